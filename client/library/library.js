@@ -0,0 +1,164 @@
+/*******************************************************
+ * library.js
+ *
+ * Page logic for the Library page.
+ * Responsible for:
+ * - Loading the catalog from the API one page at a time
+ * - Rendering book cards as each page arrives
+ * - Loading the next page when the user scrolls near the end
+ * - Showing the reader's recommendations above the catalog
+ *******************************************************/
+
+// Number of books requested per page
+const PAGE_SIZE = 24;
+
+// Width (CSS px) of a cover in the grid (.cover in library.css)
+const COVER_WIDTH = 120;
+
+// Books on the "Readers like you also read" shelf
+const SHELF_SIZE = 6;
+
+// Media manifest from the server (stored path -> cacheable URLs)
+let media = {};
+
+/**
+ * coverUrl
+ * --------
+ * Turns a cover path stored in the DB (e.g. "images\books\mobyDick.jpg")
+ * into a URL: a grid-sized thumbnail from the server when it has one,
+ * otherwise the file relative to this page.
+ */
+function coverUrl(path) {
+  if (!path) return '';
+  if (/^https?:\/\//.test(path)) return path;
+  return BookClubApi.mediaUrl(media, path, COVER_WIDTH) || `../${path.replace(/\\/g, '/')}`;
+}
+
+/**
+ * createBookCard
+ * --------------
+ * Builds the same markup as the static cards in library.html.
+ *
+ * @param {object} book - One item from GET /api/books
+ * @returns {HTMLAnchorElement}
+ */
+function createBookCard(book) {
+  const link = document.createElement('a');
+  link.className = 'book-link';
+  link.href = `../book/book.html?id=${book.book_id}`;
+
+  link.innerHTML = `
+    <article class="book-card">
+      <div class="cover-wrap"><img class="cover" loading="lazy" alt="Book cover"></div>
+      <div class="info">
+        <h3 class="title"></h3>
+        <p class="author"></p>
+        <div class="meta">
+          <svg class="bookmark" viewBox="0 0 24 24" aria-hidden="true">
+            <path d="M6 2h12a1 1 0 0 1 1 1v19l-7-4-7 4V3a1 1 0 0 1 1-1z"></path>
+          </svg>
+          <span class="price"></span>
+        </div>
+      </div>
+    </article>`;
+
+  // Use textContent so titles are never interpreted as HTML
+  link.querySelector('.cover').src = coverUrl(book.cover_image);
+  link.querySelector('.title').textContent = book.title;
+  link.querySelector('.author').textContent = book.author;
+  link.querySelector('.price').textContent = book.bookmark_price;
+
+  return link;
+}
+
+/**
+ * loadRecommendations
+ * -------------------
+ * Fills the "Readers like you also read" shelf. It stays hidden for
+ * guests, for readers without ratings or purchases, and on errors.
+ */
+async function loadRecommendations() {
+  const shelf = document.getElementById('recommended');
+  if (!shelf) return;
+
+  try {
+    const books = await BookClubApi.fetchRecommendations(SHELF_SIZE);
+    if (!books.length) return;
+
+    const grid = shelf.querySelector('.books-grid');
+    books.forEach((book) => grid.appendChild(createBookCard(book)));
+    shelf.classList.remove('hidden');
+  } catch (err) {
+    console.warn(err);
+  }
+}
+
+/**
+ * loadLibrary
+ * -----------
+ * Streams the catalog into the grid. The next page is only requested
+ * once the sentinel below the grid scrolls into view.
+ */
+async function loadLibrary() {
+  const grid = document.getElementById('catalog-grid');
+  if (!grid || !window.BookClubApi) return;
+
+  const q = new URLSearchParams(window.location.search).get('q') || undefined;
+  media = await BookClubApi.loadMediaManifest();
+  if (!q) loadRecommendations();
+  const pages = BookClubApi.streamBooks({ q, limit: PAGE_SIZE, sort: 'title' });
+
+  // Sentinel element: when it becomes visible we fetch another page
+  const sentinel = document.createElement('div');
+  grid.after(sentinel);
+
+  let firstPage = true;
+  let loading = false;
+
+  async function loadNextPage() {
+    if (loading) return;
+    loading = true;
+
+    try {
+      const { value: books, done } = await pages.next();
+
+      if (done) {
+        observer.disconnect();
+        sentinel.remove();
+        return;
+      }
+
+      // The static cards are only a placeholder until the API answers
+      if (firstPage) {
+        grid.innerHTML = '';
+        firstPage = false;
+      }
+
+      books.forEach((book) => grid.appendChild(createBookCard(book)));
+    } catch (err) {
+      // Keep the static cards if the server is not running
+      console.warn(err);
+      observer.disconnect();
+      return;
+    } finally {
+      loading = false;
+    }
+
+    // The observer only fires on changes, so keep going while the
+    // sentinel is still on screen (e.g. short pages on a tall window)
+    if (sentinel.isConnected &&
+        sentinel.getBoundingClientRect().top < window.innerHeight + 400) {
+      loadNextPage();
+    }
+  }
+
+  const observer = new IntersectionObserver((entries) => {
+    if (entries.some((entry) => entry.isIntersecting)) {
+      loadNextPage();
+    }
+  }, { rootMargin: '400px' });
+
+  observer.observe(sentinel);
+}
+
+document.addEventListener('DOMContentLoaded', loadLibrary);
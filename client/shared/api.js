@@ -0,0 +1,242 @@
+/*******************************************************
+ * api.js
+ *
+ * Small client for the Book Club API.
+ * Responsible for:
+ * - Knowing where the backend lives
+ * - Fetching the book catalog one page at a time
+ * - Ranked full-text search for the search bar
+ * - Batch lookups and writes (one request for many books)
+ * - Similar books and the reader's recommendations
+ * - Cacheable URLs for covers and their thumbnails
+ *******************************************************/
+
+// Base URL of the FastAPI server (see server/README.md)
+const API_BASE_URL = 'http://127.0.0.1:8000';
+
+// Fields needed to draw a book card (no summary / pdf_url in list views)
+const CARD_FIELDS = 'book_id,title,author,bookmark_price,cover_image';
+
+/**
+ * fetchBooksPage
+ * --------------
+ * Requests ONE page of books from GET /api/books.
+ *
+ * @param {object} options
+ * @param {string} [options.q]       - search text
+ * @param {number} [options.limit]   - page size
+ * @param {string} [options.cursor]  - next_cursor from the previous page
+ * @param {string} [options.sort]    - 'book_id' or 'title'
+ * @param {string} [options.fields]  - comma-separated projection
+ * @returns {Promise<{items: object[], next_cursor: string|null}>}
+ */
+async function fetchBooksPage({ q, limit = 50, cursor, sort, fields = CARD_FIELDS } = {}) {
+  const params = new URLSearchParams({ limit: String(limit) });
+  if (q) params.set('q', q);
+  if (cursor) params.set('cursor', cursor);
+  if (sort) params.set('sort', sort);
+  if (fields) params.set('fields', fields);
+
+  const response = await fetch(`${API_BASE_URL}/api/books?${params}`, {
+    credentials: 'include' // send the session cookie for per-user data
+  });
+
+  if (!response.ok) {
+    throw new Error(`Failed to load books (${response.status})`);
+  }
+
+  return response.json();
+}
+
+/**
+ * streamBooks
+ * -----------
+ * Async generator that walks the whole catalog page by page.
+ * Each step yields the books of one page, so callers can render
+ * as pages arrive instead of waiting for the full catalog.
+ *
+ * Example:
+ *   for await (const page of BookClubApi.streamBooks({ sort: 'title' })) {
+ *     renderCards(page);
+ *   }
+ */
+async function* streamBooks(options = {}) {
+  let cursor = null;
+
+  do {
+    const page = await fetchBooksPage({ ...options, cursor });
+    yield page.items;
+    cursor = page.next_cursor;
+  } while (cursor);
+}
+
+/**
+ * searchBooks
+ * -----------
+ * Ranked full-text search (GET /api/books/search).
+ * Every word is matched as a prefix, so it works while the user types.
+ *
+ * @param {string} q       - search text
+ * @param {number} [limit] - maximum number of results
+ * @returns {Promise<object[]>} best matches first
+ */
+async function searchBooks(q, limit = 8) {
+  const params = new URLSearchParams({ q, limit: String(limit) });
+  const response = await fetch(`${API_BASE_URL}/api/books/search?${params}`);
+
+  if (!response.ok) {
+    throw new Error(`Search failed (${response.status})`);
+  }
+
+  return response.json();
+}
+
+/**
+ * postJson
+ * --------
+ * POSTs a JSON body with the session cookie and returns the parsed reply.
+ */
+async function postJson(path, body) {
+  const response = await fetch(`${API_BASE_URL}${path}`, {
+    method: 'POST',
+    credentials: 'include',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(body)
+  });
+
+  if (!response.ok) {
+    throw new Error(`Request to ${path} failed (${response.status})`);
+  }
+
+  return response.json();
+}
+
+/**
+ * fetchBooksByIds
+ * ---------------
+ * Loads several books in one request (POST /api/books/batch),
+ * e.g. to render a shelf. At most 200 ids per call.
+ *
+ * @param {number[]} bookIds
+ * @returns {Promise<{items: object[], not_found: number[]}>}
+ */
+function fetchBooksByIds(bookIds) {
+  return postJson('/api/books/batch', { book_ids: bookIds });
+}
+
+/**
+ * rateBooks
+ * ---------
+ * Saves several ratings in one request (POST /api/books/ratings:batch),
+ * e.g. ratings made while offline.
+ *
+ * @param {{book_id: number, stars: number}[]} ratings
+ * @returns {Promise<{results: {book_id: number, status: number}[]}>}
+ *          one result per rating; status 200 = saved, 404 = unknown book
+ */
+function rateBooks(ratings) {
+  return postJson('/api/books/ratings:batch', { ratings });
+}
+
+/**
+ * fetchSimilarBooks
+ * -----------------
+ * "Readers of this also read": GET /api/books/{id}/similar.
+ *
+ * @param {number} bookId
+ * @param {number} [limit]
+ * @returns {Promise<object[]>} most similar first (empty until the
+ *          server has built its similar book lists)
+ */
+async function fetchSimilarBooks(bookId, limit = 10) {
+  const params = new URLSearchParams({ limit: String(limit) });
+  const response = await fetch(`${API_BASE_URL}/api/books/${bookId}/similar?${params}`);
+
+  if (!response.ok) {
+    throw new Error(`Failed to load similar books (${response.status})`);
+  }
+
+  return response.json();
+}
+
+/**
+ * fetchRecommendations
+ * --------------------
+ * Books for the logged-in reader: GET /api/me/recommendations.
+ *
+ * @param {number} [limit]
+ * @returns {Promise<object[]>} best first; empty for guests and for
+ *          readers who haven't rated or bought anything yet
+ */
+async function fetchRecommendations(limit = 10) {
+  const params = new URLSearchParams({ limit: String(limit) });
+  const response = await fetch(`${API_BASE_URL}/api/me/recommendations?${params}`, {
+    credentials: 'include'
+  });
+
+  if (response.status === 401) return [];
+  if (!response.ok) {
+    throw new Error(`Failed to load recommendations (${response.status})`);
+  }
+
+  return response.json();
+}
+
+// The media manifest, loaded once per page
+let mediaManifest = null;
+
+/**
+ * loadMediaManifest
+ * -----------------
+ * Loads GET /media/manifest: for every stored cover path, its
+ * content-hashed URL (cached by the browser for good) and thumbnails.
+ *
+ * @returns {Promise<object>} path -> {url, thumbnails: {width: url}}
+ */
+function loadMediaManifest() {
+  if (!mediaManifest) {
+    mediaManifest = fetch(`${API_BASE_URL}/media/manifest`)
+      .then((response) => (response.ok ? response.json() : {}))
+      .catch(() => ({}));
+  }
+  return mediaManifest;
+}
+
+/**
+ * mediaUrl
+ * --------
+ * The URL to load a stored media path (e.g. "images\books\mobyDick.jpg")
+ * from, preferring the smallest thumbnail at least `width` pixels wide.
+ *
+ * @param {object} manifest - from loadMediaManifest()
+ * @param {string} path     - path as stored in the database
+ * @param {number} [width]  - displayed width in CSS pixels
+ * @returns {string|null} absolute URL, or null if the server doesn't know the file
+ */
+function mediaUrl(manifest, path, width) {
+  const entry = manifest[path.replace(/\\/g, '/')];
+  if (!entry) return null;
+
+  if (width && entry.thumbnails) {
+    const wanted = width * (window.devicePixelRatio || 1);
+    const widths = Object.keys(entry.thumbnails).map(Number).sort((a, b) => a - b);
+    const best = widths.find((w) => w >= wanted);
+    // Larger than every thumbnail: the original is the sharpest we have
+    if (best) return `${API_BASE_URL}${entry.thumbnails[best]}`;
+  }
+  return `${API_BASE_URL}${entry.url}`;
+}
+
+// Expose the API helpers to the global scope
+window.BookClubApi = {
+  API_BASE_URL,
+  fetchBooksPage,
+  streamBooks,
+  searchBooks,
+  fetchBooksByIds,
+  rateBooks,
+  fetchSimilarBooks,
+  fetchRecommendations,
+  loadMediaManifest,
+  mediaUrl
+};
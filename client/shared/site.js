@@ -26,15 +26,28 @@ if (isLoggedIn) {
 }
 
 // -------------------------
-// SEARCH: Autocomplete dropdown (demo data)
+// SEARCH: Autocomplete dropdown (API data)
 // -------------------------
 
-// Temporary book list (until we have DB/API).
-// Each book should have a title and a link to its book page.
-const BOOKS = BookData.getAllBooks().map((b) => ({
-  id: b.id,
-  title: b.title,
-}));
+// Suggestions come from GET /api/books/search (see shared/api.js),
+// which returns the best matches first.
+const SUGGESTION_LIMIT = 8;
+
+// Incremented on every keystroke so late answers for old text are ignored.
+let searchSeq = 0;
+
+// Fetch the books matching the search text.
+// Each result has an id and a title (used for the link to its book page).
+async function findMatches(q) {
+  if (!window.BookClubApi) return [];
+
+  const results = await BookClubApi.searchBooks(q, SUGGESTION_LIMIT);
+
+  return results.map((b) => ({
+    id: b.book_id,
+    title: b.title,
+  }));
+}
 
 
 
@@ -101,8 +114,9 @@ function renderSuggestions(matches) {
 }
 
 // 1) Input event: update suggestions on every keystroke.
-searchInput.addEventListener('input', () => {
-  const q = searchInput.value.trim().toLowerCase();
+searchInput.addEventListener('input', async () => {
+  const q = searchInput.value.trim();
+  const seq = ++searchSeq;
 
   // If the input is empty, close the dropdown (polish).
   if (q === '') {
@@ -110,10 +124,16 @@ searchInput.addEventListener('input', () => {
     return;
   }
 
-  // Filter by "startsWith" so results must begin with the typed text.
-  const matches = BOOKS.filter((b) =>
-    b.title.toLowerCase().startsWith(q)
-  );
+  let matches;
+  try {
+    matches = await findMatches(q);
+  } catch (err) {
+    console.warn(err);
+    matches = [];
+  }
+
+  // The user kept typing while we waited; a newer request will render.
+  if (seq !== searchSeq) return;
 
   renderSuggestions(matches);
 });
@@ -0,0 +1,364 @@
+-- Book Club database schema (migration 7).
+-- Generated from the models by `python manage.py dump-schema`; don't edit by hand.
+
+CREATE TABLE "Users" (
+	user_id INTEGER NOT NULL,
+	name TEXT NOT NULL,
+	email TEXT NOT NULL,
+	password_hash TEXT NOT NULL,
+	bookmark_count INTEGER NOT NULL,
+	PRIMARY KEY (user_id),
+	UNIQUE (email)
+);
+
+CREATE TABLE "Books" (
+	book_id INTEGER NOT NULL,
+	title TEXT NOT NULL,
+	author TEXT NOT NULL,
+	release_year INTEGER,
+	summary TEXT,
+	bookmark_price INTEGER NOT NULL,
+	cover_image TEXT,
+	pdf_url TEXT,
+	PRIMARY KEY (book_id)
+);
+
+CREATE INDEX "ix_Books_title" ON "Books" (title);
+
+CREATE TABLE "ResourceVersions" (
+	resource TEXT NOT NULL,
+	version INTEGER NOT NULL,
+	updated_at INTEGER NOT NULL,
+	PRIMARY KEY (resource)
+);
+
+CREATE TABLE "BookNeighborQueue" (
+	book_id INTEGER NOT NULL,
+	changes INTEGER NOT NULL,
+	PRIMARY KEY (book_id)
+);
+
+CREATE TABLE "PopularityEvents" (
+	event_id INTEGER NOT NULL,
+	book_id INTEGER NOT NULL,
+	kind TEXT NOT NULL,
+	created_at INTEGER NOT NULL,
+	PRIMARY KEY (event_id)
+);
+
+CREATE TABLE "PopularitySnapshot" (
+	snapshot_id INTEGER NOT NULL,
+	event_id INTEGER NOT NULL,
+	purged_through INTEGER NOT NULL,
+	taken_at INTEGER NOT NULL,
+	PRIMARY KEY (snapshot_id)
+);
+
+CREATE TABLE "SchemaMigrations" (
+	version INTEGER NOT NULL,
+	name TEXT NOT NULL,
+	applied_at INTEGER NOT NULL,
+	PRIMARY KEY (version)
+);
+
+CREATE TABLE "Groups" (
+	group_id INTEGER NOT NULL,
+	name TEXT NOT NULL,
+	cover_image TEXT,
+	current_book_id INTEGER,
+	created_at TEXT NOT NULL,
+	member_count INTEGER DEFAULT 0 NOT NULL,
+	PRIMARY KEY (group_id),
+	FOREIGN KEY(current_book_id) REFERENCES "Books" (book_id)
+);
+
+CREATE INDEX "ix_Groups_current_book_id" ON "Groups" (current_book_id);
+
+CREATE TABLE "BookRatings" (
+	user_id INTEGER NOT NULL,
+	book_id INTEGER NOT NULL,
+	stars INTEGER NOT NULL,
+	PRIMARY KEY (user_id, book_id),
+	CONSTRAINT check_stars_range CHECK (stars BETWEEN 1 AND 5),
+	FOREIGN KEY(user_id) REFERENCES "Users" (user_id),
+	FOREIGN KEY(book_id) REFERENCES "Books" (book_id)
+);
+
+CREATE INDEX "ix_BookRatings_book_id_stars" ON "BookRatings" (book_id, stars);
+
+CREATE TABLE "BookRatingStats" (
+	book_id INTEGER NOT NULL,
+	rating_sum INTEGER NOT NULL,
+	rating_count INTEGER NOT NULL,
+	PRIMARY KEY (book_id),
+	FOREIGN KEY(book_id) REFERENCES "Books" (book_id)
+);
+
+CREATE INDEX "ix_BookRatingStats_average_rating" ON "BookRatingStats" (CAST(rating_sum AS FLOAT) / (rating_count + 0.0));
+
+CREATE TABLE "BookComments" (
+	comment_id INTEGER NOT NULL,
+	book_id INTEGER NOT NULL,
+	user_id INTEGER NOT NULL,
+	content TEXT NOT NULL,
+	created_at DATETIME,
+	PRIMARY KEY (comment_id),
+	FOREIGN KEY(book_id) REFERENCES "Books" (book_id),
+	FOREIGN KEY(user_id) REFERENCES "Users" (user_id)
+);
+
+CREATE INDEX "ix_BookComments_book_id_comment_time" ON "BookComments" (book_id, coalesce(created_at, '1970-01-01 00:00:00.000000'));
+
+CREATE TABLE "UserBooksRead" (
+	user_id INTEGER NOT NULL,
+	book_id INTEGER NOT NULL,
+	PRIMARY KEY (user_id, book_id),
+	FOREIGN KEY(user_id) REFERENCES "Users" (user_id),
+	FOREIGN KEY(book_id) REFERENCES "Books" (book_id)
+);
+
+CREATE TABLE "IdempotencyKeys" (
+	user_id INTEGER NOT NULL,
+	"key" TEXT NOT NULL,
+	request_path TEXT NOT NULL,
+	status_code INTEGER NOT NULL,
+	response_body TEXT NOT NULL,
+	created_at DATETIME NOT NULL,
+	PRIMARY KEY (user_id, "key"),
+	FOREIGN KEY(user_id) REFERENCES "Users" (user_id)
+);
+
+CREATE INDEX "ix_IdempotencyKeys_created_at" ON "IdempotencyKeys" (created_at);
+
+CREATE TABLE "BookNeighbors" (
+	book_id INTEGER NOT NULL,
+	rank INTEGER NOT NULL,
+	neighbor_id INTEGER NOT NULL,
+	score FLOAT NOT NULL,
+	PRIMARY KEY (book_id, rank),
+	FOREIGN KEY(book_id) REFERENCES "Books" (book_id),
+	FOREIGN KEY(neighbor_id) REFERENCES "Books" (book_id)
+);
+
+CREATE INDEX "ix_BookNeighbors_neighbor_id" ON "BookNeighbors" (neighbor_id);
+
+CREATE TABLE "BookPopularity" (
+	book_id INTEGER NOT NULL,
+	trending FLOAT,
+	purchases INTEGER NOT NULL,
+	PRIMARY KEY (book_id),
+	FOREIGN KEY(book_id) REFERENCES "Books" (book_id)
+);
+
+CREATE TABLE "UserGroups" (
+	user_id INTEGER NOT NULL,
+	group_id INTEGER NOT NULL,
+	PRIMARY KEY (user_id, group_id),
+	FOREIGN KEY(user_id) REFERENCES "Users" (user_id),
+	FOREIGN KEY(group_id) REFERENCES "Groups" (group_id)
+);
+
+CREATE INDEX "ix_UserGroups_group_id_user_id" ON "UserGroups" (group_id, user_id);
+
+CREATE TABLE "GroupReadingHistory" (
+	group_id INTEGER NOT NULL,
+	book_id INTEGER NOT NULL,
+	PRIMARY KEY (group_id, book_id),
+	FOREIGN KEY(group_id) REFERENCES "Groups" (group_id),
+	FOREIGN KEY(book_id) REFERENCES "Books" (book_id)
+);
+
+CREATE INDEX "ix_GroupReadingHistory_book_id" ON "GroupReadingHistory" (book_id);
+
+CREATE TABLE "GroupPosts" (
+	post_id INTEGER NOT NULL,
+	group_id INTEGER NOT NULL,
+	book_id INTEGER,
+	user_id INTEGER NOT NULL,
+	content TEXT NOT NULL,
+	PRIMARY KEY (post_id),
+	FOREIGN KEY(group_id) REFERENCES "Groups" (group_id),
+	FOREIGN KEY(book_id) REFERENCES "Books" (book_id),
+	FOREIGN KEY(user_id) REFERENCES "Users" (user_id)
+);
+
+CREATE INDEX "ix_GroupPosts_group_id_post_id" ON "GroupPosts" (group_id, post_id);
+
+CREATE VIRTUAL TABLE BooksSearch USING fts5(
+        title, author, summary,
+        content='Books', content_rowid='book_id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    );
+
+CREATE TRIGGER Books_search_insert AFTER INSERT ON Books BEGIN
+        INSERT INTO BooksSearch(rowid, title, author, summary)
+        VALUES (new.book_id, new.title, new.author, new.summary);
+    END;
+
+CREATE TRIGGER Books_search_delete AFTER DELETE ON Books BEGIN
+        INSERT INTO BooksSearch(BooksSearch, rowid, title, author, summary)
+        VALUES ('delete', old.book_id, old.title, old.author, old.summary);
+    END;
+
+CREATE TRIGGER Books_search_update AFTER UPDATE OF title, author, summary ON Books BEGIN
+        INSERT INTO BooksSearch(BooksSearch, rowid, title, author, summary)
+        VALUES ('delete', old.book_id, old.title, old.author, old.summary);
+        INSERT INTO BooksSearch(rowid, title, author, summary)
+        VALUES (new.book_id, new.title, new.author, new.summary);
+    END;
+
+CREATE TRIGGER Books_version_insert AFTER INSERT ON Books BEGIN
+        INSERT INTO ResourceVersions(resource, version, updated_at)
+        VALUES ('catalog', 1, CAST(strftime('%s', 'now') AS INTEGER))
+        ON CONFLICT(resource) DO UPDATE SET
+            version = version + 1,
+            updated_at = excluded.updated_at;
+    END;
+
+CREATE TRIGGER Books_version_update AFTER UPDATE ON Books BEGIN
+        INSERT INTO ResourceVersions(resource, version, updated_at)
+        VALUES ('catalog', 1, CAST(strftime('%s', 'now') AS INTEGER))
+        ON CONFLICT(resource) DO UPDATE SET
+            version = version + 1,
+            updated_at = excluded.updated_at;
+    END;
+
+CREATE TRIGGER Books_version_delete AFTER DELETE ON Books BEGIN
+        INSERT INTO ResourceVersions(resource, version, updated_at)
+        VALUES ('catalog', 1, CAST(strftime('%s', 'now') AS INTEGER))
+        ON CONFLICT(resource) DO UPDATE SET
+            version = version + 1,
+            updated_at = excluded.updated_at;
+    END;
+
+CREATE TRIGGER BookRatingStats_version_insert AFTER INSERT ON BookRatingStats BEGIN
+        INSERT INTO ResourceVersions(resource, version, updated_at)
+        VALUES ('catalog', 1, CAST(strftime('%s', 'now') AS INTEGER))
+        ON CONFLICT(resource) DO UPDATE SET
+            version = version + 1,
+            updated_at = excluded.updated_at;
+    END;
+
+CREATE TRIGGER BookRatingStats_version_update AFTER UPDATE ON BookRatingStats BEGIN
+        INSERT INTO ResourceVersions(resource, version, updated_at)
+        VALUES ('catalog', 1, CAST(strftime('%s', 'now') AS INTEGER))
+        ON CONFLICT(resource) DO UPDATE SET
+            version = version + 1,
+            updated_at = excluded.updated_at;
+    END;
+
+CREATE TRIGGER BookRatingStats_version_delete AFTER DELETE ON BookRatingStats BEGIN
+        INSERT INTO ResourceVersions(resource, version, updated_at)
+        VALUES ('catalog', 1, CAST(strftime('%s', 'now') AS INTEGER))
+        ON CONFLICT(resource) DO UPDATE SET
+            version = version + 1,
+            updated_at = excluded.updated_at;
+    END;
+
+CREATE TRIGGER BookRatings_version_insert AFTER INSERT ON BookRatings BEGIN
+        INSERT INTO ResourceVersions(resource, version, updated_at)
+        VALUES ('user:' || new.user_id, 1, CAST(strftime('%s', 'now') AS INTEGER))
+        ON CONFLICT(resource) DO UPDATE SET
+            version = version + 1,
+            updated_at = excluded.updated_at;
+    END;
+
+CREATE TRIGGER BookRatings_version_update AFTER UPDATE ON BookRatings BEGIN
+        INSERT INTO ResourceVersions(resource, version, updated_at)
+        VALUES ('user:' || new.user_id, 1, CAST(strftime('%s', 'now') AS INTEGER))
+        ON CONFLICT(resource) DO UPDATE SET
+            version = version + 1,
+            updated_at = excluded.updated_at;
+    END;
+
+CREATE TRIGGER BookRatings_version_delete AFTER DELETE ON BookRatings BEGIN
+        INSERT INTO ResourceVersions(resource, version, updated_at)
+        VALUES ('user:' || old.user_id, 1, CAST(strftime('%s', 'now') AS INTEGER))
+        ON CONFLICT(resource) DO UPDATE SET
+            version = version + 1,
+            updated_at = excluded.updated_at;
+    END;
+
+CREATE TRIGGER UserBooksRead_version_insert AFTER INSERT ON UserBooksRead BEGIN
+        INSERT INTO ResourceVersions(resource, version, updated_at)
+        VALUES ('user:' || new.user_id, 1, CAST(strftime('%s', 'now') AS INTEGER))
+        ON CONFLICT(resource) DO UPDATE SET
+            version = version + 1,
+            updated_at = excluded.updated_at;
+    END;
+
+CREATE TRIGGER UserBooksRead_version_delete AFTER DELETE ON UserBooksRead BEGIN
+        INSERT INTO ResourceVersions(resource, version, updated_at)
+        VALUES ('user:' || old.user_id, 1, CAST(strftime('%s', 'now') AS INTEGER))
+        ON CONFLICT(resource) DO UPDATE SET
+            version = version + 1,
+            updated_at = excluded.updated_at;
+    END;
+
+CREATE TRIGGER BookRatings_neighbors_insert AFTER INSERT ON BookRatings BEGIN
+        INSERT INTO BookNeighborQueue(book_id, changes) VALUES (new.book_id, 1)
+        ON CONFLICT(book_id) DO UPDATE SET changes = changes + 1;
+    END;
+
+CREATE TRIGGER BookRatings_neighbors_update AFTER UPDATE ON BookRatings BEGIN
+        INSERT INTO BookNeighborQueue(book_id, changes) VALUES (old.book_id, 1)
+        ON CONFLICT(book_id) DO UPDATE SET changes = changes + 1;
+        INSERT INTO BookNeighborQueue(book_id, changes) VALUES (new.book_id, 1)
+        ON CONFLICT(book_id) DO UPDATE SET changes = changes + 1;
+    END;
+
+CREATE TRIGGER BookRatings_neighbors_delete AFTER DELETE ON BookRatings BEGIN
+        INSERT INTO BookNeighborQueue(book_id, changes) VALUES (old.book_id, 1)
+        ON CONFLICT(book_id) DO UPDATE SET changes = changes + 1;
+    END;
+
+CREATE TRIGGER UserBooksRead_neighbors_insert AFTER INSERT ON UserBooksRead BEGIN
+        INSERT INTO BookNeighborQueue(book_id, changes) VALUES (new.book_id, 1)
+        ON CONFLICT(book_id) DO UPDATE SET changes = changes + 1;
+    END;
+
+CREATE TRIGGER UserBooksRead_neighbors_delete AFTER DELETE ON UserBooksRead BEGIN
+        INSERT INTO BookNeighborQueue(book_id, changes) VALUES (old.book_id, 1)
+        ON CONFLICT(book_id) DO UPDATE SET changes = changes + 1;
+    END;
+
+CREATE TRIGGER GroupReadingHistory_neighbors_insert AFTER INSERT ON GroupReadingHistory BEGIN
+        INSERT INTO BookNeighborQueue(book_id, changes) VALUES (new.book_id, 1)
+        ON CONFLICT(book_id) DO UPDATE SET changes = changes + 1;
+    END;
+
+CREATE TRIGGER GroupReadingHistory_neighbors_delete AFTER DELETE ON GroupReadingHistory BEGIN
+        INSERT INTO BookNeighborQueue(book_id, changes) VALUES (old.book_id, 1)
+        ON CONFLICT(book_id) DO UPDATE SET changes = changes + 1;
+    END;
+
+CREATE TRIGGER UserBooksRead_popularity_insert AFTER INSERT ON UserBooksRead BEGIN
+        INSERT INTO PopularityEvents(book_id, kind, created_at)
+        VALUES (new.book_id, 'purchase', CAST(strftime('%s', 'now') AS INTEGER));
+    END;
+
+CREATE TRIGGER UserBooksRead_popularity_delete AFTER DELETE ON UserBooksRead BEGIN
+        INSERT INTO PopularityEvents(book_id, kind, created_at)
+        VALUES (old.book_id, 'refund', CAST(strftime('%s', 'now') AS INTEGER));
+    END;
+
+CREATE TRIGGER BookRatings_popularity_insert AFTER INSERT ON BookRatings BEGIN
+        INSERT INTO PopularityEvents(book_id, kind, created_at)
+        VALUES (new.book_id, 'rating', CAST(strftime('%s', 'now') AS INTEGER));
+    END;
+
+CREATE TRIGGER BookRatings_popularity_update AFTER UPDATE ON BookRatings BEGIN
+        INSERT INTO PopularityEvents(book_id, kind, created_at)
+        VALUES (new.book_id, 'rating_change', CAST(strftime('%s', 'now') AS INTEGER));
+    END;
+
+CREATE TRIGGER BookRatings_popularity_delete AFTER DELETE ON BookRatings BEGIN
+        INSERT INTO PopularityEvents(book_id, kind, created_at)
+        VALUES (old.book_id, 'rating_change', CAST(strftime('%s', 'now') AS INTEGER));
+    END;
+
+CREATE TRIGGER BookComments_popularity_insert AFTER INSERT ON BookComments BEGIN
+        INSERT INTO PopularityEvents(book_id, kind, created_at)
+        VALUES (new.book_id, 'comment', CAST(strftime('%s', 'now') AS INTEGER));
+    END;
@@ -2,23 +2,37 @@
 Authentication utilities for password hashing and session management.
 """
 
+import asyncio
+import threading
+import time
 import bcrypt
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from typing import Optional
 from fastapi import Request, HTTPException, status
+from config import settings
+from database import LAST_WRITE_KEY
+from metrics import time_password_hash
+from schemas import UserResponse
+from sessions import ROTATE_SESSION_KEY
 
+# Session keys holding the cached UserResponse and when it was cached
+USER_CACHE_KEY = "user"
+USER_CACHED_AT_KEY = "user_cached_at"
 
-def hash_password(password: str) -> str:
+
+def hash_password(password: str, rounds: Optional[int] = None) -> str:
     """
     Hash a password using bcrypt.
 
     Args:
         password: Plain text password
+        rounds: bcrypt cost factor (defaults to settings.BCRYPT_ROUNDS)
 
     Returns:
         Hashed password as a string
     """
     # Generate a salt and hash the password
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=rounds or settings.BCRYPT_ROUNDS)
     hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
     return hashed.decode('utf-8')
 
@@ -40,15 +54,151 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     )
 
 
-def create_session(request: Request, user_id: int):
+def needs_rehash(hashed_password: str) -> bool:
+    """
+    Check whether a stored hash uses a different cost than BCRYPT_ROUNDS.
+
+    Args:
+        hashed_password: Hashed password from database ("$2b$12$...")
+
+    Returns:
+        True if the password should be hashed again
+    """
+    try:
+        rounds = int(hashed_password.split("$")[2])
+    except (IndexError, ValueError):
+        return False
+    return rounds != settings.BCRYPT_ROUNDS
+
+
+# ============================================================================
+# Password hashing pool
+# ============================================================================
+
+# bcrypt is deliberately slow, so it runs on its own small executor instead
+# of the threadpool that serves every other request. A login burst then
+# queues here (up to PASSWORD_HASH_MAX_PENDING jobs) and is shed with 503
+# beyond that, while catalog requests keep being served.
+_password_executor: Optional[Executor] = None
+_password_slots = threading.BoundedSemaphore(settings.PASSWORD_HASH_MAX_PENDING)
+_password_executor_lock = threading.Lock()
+
+
+def _get_password_executor() -> Executor:
+    """Create the password hashing executor on first use."""
+    global _password_executor
+    with _password_executor_lock:
+        if _password_executor is None:
+            if settings.PASSWORD_HASH_EXECUTOR == "process":
+                _password_executor = ProcessPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS)
+            else:
+                _password_executor = ThreadPoolExecutor(
+                    max_workers=settings.PASSWORD_HASH_WORKERS,
+                    thread_name_prefix="password-hash"
+                )
+        return _password_executor
+
+
+def shutdown_password_executor():
+    """Stop the password hashing executor (called on application shutdown)."""
+    global _password_executor
+    with _password_executor_lock:
+        if _password_executor is not None:
+            _password_executor.shutdown(wait=False, cancel_futures=True)
+            _password_executor = None
+
+
+async def _run_password_job(func, *args):
+    """
+    Run a bcrypt function on the password executor.
+
+    Raises:
+        HTTPException: 503 if too many password jobs are already pending
+    """
+    if not _password_slots.acquire(blocking=False):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please try again",
+            headers={"Retry-After": "1"}
+        )
+
+    try:
+        job = _get_password_executor().submit(func, *args)
+    except BaseException:
+        _password_slots.release()
+        raise
+
+    # Free the slot when the job really finishes, even if the request that
+    # started it has been cancelled in the meantime
+    job.add_done_callback(lambda _: _password_slots.release())
+    return await asyncio.wrap_future(job)
+
+
+async def hash_password_async(password: str) -> str:
+    """Hash a password on the password executor. See hash_password."""
+    with time_password_hash("hash"):
+        return await _run_password_job(hash_password, password, settings.BCRYPT_ROUNDS)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password on the password executor. See verify_password."""
+    with time_password_hash("verify"):
+        return await _run_password_job(verify_password, plain_password, hashed_password)
+
+
+def create_session(request: Request, user_id: int, user=None):
     """
     Create a user session by storing user_id in the session.
 
+    The session gets a new id (the one from before login stops working),
+    and the user's data is cached in it for /me.
+
     Args:
         request: FastAPI request object
         user_id: ID of the authenticated user
+        user: The user (model or UserResponse), to cache in the session
     """
+    request.session.clear()
     request.session["user_id"] = user_id
+    request.scope[ROTATE_SESSION_KEY] = True
+    if user is not None:
+        cache_user(request, user)
+
+
+def cache_user(request: Request, user):
+    """
+    Cache the current user's UserResponse in the session.
+
+    Args:
+        request: FastAPI request object
+        user: User model or UserResponse
+    """
+    request.session[USER_CACHE_KEY] = UserResponse.model_validate(user).model_dump()
+    request.session[USER_CACHED_AT_KEY] = time.time()
+
+
+def get_cached_user(request: Request) -> Optional[UserResponse]:
+    """
+    Get the current user from the session cache.
+
+    The cached copy is used for SESSION_USER_CACHE_SECONDS, and never
+    after the user committed a write (a purchase changes bookmark_count).
+
+    Args:
+        request: FastAPI request object
+
+    Returns:
+        The cached UserResponse, or None if there is no usable copy
+    """
+    cached = request.session.get(USER_CACHE_KEY)
+    cached_at = request.session.get(USER_CACHED_AT_KEY)
+    if cached is None or cached_at is None:
+        return None
+    if time.time() - cached_at > settings.SESSION_USER_CACHE_SECONDS:
+        return None
+    if cached_at < request.session.get(LAST_WRITE_KEY, 0):
+        return None
+    return UserResponse(**cached)
 
 
 def get_current_user_id(request: Request) -> Optional[int]:
@@ -89,6 +239,8 @@ def require_auth(request: Request) -> int:
 def destroy_session(request: Request):
     """
     Destroy the user session (logout).
+    The emptied session is deleted from the session store, so the cookie
+    can't be replayed.
 
     Args:
         request: FastAPI request object
@@ -0,0 +1 @@
+# Benchmarks for the Book Club API (run with: python -m benchmarks.<name>)
@@ -0,0 +1,177 @@
+"""
+Load test comparing the sync and async database stacks over HTTP.
+
+For each mode (ASYNC_DB=false / true) the script starts uvicorn on a fresh
+copy of the database, then keeps a fixed number of requests in flight for
+a fixed time: catalog pages, single books and comment writes from a
+logged-in user. It reports requests/second and tail latency per mode.
+
+Needs httpx (pip install httpx).
+
+Usage (from the server directory):
+    python -m benchmarks.async_load --concurrency 256 --seconds 15 --workers 1
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+import httpx
+from benchmarks.db_profiles import prepare_database
+
+PAGE_SIZE = 20
+
+
+async def wait_until_ready(base_url: str, timeout: float = 30):
+    """Poll /health until the server answers."""
+    deadline = time.perf_counter() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.perf_counter() < deadline:
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not start")
+
+
+async def run_load(base_url: str, concurrency: int, seconds: float, book_ids) -> dict:
+    """Keep `concurrency` requests in flight and collect latencies."""
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        # One user for the writes; the session cookie stays on the client
+        email = f"load{random.randrange(10**9)}@example.com"
+        response = await client.post("/api/auth/register", json={
+            "name": "Load Test", "email": email, "password": "benchmark"
+        })
+        response.raise_for_status()
+
+        requests = [
+            ("catalog_page", 85, lambda: client.get("/api/books", params={
+                "limit": PAGE_SIZE, "sort": random.choice(["book_id", "title"])
+            })),
+            ("book_detail", 10, lambda: client.get(f"/api/books/{random.choice(book_ids)}")),
+            ("add_comment", 5, lambda: client.post(
+                f"/api/books/{random.choice(book_ids)}/comments", json={"content": "Load test"}
+            )),
+        ]
+        names = [name for name, _, _ in requests]
+        weights = [weight for _, weight, _ in requests]
+        senders = {name: send for name, _, send in requests}
+
+        latencies = defaultdict(list)
+        errors = defaultdict(int)
+        deadline = time.perf_counter() + seconds
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                name = random.choices(names, weights)[0]
+                started = time.perf_counter()
+                try:
+                    response = await senders[name]()
+                    ok = response.status_code < 400
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies[name].append(time.perf_counter() - started)
+                else:
+                    errors[name] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    every = [value for values in latencies.values() for value in values]
+    return {
+        "requests_per_sec": len(every) / elapsed,
+        "errors": sum(errors.values()),
+        "operations": {
+            name: _summary(values) for name, values in latencies.items()
+        },
+        "overall": _summary(every),
+    }
+
+
+def _summary(values) -> dict:
+    """p50/p95/p99 in milliseconds."""
+    if len(values) < 2:
+        return {"count": len(values), "p50_ms": None, "p95_ms": None, "p99_ms": None}
+    cuts = statistics.quantiles(values, n=100)
+    return {
+        "count": len(values),
+        "p50_ms": statistics.median(values) * 1000,
+        "p95_ms": cuts[94] * 1000,
+        "p99_ms": cuts[98] * 1000,
+    }
+
+
+def run_mode(path: str, async_db: bool, args) -> dict:
+    """Start uvicorn for one mode, run the load and stop the server."""
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{path}",
+        ASYNC_DB=str(async_db).lower(),
+        DB_PROFILE=args.profile,
+        BCRYPT_ROUNDS="4",
+        DEBUG="false",
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+         "--port", str(args.port), "--workers", str(args.workers), "--log-level", "warning"],
+        env=env
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        asyncio.run(wait_until_ready(base_url))
+        with sqlite3.connect(path) as connection:
+            book_ids = [row[0] for row in connection.execute("SELECT book_id FROM Books")]
+        return asyncio.run(run_load(base_url, args.concurrency, args.seconds, book_ids))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def _ms(value) -> str:
+    return f"{value:.1f}" if value is not None else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default="../bookclub.db", help="database to copy for each run")
+    parser.add_argument("--books", type=int, default=5000, help="synthetic books to add")
+    parser.add_argument("--concurrency", type=int, default=256, help="requests kept in flight")
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--profile", default="production", help="DB_PROFILE for the server")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        template = os.path.join(workdir, "template.db")
+        prepare_database(args.database, template, args.books, 0)
+
+        for async_db in (False, True):
+            path = os.path.join(workdir, f"async-{async_db}.db")
+            shutil.copy(template, path)
+            results = run_mode(path, async_db, args)
+
+            print(f"\nASYNC_DB={str(async_db).lower()}: "
+                  f"{results['requests_per_sec']:.1f} req/s, {results['errors']} errors")
+            print(f"  {'request':<14}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+            rows = sorted(results["operations"].items()) + [("overall", results["overall"])]
+            for name, stats in rows:
+                print(f"  {name:<14}{stats['count']:>8}{_ms(stats['p50_ms']):>10}"
+                      f"{_ms(stats['p95_ms']):>10}{_ms(stats['p99_ms']):>10}")
+
+
+if __name__ == "__main__":
+    main()
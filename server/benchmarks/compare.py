@@ -0,0 +1,91 @@
+"""
+Compare two benchmark result files (from benchmarks.harness).
+
+Prints throughput, p95 latency and SQL per request of every operation side
+by side, and flags regressions: p95 latency or SQL per request up, or
+throughput down, by more than --threshold percent. Exits with status 1
+if any were found, so it can gate a CI job.
+
+Usage (from the server directory):
+    python -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json --threshold 10
+"""
+
+import argparse
+import json
+import sys
+from typing import List, Optional
+
+
+def _change(old: Optional[float], new: Optional[float]) -> Optional[float]:
+    """Relative change in percent (None if either side is missing)."""
+    if old is None or new is None or old == 0:
+        return None
+    return (new - old) / old * 100
+
+
+def _format(value: Optional[float], change: Optional[float]) -> str:
+    if value is None:
+        return "-"
+    return f"{value:.1f}" + (f" ({change:+.0f}%)" if change is not None else "")
+
+
+def compare(old: dict, new: dict, threshold: float) -> List[str]:
+    """Print the comparison; return the regressions found."""
+    for label, report in (("old", old), ("new", new)):
+        run = report["run"]
+        print(f"{label}: {(run.get('commit') or '?')[:10]}{' (dirty)' if run.get('dirty') else ''} "
+              f"{run.get('mode')}/{run.get('workload')} x{run.get('concurrency')} at {run.get('created_at')}")
+    if (old["run"].get("dataset") or {}) != (new["run"].get("dataset") or {}):
+        print("warning: the runs used different datasets")
+    for setting in ("mode", "workload", "concurrency", "workers", "profile", "async_db", "write_behind",
+                    "bcrypt_rounds"):
+        if old["run"].get(setting) != new["run"].get(setting):
+            print(f"warning: the runs used different {setting} settings")
+
+    print(f"\n{'operation':<14}{'req/s':>22}{'p95 ms':>22}{'SQL/req':>18}")
+    regressions = []
+    names = sorted(set(old["operations"]) | set(new["operations"])) + ["overall"]
+    for name in names:
+        before = old["overall"] if name == "overall" else old["operations"].get(name)
+        after = new["overall"] if name == "overall" else new["operations"].get(name)
+        if before is None or after is None:
+            print(f"{name:<14}  only in {'new' if before is None else 'old'}")
+            continue
+
+        rps = _change(before["requests_per_sec"], after["requests_per_sec"])
+        p95 = _change(before["p95_ms"], after["p95_ms"])
+        sql = _change(before.get("sql_per_request"), after.get("sql_per_request"))
+        print(f"{name:<14}{_format(after['requests_per_sec'], rps):>22}{_format(after['p95_ms'], p95):>22}"
+              f"{_format(after.get('sql_per_request'), sql):>18}")
+
+        if rps is not None and rps < -threshold:
+            regressions.append(f"{name}: throughput {rps:+.0f}%")
+        if p95 is not None and p95 > threshold:
+            regressions.append(f"{name}: p95 latency {p95:+.0f}%")
+        if sql is not None and sql > threshold:
+            regressions.append(f"{name}: SQL per request {sql:+.0f}%")
+
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("old", help="baseline results JSON")
+    parser.add_argument("new", help="results JSON to check")
+    parser.add_argument("--threshold", type=float, default=10, help="allowed change in percent")
+    args = parser.parse_args()
+
+    with open(args.old, encoding="utf-8") as old_file, open(args.new, encoding="utf-8") as new_file:
+        regressions = compare(json.load(old_file), json.load(new_file), args.threshold)
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over {args.threshold:.0f}%:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print("\nNo regressions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+"""
+Build a synthetic Book Club database of a chosen size.
+
+Creates a new SQLite file from the models (tables, indexes, search index
+and version triggers, exactly as init_db would) and fills it with
+generated users, books, ratings, purchases, comments, groups, members and
+posts. The same seed and sizes always give the same data, so benchmark
+runs on different commits compare like with like.
+
+Popularity is skewed the way real catalogs are: a few books get most of
+the ratings, purchases and comments, and a few groups most of the
+members. Every user's password is BENCHMARK_PASSWORD (hashed with
+BCRYPT_ROUNDS; set BCRYPT_ROUNDS=4 for quick logins) and their email is
+reader<N>@example.com, so load tests can log in as any of them.
+
+Usage (from the server directory):
+    python -m benchmarks.dataset --output /tmp/bookclub-large.db --preset large
+    python -m benchmarks.dataset --output /tmp/custom.db --books 50000 --ratings 200000 --seed 7
+"""
+
+import argparse
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Dict, Iterator, List
+from sqlalchemy import insert
+import migrations
+from auth import hash_password
+from config import settings
+from database import Base, create_db_engine
+from models import (
+    Book, BookComment, BookRating, Group, GroupPost, User, UserBooksRead, UserGroup,
+    create_search_index, create_version_triggers
+)
+
+BENCHMARK_PASSWORD = "benchmark"
+
+# Row counts per preset
+PRESETS: Dict[str, Dict[str, int]] = {
+    "small": {"users": 1_000, "books": 5_000, "ratings": 20_000, "purchases": 10_000,
+              "comments": 10_000, "groups": 100, "memberships": 3_000, "posts": 5_000},
+    "medium": {"users": 20_000, "books": 50_000, "ratings": 300_000, "purchases": 150_000,
+               "comments": 200_000, "groups": 2_000, "memberships": 60_000, "posts": 100_000},
+    "large": {"users": 100_000, "books": 250_000, "ratings": 2_000_000, "purchases": 1_000_000,
+              "comments": 1_000_000, "groups": 10_000, "memberships": 400_000, "posts": 500_000},
+}
+
+# Rows per executemany
+CHUNK_SIZE = 10_000
+
+WORDS = (
+    "river night garden winter letter silent house empty stone secret city ocean "
+    "mirror shadow forest island bridge summer glass iron crown voyage storm memory "
+    "daughter kingdom orchard harbor lantern paper wild last first quiet golden broken"
+).split()
+
+FIRST_NAMES = "Ana Ion Maria Mihai Elena Andrei Ioana Radu Clara Victor Sofia Luca".split()
+LAST_NAMES = "Popescu Ionescu Stan Dumitru Marin Tudor Lungu Barbu Rusu Munteanu".split()
+
+
+def _skewed(rng: random.Random, count: int, skew: float = 2.0) -> int:
+    """A 1-based id where low ids are much more likely (popular items)."""
+    return 1 + min(count - 1, int(count * rng.random() ** skew))
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def _chunks(rows: Iterator[dict], size: int = CHUNK_SIZE) -> Iterator[List[dict]]:
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _unique_pairs(rng: random.Random, count: int, left: int, right: int, skew_right: float) -> Iterator[tuple]:
+    """`count` distinct (left id, right id) pairs, right ids skewed to popular ones."""
+    count = min(count, left * right)
+    seen = set()
+    while len(seen) < count:
+        pair = (rng.randint(1, left), _skewed(rng, right, skew_right))
+        if pair not in seen:
+            seen.add(pair)
+            yield pair
+
+
+def generate(engine, sizes: Dict[str, int], seed: int, progress=print):
+    """
+    Fill an empty database with generated rows.
+
+    Args:
+        engine: Engine of the new database (tables already created)
+        sizes: Row counts, as in PRESETS
+        seed: Random seed; the same seed and sizes give the same data
+        progress: Called with a line of text after each table
+    """
+    sizes = dict(sizes)
+    # Everything else refers to users and books, and members/posts to groups
+    if not sizes["users"] or not sizes["books"]:
+        for name in ("ratings", "purchases", "comments", "groups"):
+            sizes[name] = 0
+    if not sizes["groups"]:
+        sizes["memberships"] = sizes["posts"] = 0
+
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    password_hash = hash_password(BENCHMARK_PASSWORD, settings.BCRYPT_ROUNDS)
+    users, books, groups = sizes["users"], sizes["books"], sizes["groups"]
+
+    def timestamp() -> datetime:
+        return start + timedelta(seconds=rng.randrange(365 * 24 * 3600))
+
+    tables = [
+        (User, ({
+            "user_id": i,
+            "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            "email": f"reader{i}@example.com",
+            "password_hash": password_hash,
+            "bookmark_count": rng.randint(0, 500),
+        } for i in range(1, users + 1)), users),
+        (Book, ({
+            "book_id": i,
+            "title": " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).title() + f" {i}",
+            "author": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            "release_year": rng.randint(1850, 2024),
+            "summary": _sentence(rng, rng.randint(20, 80)),
+            "bookmark_price": rng.randint(0, 30),
+            "cover_image": None,
+            "pdf_url": f"https://example.com/books/{i}.pdf",
+        } for i in range(1, books + 1)), books),
+        (BookRating, ({"user_id": user_id, "book_id": book_id, "stars": rng.randint(1, 5)}
+                      for user_id, book_id in _unique_pairs(rng, sizes["ratings"], users, books, 2.5)),
+         sizes["ratings"]),
+        (UserBooksRead, ({"user_id": user_id, "book_id": book_id}
+                         for user_id, book_id in _unique_pairs(rng, sizes["purchases"], users, books, 2.5)),
+         sizes["purchases"]),
+        (BookComment, ({
+            "book_id": _skewed(rng, books, 2.5),
+            "user_id": rng.randint(1, users),
+            "content": _sentence(rng, rng.randint(5, 40)),
+            "created_at": timestamp(),
+        } for _ in range(sizes["comments"])), sizes["comments"]),
+        (Group, ({
+            "group_id": i,
+            "name": f"{rng.choice(WORDS).title()} Readers {i}",
+            "current_book_id": _skewed(rng, books, 2.0),
+            "created_at": timestamp().isoformat(),
+        } for i in range(1, groups + 1)), groups),
+        (UserGroup, ({"user_id": user_id, "group_id": group_id}
+                     for user_id, group_id in _unique_pairs(rng, sizes["memberships"], users, groups, 3.0)),
+         sizes["memberships"]),
+        (GroupPost, ({
+            "group_id": _skewed(rng, groups, 3.0),
+            "user_id": rng.randint(1, users),
+            "book_id": None,
+            "content": _sentence(rng, rng.randint(5, 30)),
+        } for _ in range(sizes["posts"])), sizes["posts"]),
+    ]
+
+    for model, rows, count in tables:
+        if count <= 0:
+            continue
+        started = time.perf_counter()
+        with engine.begin() as connection:
+            for chunk in _chunks(rows):
+                connection.execute(insert(model), chunk)
+        progress(f"  {model.__tablename__:<16}{count:>10} rows in {time.perf_counter() - started:.1f} s")
+
+
+def build_database(path: str, sizes: Dict[str, int], seed: int, progress=print):
+    """
+    Create a new database at `path` with generated data.
+
+    Tables and indexes come from the models; the search index, version
+    triggers, migrations (running totals) and planner statistics are
+    added after the bulk insert (the same end state as init_db, much
+    faster than row-by-row triggers).
+    """
+    if os.path.exists(path):
+        raise FileExistsError(f"{path} already exists")
+
+    engine = create_db_engine(f"sqlite:///{path}", "default")
+    with engine.begin() as connection:
+        # Bulk load: no rollback journal needed for a file that is thrown
+        # away if this fails
+        connection.exec_driver_sql("PRAGMA journal_mode = OFF")
+        connection.exec_driver_sql("PRAGMA synchronous = OFF")
+    Base.metadata.create_all(bind=engine)
+
+    generate(engine, sizes, seed, progress)
+
+    started = time.perf_counter()
+    with engine.begin() as connection:
+        create_search_index(connection)
+        create_version_triggers(connection)
+        # Fills in the rating totals and member counts, then runs ANALYZE
+        migrations.upgrade(connection)
+    with engine.connect() as connection:
+        connection.exec_driver_sql("PRAGMA journal_mode = DELETE")
+    progress(f"  indexes, triggers and totals in {time.perf_counter() - started:.1f} s")
+    engine.dispose()
+
+    # Describe the data next to the file, for the benchmark reports
+    with open(f"{path}.json", "w", encoding="utf-8") as meta_file:
+        json.dump({"seed": seed, "sizes": sizes, "password": BENCHMARK_PASSWORD}, meta_file, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", required=True, help="path of the database to create")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="small")
+    parser.add_argument("--seed", type=int, default=1)
+    for name in PRESETS["small"]:
+        parser.add_argument(f"--{name}", type=int, help=f"number of {name} (overrides the preset)")
+    args = parser.parse_args()
+
+    sizes = {name: getattr(args, name) if getattr(args, name) is not None else count
+             for name, count in PRESETS[args.preset].items()}
+
+    started = time.perf_counter()
+    print(f"Building {args.output} (seed {args.seed}):")
+    build_database(args.output, sizes, args.seed)
+    size_mb = os.path.getsize(args.output) / (1024 * 1024)
+    print(f"Done in {time.perf_counter() - started:.1f} s, {size_mb:.1f} MB.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Compare database engine profiles under a mixed read/write workload.
+
+Each profile gets its own copy of the database. Worker threads then run
+catalog page reads alongside rate_book / add_book_comment style writes
+for a fixed time, and the script reports throughput and latency per
+operation.
+
+Usage (from the server directory):
+    python -m benchmarks.db_profiles --database ../bookclub.db --books 5000 --threads 16 --seconds 10
+"""
+
+import argparse
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from sqlalchemy import insert
+from sqlalchemy.orm import sessionmaker
+from database import SQLITE_PROFILES, Base, create_db_engine
+from models import Book, BookComment, BookRating, User
+from ratings import rebuild_rating_stats, update_rating_stats
+from routes.book_routes import _books_with_user_data
+
+PAGE_SIZE = 50
+
+
+def prepare_database(source: str, path: str, books: int, users: int):
+    """Copy the source database and pad it with synthetic books and users."""
+    shutil.copy(source, path)
+    engine = create_db_engine(f"sqlite:///{path}", "default")
+    Base.metadata.create_all(bind=engine)
+
+    with engine.begin() as connection:
+        if books:
+            connection.execute(insert(Book), [
+                {"title": f"Benchmark Book {i}", "author": f"Author {i % 500}",
+                 "summary": "Lorem ipsum " * 40, "bookmark_price": i % 20}
+                for i in range(books)
+            ])
+        if users:
+            connection.execute(insert(User), [
+                {"name": f"Reader {i}", "email": f"bench{i}@example.com",
+                 "password_hash": "x", "bookmark_count": 100}
+                for i in range(users)
+            ])
+
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        rebuild_rating_stats(db)
+        db.commit()
+    engine.dispose()
+
+
+def read_catalog(db, user_ids, book_ids):
+    """One catalog page for a random user, starting at a random book."""
+    start = random.choice(book_ids)
+    _books_with_user_data(db, random.choice(user_ids)).filter(
+        Book.book_id >= start
+    ).order_by(Book.book_id).limit(PAGE_SIZE).all()
+
+
+def rate_book(db, user_ids, book_ids):
+    """Same writes as POST /api/books/{id}/rate."""
+    user_id, book_id, stars = random.choice(user_ids), random.choice(book_ids), random.randint(1, 5)
+    existing = db.query(BookRating).filter(
+        BookRating.user_id == user_id, BookRating.book_id == book_id
+    ).first()
+    if existing:
+        update_rating_stats(db, book_id, stars - existing.stars, 0)
+        existing.stars = stars
+    else:
+        db.add(BookRating(user_id=user_id, book_id=book_id, stars=stars))
+        update_rating_stats(db, book_id, stars, 1)
+    db.commit()
+
+
+def add_comment(db, user_ids, book_ids):
+    """Same writes as POST /api/books/{id}/comments."""
+    db.add(BookComment(
+        book_id=random.choice(book_ids),
+        user_id=random.choice(user_ids),
+        content="Benchmark comment"
+    ))
+    db.commit()
+
+
+# Operation mix: (name, function, weight)
+WORKLOAD = [
+    ("read_catalog", read_catalog, 80),
+    ("rate_book", rate_book, 12),
+    ("add_comment", add_comment, 8),
+]
+
+
+def run_profile(path: str, profile: str, threads: int, seconds: float) -> dict:
+    """Run the workload against one profile and collect latencies."""
+    engine = create_db_engine(f"sqlite:///{path}", profile)
+    Session = sessionmaker(bind=engine, autoflush=False)
+
+    with Session() as db:
+        user_ids = [row[0] for row in db.query(User.user_id)]
+        book_ids = [row[0] for row in db.query(Book.book_id)]
+
+    names = [name for name, _, _ in WORKLOAD]
+    functions = {name: func for name, func, _ in WORKLOAD}
+    weights = [weight for _, _, weight in WORKLOAD]
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def worker():
+        local = defaultdict(list)
+        local_errors = defaultdict(int)
+        while time.perf_counter() < deadline:
+            name = random.choices(names, weights)[0]
+            started = time.perf_counter()
+            with Session() as db:
+                try:
+                    functions[name](db, user_ids, book_ids)
+                except Exception:
+                    db.rollback()
+                    local_errors[name] += 1
+                    continue
+            local[name].append(time.perf_counter() - started)
+        with lock:
+            for name, values in local.items():
+                latencies[name].extend(values)
+            for name, count in local_errors.items():
+                errors[name] += count
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    engine.dispose()
+
+    return {
+        name: {
+            "ops_per_sec": len(values) / seconds,
+            "p50_ms": statistics.median(values) * 1000 if values else None,
+            "p99_ms": statistics.quantiles(values, n=100)[98] * 1000 if len(values) > 1 else None,
+            "errors": errors[name],
+        }
+        for name, values in latencies.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default="../bookclub.db", help="database to copy for each run")
+    parser.add_argument("--books", type=int, default=5000, help="synthetic books to add")
+    parser.add_argument("--users", type=int, default=500, help="synthetic users to add")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--profiles", nargs="+", default=sorted(SQLITE_PROFILES))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        template = os.path.join(workdir, "template.db")
+        prepare_database(args.database, template, args.books, args.users)
+
+        for profile in args.profiles:
+            path = os.path.join(workdir, f"{profile}.db")
+            shutil.copy(template, path)
+            results = run_profile(path, profile, args.threads, args.seconds)
+
+            print(f"\nprofile: {profile}")
+            print(f"  {'operation':<14}{'ops/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+            for name, stats in sorted(results.items()):
+                p50 = f"{stats['p50_ms']:.2f}" if stats["p50_ms"] is not None else "-"
+                p99 = f"{stats['p99_ms']:.2f}" if stats["p99_ms"] is not None else "-"
+                print(f"  {name:<14}{stats['ops_per_sec']:>10.1f}{p50:>10}{p99:>10}{stats['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main()
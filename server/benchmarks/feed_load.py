@@ -0,0 +1,170 @@
+"""
+Load test for the live group feed: many idle subscribers on one process.
+
+Starts uvicorn (one worker) on a copy of the database, opens a number of
+server-sent event connections to one group's feed, and measures the
+server's memory with them open. Then writes posts and reports how long
+each takes to reach every subscriber (fan-out latency).
+
+Needs httpx (pip install httpx). Memory is read from /proc (Linux).
+
+Usage (from the server directory):
+    python -m benchmarks.feed_load --subscribers 2000 --posts 20
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Optional
+import httpx
+from benchmarks.async_load import wait_until_ready
+
+
+def server_rss_mb(pid: int) -> Optional[float]:
+    """Resident memory of a process in MB (None where /proc is missing)."""
+    try:
+        with open(f"/proc/{pid}/status") as status_file:
+            for line in status_file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+async def subscribe(client: httpx.AsyncClient, group_id: int, received: dict, stop: asyncio.Event):
+    """Follow the feed and note when each post_id arrives."""
+    async with client.stream("GET", f"/api/groups/{group_id}/feed") as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if line.startswith("id: "):
+                received[int(line[4:])].append(time.perf_counter())
+            if stop.is_set():
+                return
+
+
+async def run(base_url: str, server_pid: int, args) -> dict:
+    limits = httpx.Limits(max_connections=args.subscribers + 10, max_keepalive_connections=args.subscribers + 10)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        email = f"feed{random.randrange(10**9)}@example.com"
+        response = await client.post("/api/auth/register", json={
+            "name": "Feed Test", "email": email, "password": "benchmark"
+        })
+        response.raise_for_status()
+        group_id = (await client.post("/api/groups", json={"name": "Feed load test"})).json()["group_id"]
+
+        rss_before = server_rss_mb(server_pid)
+        received = defaultdict(list)
+        stop = asyncio.Event()
+
+        started = time.perf_counter()
+        subscribers = [
+            asyncio.create_task(subscribe(client, group_id, received, stop))
+            for _ in range(args.subscribers)
+        ]
+        while (await client.get("/health/feed")).json()["subscribers"] < args.subscribers:
+            if any(task.done() for task in subscribers):
+                raise RuntimeError("A subscriber failed to connect")
+            await asyncio.sleep(0.2)
+        connect_seconds = time.perf_counter() - started
+
+        # Let the connections sit idle for a moment, as real ones would
+        await asyncio.sleep(args.idle)
+        rss_connected = server_rss_mb(server_pid)
+
+        sent_at = {}
+        for i in range(args.posts):
+            posted = time.perf_counter()
+            response = await client.post(f"/api/groups/{group_id}/posts", json={"content": f"Post {i}"})
+            response.raise_for_status()
+            sent_at[response.json()["post_id"]] = posted
+            await asyncio.sleep(args.interval)
+
+        # Wait for every subscriber to get every post
+        deadline = time.perf_counter() + 30
+        while time.perf_counter() < deadline and any(
+            len(received[post_id]) < args.subscribers for post_id in sent_at
+        ):
+            await asyncio.sleep(0.1)
+
+        stats = (await client.get("/health/feed")).json()
+        stop.set()
+        for task in subscribers:
+            task.cancel()
+        await asyncio.gather(*subscribers, return_exceptions=True)
+
+    first, last, missing = [], [], 0
+    for post_id, posted in sent_at.items():
+        times = received[post_id]
+        missing += args.subscribers - len(times)
+        if times:
+            first.append(min(times) - posted)
+            last.append(max(times) - posted)
+
+    return {
+        "connect_seconds": connect_seconds,
+        "rss_before": rss_before,
+        "rss_connected": rss_connected,
+        "first_ms": [value * 1000 for value in first],
+        "last_ms": [value * 1000 for value in last],
+        "missing": missing,
+        "dropped": stats["dropped_slow_subscribers"],
+    }
+
+
+def _quantiles(values) -> str:
+    if not values:
+        return "-"
+    return (f"p50 {statistics.median(values):.1f} ms, "
+            f"max {max(values):.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default="../bookclub.db", help="database to copy for the run")
+    parser.add_argument("--subscribers", type=int, default=2000, help="open feed connections")
+    parser.add_argument("--posts", type=int, default=20, help="posts to fan out")
+    parser.add_argument("--interval", type=float, default=0.25, help="seconds between posts")
+    parser.add_argument("--idle", type=float, default=2, help="seconds to idle before posting")
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "feed.db")
+        shutil.copy(args.database, path)
+
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}", BCRYPT_ROUNDS="4", DEBUG="false")
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+             "--port", str(args.port), "--log-level", "warning", "--timeout-graceful-shutdown", "1"],
+            env=env
+        )
+        base_url = f"http://127.0.0.1:{args.port}"
+        try:
+            asyncio.run(wait_until_ready(base_url))
+            results = asyncio.run(run(base_url, server.pid, args))
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    print(f"{args.subscribers} subscribers connected in {results['connect_seconds']:.1f} s")
+    if results["rss_before"] is not None and results["rss_connected"] is not None:
+        grown = results["rss_connected"] - results["rss_before"]
+        print(f"server memory: {results['rss_before']:.1f} MB -> {results['rss_connected']:.1f} MB "
+              f"({grown * 1024 / args.subscribers:.1f} KB per subscriber)")
+    print(f"fan-out of {args.posts} posts:")
+    print(f"  first subscriber: {_quantiles(results['first_ms'])}")
+    print(f"  last subscriber:  {_quantiles(results['last_ms'])}")
+    print(f"  missed deliveries: {results['missing']}, dropped slow subscribers: {results['dropped']}")
+
+
+if __name__ == "__main__":
+    main()
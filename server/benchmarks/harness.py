@@ -0,0 +1,355 @@
+"""
+Benchmark harness: realistic mixed workloads against a generated database.
+
+Runs a workload (a weighted mix of catalog browsing, book pages, search,
+comments, ratings, purchases, logins and groups) from a number of virtual
+users, each logged in as its own generated reader, for a fixed time. The
+app is driven either in this process (--mode inprocess, through httpx's
+ASGI transport: no network, shows the cost of the app itself) or over
+real HTTP (--mode http, uvicorn in a subprocess with --workers).
+
+Reports throughput, p50/p95/p99 latency, errors and SQL statements per
+request for every operation (the SQL counts come from /metrics), and
+saves everything as JSON so runs on different commits can be compared
+with `python -m benchmarks.compare`.
+
+Every run works on a fresh copy of the database, so runs are repeatable.
+Build one first with benchmarks.dataset, using the same BCRYPT_ROUNDS:
+
+    BCRYPT_ROUNDS=4 python -m benchmarks.dataset --output /tmp/bench.db --preset medium
+    BCRYPT_ROUNDS=4 python -m benchmarks.harness --database /tmp/bench.db --mode http --workload mixed
+
+Needs httpx (pip install httpx).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+import httpx
+
+PAGE_SIZE = 24
+
+SEARCH_WORDS = ["river", "night", "gar", "win", "secret", "ocean", "mirr", "fore", "isla", "gold"]
+
+
+class Context:
+    """What the operations draw their ids from."""
+
+    def __init__(self, users: int, book_ids: List[int], group_ids: List[int]):
+        self.users = users
+        self.book_ids = book_ids
+        self.group_ids = group_ids
+
+    def book_id(self) -> int:
+        # Popular books get most of the traffic, like the generated data
+        return self.book_ids[min(len(self.book_ids) - 1, int(len(self.book_ids) * random.random() ** 2))]
+
+    def group_id(self) -> int:
+        return self.group_ids[min(len(self.group_ids) - 1, int(len(self.group_ids) * random.random() ** 2))]
+
+    def email(self) -> str:
+        return f"reader{random.randint(1, self.users)}@example.com"
+
+
+# Operation name -> (route template for the SQL counts, request sender,
+# status codes that count as success besides 2xx/304)
+Operation = Tuple[str, Callable[[httpx.AsyncClient, Context], "asyncio.Future"], Tuple[int, ...]]
+
+OPERATIONS: Dict[str, Operation] = {
+    "catalog_page": ("/api/books", lambda client, ctx: client.get("/api/books", params={
+        "limit": PAGE_SIZE, "sort": random.choice(["book_id", "title", "rating"])
+    }), ()),
+    "book_detail": ("/api/books/{book_id}", lambda client, ctx: client.get(
+        f"/api/books/{ctx.book_id()}"
+    ), ()),
+    "search": ("/api/books/search", lambda client, ctx: client.get("/api/books/search", params={
+        "q": random.choice(SEARCH_WORDS), "limit": 8
+    }), ()),
+    "comments": ("/api/books/{book_id}/comments", lambda client, ctx: client.get(
+        f"/api/books/{ctx.book_id()}/comments", params={"limit": 20}
+    ), ()),
+    "groups": ("/api/groups", lambda client, ctx: client.get("/api/groups", params={"limit": 20}), ()),
+    "group_posts": ("/api/groups/{group_id}/posts", lambda client, ctx: client.get(
+        f"/api/groups/{ctx.group_id()}/posts", params={"limit": 20}
+    ), ()),
+    "rate": ("/api/books/{book_id}/rate", lambda client, ctx: client.post(
+        f"/api/books/{ctx.book_id()}/rate", json={"stars": random.randint(1, 5)}
+    ), ()),
+    "comment": ("/api/books/{book_id}/comments", lambda client, ctx: client.post(
+        f"/api/books/{ctx.book_id()}/comments", json={"content": "Benchmark comment"}
+    ), ()),
+    # Already owned (409) and not enough bookmarks (400) are normal answers
+    "purchase": ("/api/books/{book_id}/purchase", lambda client, ctx: client.post(
+        f"/api/books/{ctx.book_id()}/purchase"
+    ), (400, 409)),
+    "login": ("/api/auth/login", lambda client, ctx: client.post("/api/auth/login", json={
+        "email": ctx.email(), "password": "benchmark"
+    }), ()),
+}
+
+# Workload name -> {operation: weight}
+WORKLOADS: Dict[str, Dict[str, int]] = {
+    "browse": {"catalog_page": 40, "book_detail": 30, "search": 15, "comments": 10, "groups": 5},
+    "mixed": {"catalog_page": 30, "book_detail": 20, "search": 10, "comments": 10, "groups": 4,
+              "group_posts": 4, "rate": 7, "comment": 5, "purchase": 5, "login": 5},
+    "writes": {"rate": 35, "comment": 30, "purchase": 25, "login": 10},
+    # Only the writes the write-behind queue takes (compare --write-behind)
+    "feedback": {"rate": 50, "comment": 50},
+}
+
+
+def latency_summary(values: List[float], seconds: float) -> dict:
+    """Count, throughput and p50/p95/p99 (ms) of a list of latencies."""
+    summary = {"count": len(values), "requests_per_sec": len(values) / seconds if seconds else 0.0,
+               "p50_ms": None, "p95_ms": None, "p99_ms": None}
+    if len(values) >= 2:
+        cuts = statistics.quantiles(values, n=100)
+        summary.update(p50_ms=statistics.median(values) * 1000, p95_ms=cuts[94] * 1000, p99_ms=cuts[98] * 1000)
+    return summary
+
+
+_STATEMENTS = re.compile(r'^bookclub_db_statements_per_request_(sum|count)\{route="([^"]*)"\} (\S+)$')
+
+
+async def statements_per_route(client: httpx.AsyncClient) -> Dict[str, List[float]]:
+    """route -> [statements, requests] from /metrics."""
+    response = await client.get("/metrics")
+    response.raise_for_status()
+    totals: Dict[str, List[float]] = defaultdict(lambda: [0.0, 0.0])
+    for line in response.text.splitlines():
+        match = _STATEMENTS.match(line)
+        if match:
+            kind, route, value = match.groups()
+            totals[route][0 if kind == "sum" else 1] = float(value)
+    return totals
+
+
+async def run_workload(make_client: Callable[[], httpx.AsyncClient], ctx: Context, weights: Dict[str, int],
+                       concurrency: int, seconds: float, warmup: float) -> dict:
+    """Run the virtual users and collect latencies per operation."""
+    names = list(weights)
+    name_weights = [weights[name] for name in names]
+
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+    measure_from = time.perf_counter() + warmup
+    deadline = measure_from + seconds
+
+    async def virtual_user(client: httpx.AsyncClient):
+        response = await client.post("/api/auth/login", json={"email": ctx.email(), "password": "benchmark"})
+        response.raise_for_status()
+
+        while time.perf_counter() < deadline:
+            name = random.choices(names, name_weights)[0]
+            _, send, accepted = OPERATIONS[name]
+            started = time.perf_counter()
+            try:
+                response = await send(client, ctx)
+                status = response.status_code
+                ok = status < 400 or status in accepted
+            except httpx.HTTPError:
+                status, ok = 0, False
+            finished = time.perf_counter()
+
+            if started < measure_from:
+                continue
+            statuses[name][status] += 1
+            if ok:
+                latencies[name].append(finished - started)
+            else:
+                errors[name] += 1
+
+    async def snapshot_after_warmup(client: httpx.AsyncClient):
+        await asyncio.sleep(max(0.0, measure_from - time.perf_counter()))
+        return await statements_per_route(client)
+
+    async with make_client() as metrics_client:
+        before = asyncio.create_task(snapshot_after_warmup(metrics_client))
+        clients = [make_client() for _ in range(concurrency)]
+        try:
+            await asyncio.gather(*(virtual_user(client) for client in clients))
+        finally:
+            await asyncio.gather(*(client.aclose() for client in clients))
+        before = await before
+        after = await statements_per_route(metrics_client)
+
+    operations = {}
+    for name in names:
+        route = OPERATIONS[name][0]
+        statements = after[route][0] - before[route][0]
+        requests = after[route][1] - before[route][1]
+        operations[name] = {
+            **latency_summary(latencies[name], seconds),
+            "errors": errors[name],
+            "statuses": {str(code): count for code, count in sorted(statuses[name].items())},
+            # Per route: operations sharing a route (comments / comment) share the figure
+            "sql_per_request": statements / requests if requests else None,
+        }
+
+    every = [value for values in latencies.values() for value in values]
+    return {
+        "overall": {**latency_summary(every, seconds), "errors": sum(errors.values())},
+        "operations": operations,
+    }
+
+
+def _read_context(path: str) -> Context:
+    with sqlite3.connect(path) as connection:
+        users = connection.execute("SELECT COUNT(*) FROM Users").fetchone()[0]
+        book_ids = [row[0] for row in connection.execute("SELECT book_id FROM Books ORDER BY book_id")]
+        group_ids = [row[0] for row in connection.execute("SELECT group_id FROM Groups ORDER BY group_id")]
+    if not users or not book_ids:
+        raise SystemExit(f"{path} has no users or books; build one with benchmarks.dataset")
+    if not group_ids:
+        group_ids = [0]
+    return Context(users, book_ids, group_ids)
+
+
+def _server_env(path: str, args) -> Dict[str, str]:
+    return dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{path}",
+        DB_PROFILE=args.profile,
+        ASYNC_DB=str(args.async_db).lower(),
+        WRITE_BEHIND_ENABLED=str(args.write_behind != "off").lower(),
+        WRITE_BEHIND_DURABILITY="commit" if args.write_behind == "off" else args.write_behind,
+        DEBUG="false",
+        METRICS_ENABLED="true",
+        # Ratings and comments from many users would otherwise flood the log
+        SLOW_QUERY_SECONDS="0",
+        REPEATED_QUERY_WARNING="0",
+    )
+
+
+def run_inprocess(path: str, ctx: Context, args) -> dict:
+    """Drive the app in this process through the ASGI transport."""
+    os.environ.update(_server_env(path, args))
+    from main import app  # settings are read on import
+
+    async def run():
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            return await run_workload(
+                lambda: httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120),
+                ctx, WORKLOADS[args.workload], args.concurrency, args.seconds, args.warmup
+            )
+
+    return asyncio.run(run())
+
+
+def run_http(path: str, ctx: Context, args) -> dict:
+    """Start uvicorn on the database and drive it over HTTP."""
+    from benchmarks.async_load import wait_until_ready  # imports the app's settings
+
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.port),
+         "--workers", str(args.workers), "--log-level", "warning", "--timeout-graceful-shutdown", "1"],
+        env=_server_env(path, args)
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        asyncio.run(wait_until_ready(base_url))
+        return asyncio.run(run_workload(
+            lambda: httpx.AsyncClient(base_url=base_url, timeout=120),
+            ctx, WORKLOADS[args.workload], args.concurrency, args.seconds, args.warmup
+        ))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def _git(*command: str) -> Optional[str]:
+    try:
+        return subprocess.run(["git", *command], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def describe_run(args, database: str) -> dict:
+    """Where and on what a run happened, stored with its results."""
+    dataset = None
+    if os.path.exists(f"{database}.json"):
+        with open(f"{database}.json", encoding="utf-8") as meta_file:
+            dataset = json.load(meta_file)
+    return {
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "dataset": dataset,
+        "bcrypt_rounds": int(os.environ.get("BCRYPT_ROUNDS", "12")),
+        **{key: value for key, value in vars(args).items() if key not in ("output", "database")},
+    }
+
+
+def print_report(results: dict):
+    print(f"\n{'operation':<14}{'count':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'SQL/req':>9}{'errors':>8}")
+    rows = sorted(results["operations"].items()) + [("overall", results["overall"])]
+    for name, stats in rows:
+        ms = [f"{stats[key]:.1f}" if stats[key] is not None else "-" for key in ("p50_ms", "p95_ms", "p99_ms")]
+        sql = stats.get("sql_per_request")
+        print(f"{name:<14}{stats['count']:>8}{stats['requests_per_sec']:>9.1f}{ms[0]:>9}{ms[1]:>9}{ms[2]:>9}"
+              f"{(f'{sql:.1f}' if sql is not None else '-'):>9}{stats['errors']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", required=True, help="database to copy for the run (see benchmarks.dataset)")
+    parser.add_argument("--mode", choices=["inprocess", "http"], default="inprocess")
+    parser.add_argument("--workload", choices=sorted(WORKLOADS), default="mixed")
+    parser.add_argument("--concurrency", type=int, default=32, help="virtual users")
+    parser.add_argument("--seconds", type=float, default=20, help="measured time")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds run before measuring")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers (http mode)")
+    parser.add_argument("--profile", default="production", help="DB_PROFILE for the app")
+    parser.add_argument("--async-db", action="store_true", help="run the app with ASYNC_DB=true")
+    parser.add_argument("--write-behind", choices=["off", "commit", "accepted"], default="off",
+                        help="queue ratings, comments and posts (WRITE_BEHIND_DURABILITY), or commit per request")
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--seed", type=int, default=1, help="seed for the request mix")
+    parser.add_argument("--output", help="JSON file for the results "
+                                         "(default: benchmarks/results/<time>-<commit>-<mode>-<workload>.json)")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "bench.db")
+        shutil.copy(args.database, path)
+        ctx = _read_context(path)
+        runner = run_inprocess if args.mode == "inprocess" else run_http
+        results = runner(path, ctx, args)
+
+    report = {"run": describe_run(args, args.database), **results}
+    print_report(results)
+
+    output = args.output
+    if output is None:
+        run = report["run"]
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(os.path.dirname(__file__), "results",
+                              f"{stamp}-{(run['commit'] or 'nocommit')[:8]}-{args.mode}-{args.workload}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as results_file:
+        json.dump(report, results_file, indent=2)
+    print(f"\nSaved {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Catalog latency during a login storm: bcrypt inline against the password
+pool (auth.py).
+
+Logged-in readers page through GET /api/books the whole time; halfway
+through, many clients start logging in as fast as they can. Two ways of
+running bcrypt are compared, each in its own process on its own copy of
+the database:
+
+- inline: bcrypt runs in the shared threadpool, in the request's own
+  thread, as it did when login and register were sync endpoints; a storm
+  then competes with the catalog for threads and CPU
+- pool: bcrypt runs on the bounded password pool (PASSWORD_HASH_WORKERS,
+  PASSWORD_HASH_MAX_PENDING), which sheds the excess with 503 (clients
+  retry after Retry-After)
+
+Reports the catalog p50/p99 before and during the storm, and the logins
+that got through. The app runs in this process through httpx's ASGI
+transport. Login cost is the cost the stored hashes were made with, so
+build the database with the production BCRYPT_ROUNDS and run with the
+same value (otherwise every login also rehashes):
+
+    BCRYPT_ROUNDS=12 python -m benchmarks.dataset --output /tmp/storm.db --preset small
+    BCRYPT_ROUNDS=12 python -m benchmarks.login_storm --database /tmp/storm.db --readers 16 --logins 64
+
+Needs httpx (pip install httpx).
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import httpx
+from benchmarks.harness import PAGE_SIZE, latency_summary
+
+MODES = ("inline", "pool")
+
+
+def _use_inline_bcrypt():
+    """Run password jobs in the shared threadpool instead of the password pool."""
+    import auth
+    from fastapi.concurrency import run_in_threadpool
+
+    async def run_inline(func, *args):
+        return await run_in_threadpool(func, *args)
+
+    auth._run_password_job = run_inline
+
+
+async def _storm(app, users: int, args) -> dict:
+    transport = httpx.ASGITransport(app=app)
+
+    def client() -> httpx.AsyncClient:
+        return httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120)
+
+    def credentials() -> dict:
+        return {"email": f"reader{random.randint(1, users)}@example.com", "password": "benchmark"}
+
+    measure_from = time.perf_counter() + args.warmup
+    storm_from = measure_from + args.seconds
+    deadline = storm_from + args.seconds
+    quiet, during = [], []
+    logins, rejected, errors = [], 0, 0
+
+    async def reader(session: httpx.AsyncClient):
+        nonlocal errors
+        (await session.post("/api/auth/login", json=credentials())).raise_for_status()
+        while time.perf_counter() < deadline:
+            request_started = time.perf_counter()
+            response = await session.get("/api/books", params={
+                "limit": PAGE_SIZE, "sort": random.choice(["book_id", "title", "rating"])
+            })
+            finished = time.perf_counter()
+            if response.status_code != 200:
+                errors += 1
+            elif request_started >= storm_from:
+                during.append(finished - request_started)
+            elif request_started >= measure_from:
+                quiet.append(finished - request_started)
+
+    async def attacker(session: httpx.AsyncClient):
+        nonlocal rejected, errors
+        await asyncio.sleep(max(0.0, storm_from - time.perf_counter()))
+        while time.perf_counter() < deadline:
+            request_started = time.perf_counter()
+            response = await session.post("/api/auth/login", json=credentials())
+            if response.status_code == 503:
+                rejected += 1
+                await asyncio.sleep(float(response.headers.get("Retry-After", 1)))
+            elif response.status_code == 200:
+                logins.append(time.perf_counter() - request_started)
+            else:
+                errors += 1
+
+    sessions = [client() for _ in range(args.readers + args.logins)]
+    try:
+        await asyncio.gather(
+            *(reader(session) for session in sessions[:args.readers]),
+            *(attacker(session) for session in sessions[args.readers:])
+        )
+    finally:
+        await asyncio.gather(*(session.aclose() for session in sessions))
+
+    return {
+        "quiet": latency_summary(quiet, args.seconds),
+        "storm": latency_summary(during, args.seconds),
+        "logins": latency_summary(logins, args.seconds),
+        "rejected": rejected,
+        "errors": errors,
+    }
+
+
+def run_mode(path: str, mode: str, args) -> dict:
+    """Run one mode against the database at `path` (in a new process)."""
+    os.environ.update(DATABASE_URL=f"sqlite:///{path}", DEBUG="false", SLOW_QUERY_SECONDS="0")
+    from main import app  # settings are read on import
+    from models import User
+    from database import SessionLocal
+
+    if mode == "inline":
+        _use_inline_bcrypt()
+    with SessionLocal() as db:
+        users = db.query(User).count()
+
+    async def run():
+        async with app.router.lifespan_context(app):
+            return await _storm(app, users, args)
+
+    return asyncio.run(run())
+
+
+def _ms(value) -> str:
+    return f"{value:.1f}" if value is not None else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", required=True, help="database to copy for each run (see benchmarks.dataset)")
+    parser.add_argument("--readers", type=int, default=16, help="logged-in users paging through the catalog")
+    parser.add_argument("--logins", type=int, default=64, help="clients logging in during the storm")
+    parser.add_argument("--seconds", type=float, default=10, help="length of the quiet phase and of the storm")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds of catalog reads before measuring")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    args = parser.parse_args()
+
+    print(f"{args.readers} readers, {args.logins} login clients, {args.seconds:g} s quiet + {args.seconds:g} s storm, "
+          f"BCRYPT_ROUNDS={os.environ.get('BCRYPT_ROUNDS', '12')}")
+    print(f"  {'mode':<8}{'quiet p50':>11}{'quiet p99':>11}{'storm p50':>11}{'storm p99':>11}"
+          f"{'logins/s':>10}{'login p99':>11}{'503s':>7}{'errors':>8}")
+    # A new process per mode: the app reads its settings and opens the database on import
+    spawn = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as workdir:
+        for mode in args.modes:
+            path = os.path.join(workdir, f"{mode}.db")
+            shutil.copy(args.database, path)
+            with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+                results = pool.submit(run_mode, path, mode, args).result()
+
+            quiet, storm, logins = results["quiet"], results["storm"], results["logins"]
+            print(f"  {mode:<8}{_ms(quiet['p50_ms']):>11}{_ms(quiet['p99_ms']):>11}"
+                  f"{_ms(storm['p50_ms']):>11}{_ms(storm['p99_ms']):>11}"
+                  f"{logins['requests_per_sec']:>10.1f}{_ms(logins['p99_ms']):>11}"
+                  f"{results['rejected']:>7}{results['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Measure catalog serialization time and bytes on the wire.
+
+For catalog pages of several sizes the script compares FastAPI's default
+path (response_model validation + jsonable encoding + JSONResponse) with
+FastJSONResponse, and reports the body size raw and with each available
+compression encoding.
+
+Usage (from the server directory):
+    python -m benchmarks.serialization --sizes 20 50 200 1000 --repeat 50
+"""
+
+import argparse
+import asyncio
+import time
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from compression import COMPRESSORS
+from config import settings
+from json_response import FastJSONResponse
+from schemas import BookPage, BookWithUserData
+
+LEVELS = {"gzip": settings.GZIP_LEVEL, "br": settings.BROTLI_QUALITY, "zstd": settings.ZSTD_LEVEL}
+
+SUMMARY = (
+    "A sweeping novel about memory, loss and the long shadows that families cast. "
+    "Told across three generations, it follows a lighthouse keeper's daughter as she "
+    "pieces together the story her parents never told. "
+) * 2
+
+
+def make_page(size: int) -> BookPage:
+    """A catalog page of `size` books with full details."""
+    return BookPage(
+        items=[
+            BookWithUserData(
+                book_id=i,
+                title=f"Benchmark Book {i}",
+                author=f"Author {i % 97}",
+                release_year=1900 + i % 120,
+                summary=SUMMARY,
+                bookmark_price=i % 20,
+                cover_image=f"images\\books\\cover{i}.jpg",
+                pdf_url=f"https://example.com/books/{i}.pdf",
+                is_purchased=i % 3 == 0,
+                user_rating=i % 5 + 1 if i % 4 == 0 else None,
+                average_rating=3.5 + (i % 3) / 2,
+                total_ratings=i % 40
+            )
+            for i in range(1, size + 1)
+        ],
+        next_cursor="WyJib29rX2lkIixbNTBdXQ"
+    )
+
+
+async def default_path(field, page: BookPage) -> bytes:
+    """What FastAPI does with a model returned from an endpoint."""
+    content = await serialize_response(
+        field=field, response_content=page, exclude_unset=True, is_coroutine=True
+    )
+    return JSONResponse(content).body
+
+
+def fast_path(page: BookPage) -> bytes:
+    """Returning FastJSONResponse from the endpoint."""
+    return FastJSONResponse(page, exclude_unset=True).body
+
+
+def timed(func, repeat: int) -> float:
+    """Average milliseconds per call."""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def compressed_size(body: bytes, encoding: str) -> int:
+    compressor = COMPRESSORS[encoding](LEVELS[encoding])
+    return len(compressor.compress(body) + compressor.finish())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20, 50, 200, 1000], help="books per page")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    field = create_response_field(name="Response_get_all_books", type_=BookPage)
+    loop = asyncio.new_event_loop()
+    encodings = sorted(COMPRESSORS)
+
+    print(f"{'books':>6}{'default ms':>12}{'fast ms':>10}{'speedup':>9}{'raw bytes':>11}"
+          + "".join(f"{name + ' bytes':>12}" for name in encodings))
+
+    for size in args.sizes:
+        page = make_page(size)
+
+        default_body = loop.run_until_complete(default_path(field, page))
+        fast_body = fast_path(page)
+        if len(default_body) != len(fast_body):
+            print(f"  warning: bodies differ in length ({len(default_body)} vs {len(fast_body)})")
+
+        default_ms = timed(lambda: loop.run_until_complete(default_path(field, page)), args.repeat)
+        fast_ms = timed(lambda: fast_path(page), args.repeat)
+
+        print(f"{size:>6}{default_ms:>12.3f}{fast_ms:>10.3f}{default_ms / fast_ms:>8.1f}x{len(fast_body):>11}"
+              + "".join(f"{compressed_size(fast_body, name):>12}" for name in encodings))
+
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Sustained write throughput: a commit per request against the write-behind
+queue (write_behind.py).
+
+Many concurrent writers send the writes of POST /api/books/{id}/rate and
+POST /api/books/{id}/comments for a fixed time, on a fresh copy of the
+database for each mode:
+
+- per-request: each write commits its own transaction, like the
+  endpoints without the queue
+- commit / accepted: writes go through a WriteBehindQueue with that
+  WRITE_BEHIND_DURABILITY
+
+Only the database work is measured (no HTTP, sessions or JSON), so the
+difference is what the shared commits save. Reports committed writes per
+second (queued writes left at the deadline are committed and counted),
+latency as a writer sees it, the average batch size and the writes shed
+with 503 because the queue was full (retried after Retry-After). Use a
+database from benchmarks.dataset:
+
+    python -m benchmarks.write_behind --database /tmp/bench.db --writers 64 --seconds 10
+    python -m benchmarks.write_behind --database /tmp/bench.db --profile default --flush-ms 2
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+from database import create_db_engine
+from models import Book, User
+from routes.book_routes import _save_comment, _save_rating
+from write_behind import WriteBehindQueue
+
+MODES = ("per-request", "commit", "accepted")
+
+
+class _Request:
+    """Stands in for the request, whose session the queue marks after a write."""
+
+    def __init__(self):
+        self.session = {}
+
+
+def _random_write(user_ids, book_ids):
+    """A rating or a comment by a random user: (save function, its arguments)."""
+    user_id, book_id = random.choice(user_ids), random.choice(book_ids)
+    if random.random() < 0.5:
+        return _save_rating, (user_id, book_id, random.randint(1, 5))
+    return _save_comment, (user_id, book_id, "Benchmark comment")
+
+
+def _commit_one(Session, func, args):
+    """One write in its own transaction (runs in the threadpool)."""
+    with Session() as db:
+        func(db, *args)
+        db.commit()
+
+
+async def run_mode(path: str, mode: str, args) -> dict:
+    """Run the writers against one mode and collect the results."""
+    engine = create_db_engine(f"sqlite:///{path}", args.profile)
+    Session = sessionmaker(bind=engine, autoflush=False)
+
+    with Session() as db:
+        user_ids = list(db.scalars(select(User.user_id)))
+        book_ids = list(db.scalars(select(Book.book_id)))
+
+    queue = None
+    writer_task = None
+    if mode != "per-request":
+        queue = WriteBehindQueue(args.queue_size, args.max_batch, args.flush_ms / 1000, mode)
+        writer_task = queue.start(Session)
+
+    latencies = []
+    errors = 0
+    rejected = 0
+    started = time.perf_counter()
+    deadline = started + args.seconds
+
+    async def writer():
+        nonlocal errors, rejected
+        while time.perf_counter() < deadline:
+            func, write_args = _random_write(user_ids, book_ids)
+            write_started = time.perf_counter()
+            try:
+                if queue is None:
+                    await run_in_threadpool(_commit_one, Session, func, write_args)
+                else:
+                    await queue.submit(_Request(), write_args[0], func, *write_args)
+            except HTTPException as error:
+                # Queue full (503): wait as long as a client would
+                rejected += 1
+                await asyncio.sleep(float(error.headers["Retry-After"]))
+                continue
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - write_started)
+
+    await asyncio.gather(*(writer() for _ in range(args.writers)))
+
+    written = len(latencies)
+    if queue is not None:
+        await queue.stop()
+        await writer_task
+        written = queue.written
+    elapsed = time.perf_counter() - started
+    engine.dispose()
+
+    return {
+        "writes_per_sec": written / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else None,
+        "p99_ms": statistics.quantiles(latencies, n=100)[98] * 1000 if len(latencies) > 1 else None,
+        "average_batch": queue.stats()["average_batch"] if queue is not None else 1,
+        "rejected": rejected,
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", required=True, help="database to copy for each run (see benchmarks.dataset)")
+    parser.add_argument("--profile", default="production", help="DB_PROFILE for the engine")
+    parser.add_argument("--writers", type=int, default=64, help="concurrent writers")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--flush-ms", type=float, default=5, help="WRITE_BEHIND_FLUSH_MS")
+    parser.add_argument("--max-batch", type=int, default=200, help="WRITE_BEHIND_MAX_BATCH")
+    parser.add_argument("--queue-size", type=int, default=2000, help="WRITE_BEHIND_QUEUE_SIZE")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    args = parser.parse_args()
+
+    print(f"profile: {args.profile}, {args.writers} writers, {args.seconds:g} s per mode")
+    print(f"  {'mode':<13}{'writes/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'batch':>8}{'503s':>8}{'errors':>8}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for mode in args.modes:
+            path = os.path.join(workdir, f"{mode}.db")
+            shutil.copy(args.database, path)
+            results = asyncio.run(run_mode(path, mode, args))
+
+            p50 = f"{results['p50_ms']:.2f}" if results["p50_ms"] is not None else "-"
+            p99 = f"{results['p99_ms']:.2f}" if results["p99_ms"] is not None else "-"
+            batch = results["average_batch"] or 0
+            print(f"  {mode:<13}{results['writes_per_sec']:>10.1f}{p50:>10}{p99:>10}{batch:>8.1f}"
+                  f"{results['rejected']:>8}{results['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+In-process cache for the book catalog.
+Holds the shared (not user-specific) part of book details and catalog
+pages, so repeated reads skip SQLite. Entries are dropped when a
+transaction that wrote Books, BookRatings or BookRatingStats commits;
+the session events below track those writes, so routes never invalidate
+by hand.
+
+The cache lives in each worker process. Writes made by another worker
+(or another program) become visible after CATALOG_CACHE_TTL_SECONDS, or
+at once when HTTP caching is on: entries carry the catalog version
+(ResourceVersions) they were loaded at, and the routes pass the version
+they read for the ETag, so a body never goes out with an ETag for newer
+data.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from itertools import chain
+from typing import Any, Dict, Hashable, Optional
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from config import settings
+from models import Book, BookRating, BookRatingStats
+
+# Tables whose writes change cached data
+TRACKED_TABLES = {
+    Book.__tablename__,
+    BookRating.__tablename__,
+    BookRatingStats.__tablename__,
+}
+
+# session.info key for the book ids written by the current transaction
+PENDING_KEY = "catalog_cache_pending"
+
+# Marker for "a write we can't pin to one book": drop everything
+ALL_BOOKS = object()
+
+
+class LRUCache:
+    """
+    Bounded least-recently-used cache with a time-to-live per entry.
+
+    Thread safe, since sync endpoints run in the threadpool. A size of 0
+    disables the cache.
+    """
+
+    def __init__(self, name: str, max_entries: int, ttl_seconds: float):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable, version: Optional[int] = None) -> Optional[Any]:
+        """
+        Return the cached value, or None if it is missing or expired.
+
+        With a version, an entry stored at another version is a miss too
+        (and is dropped).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at, entry_version = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            if version is not None and entry_version != version:
+                del self._entries[key]
+                self.invalidations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, generation: int, version: Optional[int] = None):
+        """
+        Store a value loaded while the cache was at `generation`.
+
+        The value is dropped if anything was invalidated in the meantime,
+        since it may have been read before that write committed.
+
+        Args:
+            key: Cache key
+            value: The value
+            generation: current_generation() from before the value was loaded
+            version: Data version the value was loaded at, if known (see get)
+        """
+        if self.max_entries <= 0:
+            return
+
+        with self._lock:
+            if generation != _generation:
+                return
+
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds, version)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key: Hashable):
+        """Remove one entry."""
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        """Remove every entry."""
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for sizing the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+# Bumped on every invalidation; see LRUCache.put
+_generation = 0
+
+# Book details, keyed by book id
+books = LRUCache("books", settings.CATALOG_CACHE_SIZE, settings.CATALOG_CACHE_TTL_SECONDS)
+
+# Catalog pages, keyed by the query parameters
+pages = LRUCache("pages", settings.CATALOG_PAGE_CACHE_SIZE, settings.CATALOG_CACHE_TTL_SECONDS)
+
+
+def current_generation() -> int:
+    """Read before loading a value that will be passed to put()."""
+    return _generation
+
+
+def invalidate(book_ids):
+    """
+    Drop cached data after a write.
+
+    Args:
+        book_ids: IDs of the books that changed; may contain ALL_BOOKS
+    """
+    global _generation
+    # Under both locks: a concurrent put() either finishes first (and is
+    # cleared below) or sees the new generation and is rejected
+    with books._lock, pages._lock:
+        _generation += 1
+
+    if ALL_BOOKS in book_ids:
+        books.clear()
+    else:
+        for book_id in book_ids:
+            books.discard(book_id)
+
+    # Any change can move books between pages (titles, average ratings)
+    pages.clear()
+
+
+def stats() -> Dict[str, Any]:
+    """Counters of both caches."""
+    return {cache.name: cache.stats() for cache in (books, pages)}
+
+
+def _statement_book_id(statement):
+    """The book id of an UPDATE/DELETE ... WHERE book_id = <value>, if it is that simple."""
+    where = statement.whereclause
+    column = getattr(where, "left", None)
+    value = getattr(where, "right", None)
+    if getattr(column, "key", None) == "book_id" and getattr(where.operator, "__name__", None) == "eq":
+        return getattr(value, "value", ALL_BOOKS)
+    return ALL_BOOKS
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_flushed(session, flush_context):
+    """Remember the books touched by ORM objects in this flush."""
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, (Book, BookRating, BookRatingStats)):
+            session.info.setdefault(PENDING_KEY, set()).add(obj.book_id)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_statement(orm_execute_state):
+    """Remember the books touched by bulk INSERT/UPDATE/DELETE statements."""
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+
+    statement = orm_execute_state.statement
+    table = getattr(statement, "table", None)
+    if table is None or table.name not in TRACKED_TABLES:
+        return
+
+    book_id = ALL_BOOKS if orm_execute_state.is_insert else _statement_book_id(statement)
+    orm_execute_state.session.info.setdefault(PENDING_KEY, set()).add(book_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session):
+    """Drop the cache entries of everything the transaction wrote."""
+    book_ids = session.info.pop(PENDING_KEY, None)
+    if book_ids:
+        invalidate(book_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_on_rollback(session):
+    """Rolled back writes never happened, so there is nothing to drop."""
+    session.info.pop(PENDING_KEY, None)
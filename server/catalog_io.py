@@ -0,0 +1,295 @@
+"""
+Bulk catalog import and export.
+Reads publisher feeds (CSV or JSON Lines) as a stream of rows, validates
+each row against the BookBase schema and upserts them in chunks, one
+executemany and one commit per chunk. Export streams the Books table the
+same way. Neither ever holds the whole catalog in memory.
+
+During an import the per-row triggers on Books (search index sync and
+resource versions) are switched off; afterwards the search index is
+rebuilt once, the catalog version bumped once and the planner statistics
+refreshed. Used by `python manage.py import-books` / `export-books`.
+"""
+
+import csv
+import io
+import json
+import sys
+import time
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import IO, Iterable, Iterator, List, Optional, Tuple
+from pydantic import ValidationError
+from sqlalchemy import select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection, Engine
+from models import Book, BOOKS_SEARCH_TABLE, bump_resource_version
+from schemas import BookBase
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# Book columns in file order
+COLUMNS = ["book_id"] + list(BookBase.model_fields)
+
+FORMATS = ("csv", "jsonl")
+
+# INSERT construct with ON CONFLICT support, per database
+DIALECT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+@dataclass
+class ImportReport:
+    """What an import did."""
+    read: int = 0
+    inserted: int = 0
+    updated: int = 0
+    rejected: int = 0
+    # (line number, message) of the first rejected rows
+    errors: List[Tuple[int, str]] = field(default_factory=list)
+    seconds: float = 0.0
+    peak_memory_mb: Optional[float] = None
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.read / self.seconds if self.seconds else 0.0
+
+
+def detect_format(path: str, requested: Optional[str]) -> str:
+    """The file format: as requested, else from the file extension."""
+    if requested:
+        return requested
+    if path.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    if path.endswith(".csv"):
+        return "csv"
+    raise ValueError(f"Can't tell the format of '{path}'; pass --format ({' or '.join(FORMATS)})")
+
+
+def open_text(path: str, mode: str) -> IO[str]:
+    """Open a file for text I/O; '-' is stdin / stdout."""
+    if path == "-":
+        stream = sys.stdin if mode == "r" else sys.stdout
+        return io.TextIOWrapper(stream.buffer, encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+def read_rows(stream: IO[str], file_format: str) -> Iterator[Tuple[int, object]]:
+    """
+    Yield (line number, raw row) from a CSV or JSON Lines stream.
+
+    CSV rows are dicts of strings (empty cells become None); JSON Lines
+    rows are whatever each line holds, or the JSONDecodeError for a line
+    that isn't valid JSON.
+    """
+    if file_format == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, {key: (value if value != "" else None) for key, value in row.items()}
+        return
+
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except json.JSONDecodeError as error:
+            yield line_number, error
+
+
+def validate_rows(rows: Iterable[Tuple[int, object]], report: ImportReport,
+                  max_errors: int = 20) -> Iterator[dict]:
+    """
+    Check raw rows against BookBase and yield them as column dicts.
+
+    Rejected rows are counted in the report (and the first max_errors of
+    them kept with their line numbers) instead of stopping the import.
+    """
+    for line_number, raw in rows:
+        report.read += 1
+        try:
+            if isinstance(raw, Exception):
+                raise ValueError(f"invalid JSON: {raw}")
+            if not isinstance(raw, dict):
+                raise ValueError("expected an object")
+
+            # Missing values take the schema defaults (e.g. bookmark_price 0)
+            book = BookBase.model_validate(
+                {key: value for key, value in raw.items() if value is not None}
+            ).model_dump()
+            book_id = raw.get("book_id")
+            book["book_id"] = int(book_id) if book_id is not None else None
+        except (ValidationError, ValueError, TypeError) as error:
+            report.rejected += 1
+            if len(report.errors) < max_errors:
+                message = "; ".join(
+                    f"{'.'.join(map(str, item['loc']))}: {item['msg']}" for item in error.errors()
+                ) if isinstance(error, ValidationError) else str(error)
+                report.errors.append((line_number, message))
+            continue
+        yield book
+
+
+def chunked(rows: Iterable[dict], size: int) -> Iterator[List[dict]]:
+    """Group a stream of rows into lists of up to `size` rows."""
+    iterator = iter(rows)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _upsert_statement(connection: Connection):
+    """INSERT ... ON CONFLICT (book_id) DO UPDATE for rows that carry a book_id."""
+    try:
+        dialect_insert = DIALECT_INSERTS[connection.dialect.name]
+    except KeyError:
+        raise ValueError(f"Bulk import doesn't support {connection.dialect.name} databases")
+
+    statement = dialect_insert(Book.__table__)
+    return statement.on_conflict_do_update(
+        index_elements=[Book.book_id],
+        set_={column: statement.excluded[column] for column in COLUMNS if column != "book_id"}
+    )
+
+
+def _suspend_book_triggers(connection: Connection) -> List[str]:
+    """Drop the triggers on Books and return their SQL to create them again."""
+    if connection.dialect.name != "sqlite":
+        return []
+
+    triggers = connection.execute(text(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = :table"
+    ), {"table": Book.__tablename__}).all()
+
+    for name, _ in triggers:
+        connection.exec_driver_sql(f'DROP TRIGGER "{name}"')
+    return [sql for _, sql in triggers]
+
+
+def _restore_book_triggers(connection: Connection, trigger_sql: List[str]):
+    """Recreate the triggers and redo, once, the work they skipped."""
+    for sql in trigger_sql:
+        connection.exec_driver_sql(sql)
+
+    if connection.dialect.name != "sqlite":
+        return
+
+    has_search_index = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE name = :name"), {"name": BOOKS_SEARCH_TABLE}
+    ).first() is not None
+    if has_search_index:
+        connection.exec_driver_sql(f"INSERT INTO {BOOKS_SEARCH_TABLE}({BOOKS_SEARCH_TABLE}) VALUES ('rebuild')")
+
+    bump_resource_version(connection, "catalog")
+
+
+def import_books(engine: Engine, rows: Iterable[Tuple[int, object]], chunk_size: int = 5000,
+                 progress=None) -> ImportReport:
+    """
+    Validate and upsert books from a stream of raw rows.
+
+    Rows with a book_id replace that book (or create it with that id);
+    rows without one are added as new books. Every chunk is committed on
+    its own, so an interrupted import keeps the chunks already done.
+
+    Args:
+        engine: Engine of the database to import into
+        rows: (line number, raw row) pairs, e.g. from read_rows
+        chunk_size: Rows per executemany / commit
+        progress: Optional callable receiving the report after each chunk
+
+    Returns:
+        Counts, timing and the first rejected rows
+    """
+    report = ImportReport()
+    started = time.perf_counter()
+
+    with engine.connect() as connection:
+        upsert = _upsert_statement(connection)
+        new_books = Book.__table__.insert()
+
+        with connection.begin():
+            trigger_sql = _suspend_book_triggers(connection)
+
+        try:
+            for chunk in chunked(validate_rows(rows, report), chunk_size):
+                with_id = [row for row in chunk if row["book_id"] is not None]
+                without_id = [{key: value for key, value in row.items() if key != "book_id"}
+                              for row in chunk if row["book_id"] is None]
+
+                with connection.begin():
+                    if with_id:
+                        existing = set(connection.scalars(
+                            select(Book.book_id).where(Book.book_id.in_([row["book_id"] for row in with_id]))
+                        ))
+                        connection.execute(upsert, with_id)
+                        report.updated += len(existing)
+                        report.inserted += len(with_id) - len(existing)
+                    if without_id:
+                        connection.execute(new_books, without_id)
+                        report.inserted += len(without_id)
+
+                if progress:
+                    report.seconds = time.perf_counter() - started
+                    progress(report)
+        finally:
+            with connection.begin():
+                _restore_book_triggers(connection, trigger_sql)
+            if connection.dialect.name == "sqlite":
+                # Refresh the query planner's statistics for the new data
+                connection.exec_driver_sql("PRAGMA optimize")
+
+    report.seconds = time.perf_counter() - started
+    report.peak_memory_mb = peak_memory_mb()
+    return report
+
+
+def export_books(engine: Engine, stream: IO[str], file_format: str, batch_size: int = 5000) -> int:
+    """
+    Write the whole catalog to a stream, in book_id order.
+
+    Rows are fetched from the database cursor batch_size at a time and
+    written straight out.
+
+    Args:
+        engine: Engine of the database to export
+        stream: Text stream to write to
+        file_format: "csv" or "jsonl"
+        batch_size: Rows fetched per round trip
+
+    Returns:
+        Number of books written
+    """
+    query = select(*(Book.__table__.c[column] for column in COLUMNS)).order_by(Book.book_id)
+    writer = None
+    if file_format == "csv":
+        writer = csv.writer(stream)
+        writer.writerow(COLUMNS)
+
+    written = 0
+    with engine.connect() as connection:
+        result = connection.execution_options(yield_per=batch_size).execute(query)
+        for rows in result.partitions():
+            if writer:
+                writer.writerows(rows)
+            else:
+                stream.writelines(
+                    json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False) + "\n" for row in rows
+                )
+            written += len(rows)
+
+    stream.flush()
+    return written
+
+
+def peak_memory_mb() -> Optional[float]:
+    """Peak resident memory of this process in MB (None where unsupported)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
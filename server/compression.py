@@ -0,0 +1,250 @@
+"""
+Response compression middleware.
+Compresses text and JSON responses with the best encoding the client
+accepts: brotli or zstd when their optional packages are installed,
+otherwise gzip. Responses below a minimum size are sent as is, since
+compressing them costs more than it saves.
+
+Streaming responses are compressed chunk by chunk and flushed after each
+chunk, so clients still get every chunk straight away.
+"""
+
+import zlib
+from typing import Dict, Iterable, List, Optional
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+# Content types worth compressing
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+)
+
+# Sent as is even though they are text: every event must reach the
+# client immediately and tiny flushed chunks barely compress
+EXCLUDED_TYPES = ("text/event-stream",)
+
+
+class _GzipCompressor:
+    """gzip through zlib (always available)."""
+
+    def __init__(self, level: int):
+        # wbits 31 = gzip container
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _BrotliCompressor:
+    """brotli, if the brotli package is installed."""
+
+    def __init__(self, level: int):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class _ZstdCompressor:
+    """Zstandard, if the zstandard package is installed."""
+
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+# Encoding name -> compressor class, for the encodings this install supports
+COMPRESSORS = {"gzip": _GzipCompressor}
+if brotli is not None:
+    COMPRESSORS["br"] = _BrotliCompressor
+if zstandard is not None:
+    COMPRESSORS["zstd"] = _ZstdCompressor
+
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    """
+    Parse an Accept-Encoding header into {encoding: q-value}.
+
+    Args:
+        header: Header value, e.g. "gzip, br;q=0.9, *;q=0"
+
+    Returns:
+        Mapping of lower-cased encoding names to their q-values
+    """
+    accepted = {}
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip().lower()] = quality
+    return accepted
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware that compresses responses.
+
+    Args:
+        app: The wrapped application
+        encodings: Encodings to offer, in order of preference; ones whose
+            package is not installed are skipped
+        minimum_size: Smallest body (in bytes) that gets compressed
+        levels: Compression level per encoding
+    """
+
+    def __init__(self, app: ASGIApp, encodings: Iterable[str] = ("br", "zstd", "gzip"),
+                 minimum_size: int = 1024, levels: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.encodings: List[str] = [name for name in encodings if name in COMPRESSORS]
+        self.minimum_size = minimum_size
+        self.levels = {"gzip": 6, "br": 4, "zstd": 3, **(levels or {})}
+
+    def choose_encoding(self, accept_encoding: str) -> Optional[str]:
+        """Pick our most preferred encoding that the client accepts."""
+        accepted = parse_accept_encoding(accept_encoding)
+        wildcard = accepted.get("*", 0.0)
+        for name in self.encodings:
+            if accepted.get(name, wildcard) > 0:
+                return name
+        return None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] == "HEAD" or not self.encodings:
+            await self.app(scope, receive, send)
+            return
+
+        encoding = self.choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressionResponder(send, encoding, self.levels[encoding], self.minimum_size)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressionResponder:
+    """Compresses the messages of one response on their way to the client."""
+
+    def __init__(self, send: Send, encoding: str, level: int, minimum_size: int):
+        self._send = send
+        self.encoding = encoding
+        self.level = level
+        self.minimum_size = minimum_size
+        self.start_message: Optional[Message] = None
+        self.compressor = None
+        self.passthrough = False
+
+    async def send(self, message: Message):
+        if message["type"] == "http.response.start":
+            # Hold the headers back until the first body chunk shows
+            # whether the response is worth compressing
+            self.start_message = message
+            return
+
+        if message["type"] != "http.response.body":
+            # e.g. zero-copy file sends: pass the whole response through
+            if self.compressor is None and not self.passthrough:
+                self.passthrough = True
+                await self._send(self.start_message)
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.passthrough:
+            await self._send(message)
+            return
+
+        if self.compressor is None:
+            if not self._should_compress(body, more_body):
+                self.passthrough = True
+                await self._send(self.start_message)
+                await self._send(message)
+                return
+            await self._start_compressing(body, more_body)
+            return
+
+        data = self.compressor.compress(body)
+        data += self.compressor.flush() if more_body else self.compressor.finish()
+        await self._send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+    def _should_compress(self, body: bytes, more_body: bool) -> bool:
+        """Whether this response gets compressed (decided on its first chunk)."""
+        headers = Headers(raw=self.start_message["headers"])
+
+        if self.start_message["status"] in (204, 206, 304) or "content-encoding" in headers:
+            return False
+
+        content_type = headers.get("content-type", "").lower()
+        if content_type.startswith(EXCLUDED_TYPES) or not content_type.startswith(COMPRESSIBLE_TYPES):
+            return False
+
+        # A complete body we can measure; a stream is assumed to be large
+        return more_body or len(body) >= self.minimum_size
+
+    async def _start_compressing(self, body: bytes, more_body: bool):
+        self.compressor = COMPRESSORS[self.encoding](self.level)
+        headers = MutableHeaders(raw=self.start_message["headers"])
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+
+        # The bytes differ from the uncompressed body, so a strong ETag
+        # no longer describes them
+        etag = headers.get("etag")
+        if etag and not etag.startswith("W/"):
+            headers["ETag"] = f"W/{etag}"
+
+        data = self.compressor.compress(body)
+        if more_body:
+            data += self.compressor.flush()
+            del headers["Content-Length"]
+        else:
+            data += self.compressor.finish()
+            headers["Content-Length"] = str(len(data))
+
+        await self._send(self.start_message)
+        await self._send({"type": "http.response.body", "body": data, "more_body": more_body})
@@ -14,6 +14,116 @@ class Settings(BaseSettings):
 
     # Database
     DATABASE_URL: str = "sqlite:///./bookclub.db"
+    # Engine profile (see database.SQLITE_PROFILES): "default" keeps SQLite's
+    # own settings, "production" enables WAL and the tuned pragmas
+    DB_PROFILE: str = "default"
+    # Extra/overriding SQLite pragmas, e.g. "cache_size=-32000,mmap_size=0"
+    DB_PRAGMAS: str = ""
+    # Connection pool (per worker process)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: int = 30
+
+    # Read-only database for GET endpoints. Empty = for SQLite, open the
+    # same file read-only (mode=ro); for other backends, use the primary.
+    # Set to a replica URL to send reads there.
+    READ_DATABASE_URL: str = ""
+    # After a user writes, their reads go to the primary for this long so
+    # they see their own changes even if the replica lags
+    READ_YOUR_WRITES_SECONDS: int = 5
+
+    # Async database stack: endpoints use an AsyncSession on an async
+    # driver instead of sync sessions in the threadpool. Empty
+    # ASYNC_DATABASE_URL = DATABASE_URL with the aiosqlite driver.
+    ASYNC_DB: bool = False
+    ASYNC_DATABASE_URL: str = ""
+
+    # In-process catalog cache (per worker). Sizes are entry counts, 0
+    # disables that cache. Writes in this process invalidate at once;
+    # writes from other workers show up after the TTL.
+    CATALOG_CACHE_SIZE: int = 2048
+    CATALOG_PAGE_CACHE_SIZE: int = 256
+    CATALOG_CACHE_TTL_SECONDS: float = 30
+
+    # ETag / Last-Modified headers and 304 responses for catalog and comments
+    HTTP_CACHE_ENABLED: bool = True
+
+    # Response compression. Encodings in order of preference; br and zstd
+    # need the brotli / zstandard packages and are skipped without them.
+    # Empty = no compression.
+    COMPRESSION_ENCODINGS: str = "br,zstd,gzip"
+    COMPRESSION_MINIMUM_SIZE: int = 1024  # bytes
+    GZIP_LEVEL: int = 6
+    BROTLI_QUALITY: int = 4
+    ZSTD_LEVEL: int = 3
+
+    # Live group feed (server-sent events, see group_feed.py)
+    # Posts a connection may have waiting before it is dropped as too slow
+    FEED_QUEUE_SIZE: int = 64
+    # Comment line sent on idle connections so proxies keep them open
+    FEED_HEARTBEAT_SECONDS: float = 15
+    # With several workers: how often each one checks the database for
+    # posts written by the others. 0 = single worker, no polling.
+    FEED_POLL_SECONDS: float = 0
+
+    # Media files (see media.py). Paths are relative to the server directory;
+    # MEDIA_DIRS are relative to MEDIA_ROOT, like the stored cover paths
+    MEDIA_ROOT: str = ".."
+    MEDIA_DIRS: str = "images,client/images"
+    # Thumbnails and the digest cache
+    MEDIA_CACHE_DIR: str = "./media_cache"
+    MEDIA_THUMBNAIL_WIDTHS: str = "160,320"
+    MEDIA_THUMBNAIL_QUALITY: int = 80
+    # Behind nginx: internal location the files are served from, e.g.
+    # "/protected-media/" (X-Accel-Redirect). Empty = the app sends them.
+    MEDIA_ACCEL_REDIRECT: str = ""
+
+    # Request metrics (see metrics.py): GET /metrics in the Prometheus
+    # text format, and a Server-Timing header (app / db / bcrypt time) on
+    # every response for browser devtools
+    METRICS_ENABLED: bool = True
+    SERVER_TIMING_ENABLED: bool = True
+    # Log SQL statements slower than this (seconds); 0 = off
+    SLOW_QUERY_SECONDS: float = 0.25
+    # Log requests that run one statement this many times (N+1); 0 = off
+    REPEATED_QUERY_WARNING: int = 20
+
+    # Recommendations (see recommendations.py; needs numpy and scipy)
+    # Similar books kept per book
+    RECOMMENDATION_NEIGHBORS: int = 20
+    # Weight of a reading group having read a book, relative to a 5-star rating
+    RECOMMENDATION_GROUP_WEIGHT: float = 1.0
+    # Books a reader's recommendations start from (their strongest
+    # ratings, then purchases)
+    RECOMMENDATION_MAX_SEEDS: int = 50
+    # How often the app folds new ratings and purchases into the similar
+    # book lists; 0 = never (run `python manage.py build-recommendations`
+    # from cron instead). With several workers, set it on one only.
+    RECOMMENDATION_REFRESH_SECONDS: float = 0
+
+    # Leaderboards (see leaderboards.py)
+    # Trending activity loses half its weight every this many hours
+    LEADERBOARD_TRENDING_HALF_LIFE_HOURS: float = 72
+    # Imaginary 3-star ratings every book starts with on the top-rated board
+    LEADERBOARD_RATING_PRIOR: float = 5
+    # How often each worker folds new purchases, ratings and comments in
+    LEADERBOARD_REFRESH_SECONDS: float = 5
+    # How often changed scores are written to BookPopularity (> 0: events
+    # are only purged once a snapshot includes them)
+    LEADERBOARD_SNAPSHOT_SECONDS: float = 300
+
+    # Write-behind queue for ratings, comments and group posts (see
+    # write_behind.py): one writer task per worker commits them in batches
+    WRITE_BEHIND_ENABLED: bool = False
+    # A batch is written this long after its first write, or sooner once
+    # it has WRITE_BEHIND_MAX_BATCH writes
+    WRITE_BEHIND_FLUSH_MS: float = 5
+    WRITE_BEHIND_MAX_BATCH: int = 200
+    # Writes that may wait; beyond this, the endpoints answer 503
+    WRITE_BEHIND_QUEUE_SIZE: int = 2000
+    # "commit": answer once the batch has committed; "accepted": answer
+    # 202 as soon as the write is queued (lost if the process dies)
+    WRITE_BEHIND_DURABILITY: str = "commit"
 
     # Application
     APP_NAME: str = "Book Club API"
@@ -23,6 +133,30 @@ class Settings(BaseSettings):
     SECRET_KEY: str = "change-this-secret-key"
     SESSION_COOKIE_NAME: str = "bookclub_session"
 
+    # Server-side sessions (see sessions.py). "memory" keeps them in each
+    # worker process; "redis" shares them between workers through any
+    # Redis-protocol server at SESSION_REDIS_URL.
+    SESSION_STORE: str = "memory"
+    SESSION_REDIS_URL: str = "redis://127.0.0.1:6379/0"
+    SESSION_MAX_AGE: int = 86400  # seconds
+    SESSION_MAX_ENTRIES: int = 100_000  # memory store only
+    # How long /me answers from the user cached in the session
+    SESSION_USER_CACHE_SECONDS: int = 300
+
+    # How long a stored Idempotency-Key response is replayed
+    IDEMPOTENCY_KEY_TTL_HOURS: int = 24
+
+    # Password hashing
+    # bcrypt cost factor; stored hashes with a different cost are
+    # re-hashed on the next successful login
+    BCRYPT_ROUNDS: int = 12
+    # Executor that runs bcrypt: "thread" or "process"
+    PASSWORD_HASH_EXECUTOR: str = "thread"
+    PASSWORD_HASH_WORKERS: int = 2
+    # Hash/verify jobs allowed to wait or run at once; beyond this,
+    # register/login answer 503 instead of queueing
+    PASSWORD_HASH_MAX_PENDING: int = 32
+
     # CORS - origins that can access the API
     ALLOWED_ORIGINS: str = "http://localhost:5500,http://127.0.0.1:5500"
 
@@ -3,27 +3,303 @@ Database connection and session management.
 Sets up SQLAlchemy to work with the existing SQLite database.
 """
 
-from sqlalchemy import create_engine
+import time
+from typing import Callable, Dict, TypeVar, Union
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool, StaticPool
 from config import settings
+from metrics import instrument_engine, instrument_orm
+
+# Per-connection SQLite settings for each engine profile.
+# "production" is tuned for a web server: WAL lets readers run while a
+# write is in progress, synchronous=NORMAL is safe with WAL and avoids an
+# fsync per commit, and busy_timeout makes writers wait for the lock
+# instead of failing straight away.
+SQLITE_PROFILES: Dict[str, Dict[str, object]] = {
+    "default": {},
+    "production": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,       # milliseconds
+        "cache_size": -64000,       # negative = KiB, so 64 MB per connection
+        "mmap_size": 268435456,     # 256 MB
+        "temp_store": "MEMORY",
+        "foreign_keys": "ON",
+    },
+}
+
+
+def get_sqlite_pragmas(profile: str) -> Dict[str, object]:
+    """
+    Pragmas for an engine profile, with DB_PRAGMAS overrides applied.
+
+    Args:
+        profile: Name of a profile in SQLITE_PROFILES
+
+    Returns:
+        Mapping of pragma name to value
+    """
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f"Unknown DB_PROFILE '{profile}', expected one of {sorted(SQLITE_PROFILES)}")
+
+    pragmas = dict(SQLITE_PROFILES[profile])
+    for item in settings.DB_PRAGMAS.split(","):
+        if "=" in item:
+            name, value = item.split("=", 1)
+            pragmas[name.strip()] = value.strip()
+    return pragmas
+
+
+def create_db_engine(url: str, profile: str = settings.DB_PROFILE, read_only: bool = False) -> Engine:
+    """
+    Create an engine for the given database URL and profile.
+
+    For SQLite the profile's pragmas are applied to every new connection.
+    In-memory databases share one connection (StaticPool); file databases
+    use a QueuePool sized by DB_POOL_SIZE / DB_MAX_OVERFLOW, which should
+    cover the threadpool of one uvicorn worker.
+
+    Args:
+        url: SQLAlchemy database URL
+        profile: Name of a profile in SQLITE_PROFILES
+        read_only: Engine is only used for reads (skips pragmas that write
+            to the database file and sets query_only for SQLite)
+
+    Returns:
+        SQLAlchemy engine
+    """
+    if make_url(url).get_backend_name() != "sqlite":
+        return create_engine(
+            url,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_pre_ping=True
+        )
+
+    pragmas = _engine_pragmas(profile, read_only)
+    database = make_url(url).database
+
+    # check_same_thread=False is needed for SQLite to work with FastAPI
+    if not database or database == ":memory:":
+        new_engine = create_engine(
+            url,
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool
+        )
+    else:
+        new_engine = create_engine(
+            url,
+            connect_args={"check_same_thread": False},
+            poolclass=QueuePool,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT
+        )
+
+    _install_pragmas(new_engine, pragmas)
+    return new_engine
+
+
+def create_async_db_engine(url: str, profile: str = settings.DB_PROFILE, read_only: bool = False) -> AsyncEngine:
+    """
+    Async counterpart of create_db_engine (used when ASYNC_DB is on).
+
+    Takes the same profiles and pool settings; the URL must name an async
+    driver, e.g. sqlite+aiosqlite:///./bookclub.db.
+
+    Args:
+        url: SQLAlchemy database URL with an async driver
+        profile: Name of a profile in SQLITE_PROFILES
+        read_only: Engine is only used for reads
+
+    Returns:
+        SQLAlchemy async engine
+    """
+    if make_url(url).get_backend_name() != "sqlite":
+        return create_async_engine(
+            url,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_pre_ping=True
+        )
+
+    pragmas = _engine_pragmas(profile, read_only)
+    database = make_url(url).database
+
+    if not database or database == ":memory:":
+        new_engine = create_async_engine(url, poolclass=StaticPool)
+    else:
+        new_engine = create_async_engine(
+            url,
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT
+        )
+
+    # Connection events are registered on the sync engine behind the async one
+    _install_pragmas(new_engine.sync_engine, pragmas)
+    return new_engine
+
+
+def _engine_pragmas(profile: str, read_only: bool) -> Dict[str, object]:
+    """Pragmas for a new SQLite engine, adjusted for read-only engines."""
+    pragmas = get_sqlite_pragmas(profile)
+
+    if read_only:
+        # journal_mode is stored in the file and can only be set by a writer
+        pragmas.pop("journal_mode", None)
+        pragmas["query_only"] = "ON"
+
+    return pragmas
+
+
+def _install_pragmas(target: Engine, pragmas: Dict[str, object]) -> None:
+    """Run the given PRAGMA statements on every new connection of an engine."""
+    if not pragmas:
+        return
+
+    @event.listens_for(target, "connect")
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+
+def get_async_database_url(url: str) -> str:
+    """
+    Switch a SQLite URL to the aiosqlite driver.
+
+    Other databases have no default async driver and need
+    ASYNC_DATABASE_URL instead.
+
+    Args:
+        url: Database URL with a sync driver
+
+    Returns:
+        Database URL with an async driver
+    """
+    parsed = make_url(url)
+    if parsed.get_backend_name() != "sqlite":
+        raise ValueError("ASYNC_DATABASE_URL must be set to use ASYNC_DB with a non-SQLite database")
+
+    return parsed.set(drivername="sqlite+aiosqlite").render_as_string(hide_password=False)
+
+
+def get_read_database_url(url: str) -> str:
+    """
+    Work out the URL of the read-only database.
+
+    Uses READ_DATABASE_URL when set. Otherwise a SQLite file is opened a
+    second time in read-only mode; other databases have no replica and
+    reads use the primary URL.
+
+    Args:
+        url: URL of the primary database
+
+    Returns:
+        URL for read-only connections
+    """
+    if settings.READ_DATABASE_URL:
+        return settings.READ_DATABASE_URL
+
+    parsed = make_url(url)
+    if parsed.get_backend_name() != "sqlite" or not parsed.database or parsed.database == ":memory:":
+        return url
+
+    if parsed.database.startswith("file:"):
+        return url
+
+    return f"sqlite:///file:{parsed.database}?mode=ro&uri=true"
+
 
 # Create database engine
-# check_same_thread=False is needed for SQLite to work with FastAPI
-engine = create_engine(
-    settings.DATABASE_URL,
-    connect_args={"check_same_thread": False}
-)
+engine = create_db_engine(settings.DATABASE_URL)
+
+# Read-only engine for GET endpoints (the primary engine if there is no
+# separate read-only database, e.g. an in-memory SQLite database)
+_read_database_url = get_read_database_url(settings.DATABASE_URL)
+if _read_database_url == settings.DATABASE_URL:
+    read_engine = engine
+else:
+    read_engine = create_db_engine(_read_database_url, read_only=True)
+
+# Count and time every statement for the request metrics (see metrics.py)
+instrument_engine(engine)
+instrument_engine(read_engine)
 
 # Create a SessionLocal class for database sessions
 # Each request will use its own session
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Sessions for read-only requests
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+# Async engines and sessions (only with ASYNC_DB). An explicit
+# ASYNC_DATABASE_URL is used for reads as well. expire_on_commit is off
+# because an expired attribute can't be lazy-loaded outside the session's
+# greenlet.
+async_engine = None
+async_read_engine = None
+AsyncSessionLocal = None
+AsyncReadSessionLocal = None
+
+if settings.ASYNC_DB:
+    async_engine = create_async_db_engine(
+        settings.ASYNC_DATABASE_URL or get_async_database_url(settings.DATABASE_URL)
+    )
+    if read_engine is engine or settings.ASYNC_DATABASE_URL:
+        async_read_engine = async_engine
+    else:
+        async_read_engine = create_async_db_engine(get_async_database_url(_read_database_url), read_only=True)
+
+    instrument_engine(async_engine.sync_engine)
+    instrument_engine(async_read_engine.sync_engine)
+
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    AsyncReadSessionLocal = async_sessionmaker(async_read_engine, autoflush=False, expire_on_commit=False)
+
 # Base class for all database models
 Base = declarative_base()
+instrument_orm(Base)
 
+# Session key holding the time of the user's last committed write
+LAST_WRITE_KEY = "last_write_at"
 
-def get_db():
+T = TypeVar("T")
+
+
+@event.listens_for(Session, "after_commit")
+def _remember_commit(session):
+    """Flag sessions that committed, so get_db can start read-your-writes."""
+    session.info["committed"] = True
+
+
+def _recently_wrote(request: Request) -> bool:
+    """Whether the user committed a write within READ_YOUR_WRITES_SECONDS."""
+    last_write = request.session.get(LAST_WRITE_KEY)
+    return last_write is not None and time.time() - last_write < settings.READ_YOUR_WRITES_SECONDS
+
+
+def open_read_session(request: Request) -> Session:
+    """
+    Open a sync session for reads, following the same read-your-writes rule
+    as get_read_db. For code that outlives the request's own session, such
+    as streaming responses; the caller closes it.
+    """
+    return SessionLocal() if _recently_wrote(request) else ReadSessionLocal()
+
+
+def _get_sync_db(request: Request):
     """
     Dependency function to get database session.
 
@@ -36,9 +312,113 @@ def get_db():
     This ensures:
     - Each request gets its own database session
     - Session is properly closed after the request
+    - After a commit, the user's reads go to the primary for a few seconds
+      (see get_read_db)
     """
     db = SessionLocal()
     try:
         yield db
+        if db.info.get("committed"):
+            request.session[LAST_WRITE_KEY] = time.time()
     finally:
         db.close()
+
+
+def _get_sync_read_db(request: Request):
+    """
+    Dependency function to get a read-only database session.
+
+    Use it for endpoints that only read. Reads go to the read-only engine,
+    except for a user who wrote within the last READ_YOUR_WRITES_SECONDS:
+    they read from the primary so they always see their own changes.
+    """
+    db = open_read_session(request)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def _get_async_db(request: Request):
+    """Async version of the get_db dependency; yields an AsyncSession."""
+    async with AsyncSessionLocal() as db:
+        yield db
+        if db.sync_session.info.get("committed"):
+            request.session[LAST_WRITE_KEY] = time.time()
+
+
+async def _get_async_read_db(request: Request):
+    """Async version of the get_read_db dependency; yields an AsyncSession."""
+    session_factory = AsyncSessionLocal if _recently_wrote(request) else AsyncReadSessionLocal
+    async with session_factory() as db:
+        yield db
+
+
+# The dependencies used by the routes. With ASYNC_DB they yield an
+# AsyncSession; route code passes either kind of session to run_db.
+get_db = _get_async_db if settings.ASYNC_DB else _get_sync_db
+get_read_db = _get_async_read_db if settings.ASYNC_DB else _get_sync_read_db
+
+
+async def run_db(db: Union[Session, AsyncSession], func: Callable[..., T], *args) -> T:
+    """
+    Run database code written against a sync Session from an async endpoint.
+
+    With an AsyncSession the function runs through run_sync (on the event
+    loop, the driver's I/O is awaited); with a sync Session it runs in the
+    threadpool, like a plain "def" endpoint would.
+
+    The function should return plain data or pydantic models rather than
+    ORM objects that still need to load attributes.
+
+    Args:
+        db: Session from get_db or get_read_db
+        func: Function taking a sync Session as its first argument
+        *args: Further arguments for func
+
+    Returns:
+        Whatever func returns
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(func, *args)
+    return await run_in_threadpool(func, db, *args)
+
+
+async def dispose_engines():
+    """Close pooled connections of the async engines (on shutdown)."""
+    if async_read_engine is not None and async_read_engine is not async_engine:
+        await async_read_engine.dispose()
+    if async_engine is not None:
+        await async_engine.dispose()
+
+
+def init_db():
+    """
+    Bring the database up to date with the models.
+
+    Called once on application startup. This:
+    - Creates any tables that don't exist yet (with their indexes)
+    - Creates the full-text search index (when SQLite supports FTS5)
+    - Creates the triggers that keep ResourceVersions up to date
+    - Applies the schema migrations this database hasn't had (migrations.py)
+    - Lets SQLite refresh stale query planner statistics
+
+    Everything runs in one transaction, so several workers starting at
+    the same time do the setup one after another.
+    """
+    import models  # registers all models on Base.metadata
+    import migrations
+
+    with engine.begin() as connection:
+        if connection.dialect.name == "sqlite":
+            # Take the write lock up front (SQLite would otherwise let
+            # two workers check for a table before either creates it)
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+        Base.metadata.create_all(bind=connection)
+
+        models.create_search_index(connection)
+        models.create_version_triggers(connection)
+
+        migrations.upgrade(connection)
+        migrations.optimize(connection)
@@ -0,0 +1,212 @@
+"""
+Live group discussion feed.
+A new post is written to the database once, serialized once, and then
+handed to every open feed connection of its group in this process
+(server-sent events, see routes/group_routes.py).
+
+Each connection has a bounded queue. A client that doesn't read fast
+enough fills its queue and is disconnected instead of making the server
+buffer more; it reconnects with the id of the last post it got and
+catches up from the database.
+
+Posts are published by one watcher task per process that reads new posts
+from the database in post_id order: it is woken by each post created in
+this process, so clients get posts in order even when two requests commit
+at the same time. Fan-out is per worker process; with several workers, set
+FEED_POLL_SECONDS so each watcher also looks for posts written by the
+other workers (one query per worker per interval, however many clients
+are connected).
+"""
+
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from config import settings
+from models import GroupPost, User
+from schemas import PostResponse
+
+logger = logging.getLogger(__name__)
+
+
+def posts_query():
+    """Group posts with their author's name, oldest first."""
+    return (
+        select(
+            GroupPost.post_id,
+            GroupPost.group_id,
+            GroupPost.user_id,
+            GroupPost.content,
+            GroupPost.book_id,
+            User.name.label("user_name")
+        )
+        .join(User, User.user_id == GroupPost.user_id)
+        .order_by(GroupPost.post_id)
+    )
+
+
+def posts_after(db: Session, after_post_id: int, limit: int, group_id: Optional[int] = None) -> List[PostResponse]:
+    """
+    Load posts newer than a post id, oldest first.
+
+    Args:
+        db: Database session
+        after_post_id: Only posts with a higher post_id
+        limit: Maximum number of posts
+        group_id: Only posts of this group (all groups if None)
+
+    Returns:
+        The posts, in post_id order
+    """
+    query = posts_query().where(GroupPost.post_id > after_post_id)
+    if group_id is not None:
+        query = query.where(GroupPost.group_id == group_id)
+    return [PostResponse(**row._mapping) for row in db.execute(query.limit(limit))]
+
+
+def format_event(post: PostResponse) -> str:
+    """A post as a server-sent event; its id lets the client resume."""
+    return f"id: {post.post_id}\nevent: post\ndata: {post.model_dump_json()}\n\n"
+
+
+class Subscription:
+    """One open feed connection: a bounded queue of (post_id, event)."""
+
+    def __init__(self, group_id: int, queue_size: int):
+        self.group_id = group_id
+        self.queue: "asyncio.Queue[Tuple[int, str]]" = asyncio.Queue(maxsize=queue_size)
+        # Set when the queue overflowed; the connection ends once drained
+        self.overflowed = False
+
+
+class FeedBroker:
+    """
+    Hands new posts to the subscriptions of their group.
+
+    Only used from the event loop thread, so it needs no locks.
+
+    Args:
+        queue_size: Events a subscription may have waiting before it is
+            dropped as too slow
+    """
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self._subscriptions: Dict[int, Set[Subscription]] = defaultdict(set)
+        # Set while watch_database runs; it publishes every post
+        self.watcher_wakeup: Optional[asyncio.Event] = None
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, group_id: int) -> Subscription:
+        subscription = Subscription(group_id, self.queue_size)
+        self._subscriptions[group_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscriptions = self._subscriptions.get(subscription.group_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.group_id]
+
+    def post_created(self, post: PostResponse):
+        """Publish a post this process has just committed."""
+        if self.watcher_wakeup is not None:
+            # The watcher publishes all posts in post_id order
+            self.watcher_wakeup.set()
+        else:
+            self.publish(post)
+
+    def publish(self, post: PostResponse) -> int:
+        """
+        Hand a committed post to its group's subscriptions.
+
+        Returns:
+            Number of subscriptions that got it
+        """
+        self.published += 1
+
+        subscriptions = self._subscriptions.get(post.group_id)
+        if not subscriptions:
+            return 0
+
+        event = (post.post_id, format_event(post))
+        delivered = 0
+        for subscription in list(subscriptions):
+            try:
+                subscription.queue.put_nowait(event)
+                delivered += 1
+            except asyncio.QueueFull:
+                # Too slow: stop feeding it; it resumes from the database
+                subscription.overflowed = True
+                self.unsubscribe(subscription)
+                self.dropped += 1
+        return delivered
+
+    def stats(self) -> dict:
+        """Counters for /health/feed."""
+        return {
+            "groups": len(self._subscriptions),
+            "subscribers": sum(len(subscriptions) for subscriptions in self._subscriptions.values()),
+            "published": self.published,
+            "dropped_slow_subscribers": self.dropped,
+            "queue_size": self.queue_size,
+        }
+
+
+broker = FeedBroker(settings.FEED_QUEUE_SIZE)
+
+
+async def watch_database(session_factory, interval: float, batch_size: int = 500):
+    """
+    Publish new posts in post_id order.
+
+    Runs until cancelled. Reads the posts newer than the last one it
+    published whenever this process creates a post, and also every
+    `interval` seconds (for posts written by other worker processes).
+
+    Args:
+        session_factory: Creates the (sync) sessions to read posts with
+        interval: Seconds between checks; 0 = only when woken
+        batch_size: Posts read per query
+    """
+    def newest_post_id() -> int:
+        with session_factory() as db:
+            return db.execute(
+                select(GroupPost.post_id).order_by(GroupPost.post_id.desc()).limit(1)
+            ).scalar() or 0
+
+    def load(after_post_id: int) -> List[PostResponse]:
+        with session_factory() as db:
+            return posts_after(db, after_post_id, batch_size)
+
+    wakeup = asyncio.Event()
+    # Posts from before startup are not live news
+    last_post_id = await run_in_threadpool(newest_post_id)
+    broker.watcher_wakeup = wakeup
+
+    try:
+        while True:
+            try:
+                await asyncio.wait_for(wakeup.wait(), interval or None)
+            except asyncio.TimeoutError:
+                pass
+            wakeup.clear()
+
+            try:
+                while True:
+                    posts = await run_in_threadpool(load, last_post_id)
+                    for post in posts:
+                        broker.publish(post)
+                    if posts:
+                        last_post_id = posts[-1].post_id
+                    if len(posts) < batch_size:
+                        break
+            except Exception:
+                logger.exception("Checking for new group posts failed")
+    finally:
+        broker.watcher_wakeup = None
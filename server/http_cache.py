@@ -0,0 +1,195 @@
+"""
+HTTP conditional requests (ETag / Last-Modified / 304 Not Modified).
+ETags are built from cheap per-resource versions (ResourceVersions
+counters, or the newest comment of a book) instead of from the response
+body, so a repeat visit is answered with a 304 before any response is
+built or serialized.
+"""
+
+import hashlib
+from datetime import timezone
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Iterable, Optional
+from fastapi import Request, Response, status
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from config import settings
+from models import Book, BookComment, ResourceVersion, has_version_triggers
+
+
+class Validators:
+    """
+    ETag and Last-Modified of one response, plus its caching policy.
+
+    `version` is the data version the ETag was built from (the catalog
+    version for catalog responses); a body taken from a cache must have
+    been loaded at that same version.
+    """
+
+    def __init__(self, etag: str, last_modified: Optional[float] = None,
+                 private: bool = False, vary_cookie: bool = False, version: Optional[int] = None):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.private = private
+        self.vary_cookie = vary_cookie
+        self.version = version
+
+    def headers(self) -> Dict[str, str]:
+        """Response headers that go on both 200 and 304 responses."""
+        headers = {
+            "ETag": self.etag,
+            # Clients may keep a copy but must revalidate before using it;
+            # per-user responses must not be stored by shared caches
+            "Cache-Control": f"{'private' if self.private else 'public'}, no-cache",
+        }
+        if self.vary_cookie:
+            # The content depends on who is logged in (the session cookie)
+            headers["Vary"] = "Cookie"
+        if self.last_modified is not None:
+            headers["Last-Modified"] = formatdate(self.last_modified, usegmt=True)
+        return headers
+
+    def is_fresh(self, request: Request) -> bool:
+        """
+        Whether the client's copy is still current (RFC 9110 section 13.2.2):
+        If-None-Match wins over If-Modified-Since when both are sent.
+        """
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            return etag_matches(if_none_match, self.etag)
+
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since and self.last_modified is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(self.last_modified) <= since
+
+        return False
+
+    def not_modified(self) -> Response:
+        """An empty 304 response carrying the validators."""
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=self.headers())
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against our ETag."""
+    if if_none_match.strip() == "*":
+        return True
+    ours = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == ours:
+            return True
+    return False
+
+
+def make_etag(*parts) -> str:
+    """
+    Build a weak ETag from the values a response depends on.
+
+    Weak, because the same data may be sent with different bytes (e.g.
+    compressed or not).
+    """
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def get_resource_versions(db: Session, resources: Iterable[str]) -> Dict[str, tuple]:
+    """
+    Read the ResourceVersions counters of some resources.
+
+    Args:
+        db: Database session
+        resources: Resource names, e.g. "catalog" or "user:7"
+
+    Returns:
+        Mapping of resource to (version, updated_at); resources never
+        written are missing
+    """
+    rows = db.query(
+        ResourceVersion.resource, ResourceVersion.version, ResourceVersion.updated_at
+    ).filter(ResourceVersion.resource.in_(list(resources))).all()
+    return {resource: (version, updated_at) for resource, version, updated_at in rows}
+
+
+def catalog_version(db: Session) -> Optional[int]:
+    """
+    The catalog version that catalog_validators puts on its Validators, for
+    routes that use the book cache without sending an ETag.
+
+    Returns:
+        The version, or None if HTTP caching is off or versions are not
+        tracked for this database
+    """
+    if not settings.HTTP_CACHE_ENABLED or not has_version_triggers(db):
+        return None
+    return get_resource_versions(db, ["catalog"]).get("catalog", (0, None))[0]
+
+
+def catalog_validators(db: Session, user_id: Optional[int], variant: str) -> Optional[Validators]:
+    """
+    Validators for catalog responses (book lists and book details).
+
+    These depend on the catalog version and, for a logged-in user, on that
+    user's purchases and ratings.
+
+    Args:
+        db: Database session
+        user_id: ID of the current user, or None for guests
+        variant: Anything else the response depends on (path and query string)
+
+    Returns:
+        Validators, or None if versions are not tracked for this database
+    """
+    if not settings.HTTP_CACHE_ENABLED or not has_version_triggers(db):
+        return None
+
+    resources = ["catalog"] + ([f"user:{user_id}"] if user_id else [])
+    versions = get_resource_versions(db, resources)
+
+    etag = make_etag(variant, user_id, [versions.get(resource, (0, None))[0] for resource in resources])
+    updated = [updated_at for _, updated_at in versions.values() if updated_at]
+    # Without a timestamp for every resource, only the ETag is reliable
+    last_modified = max(updated) if len(updated) == len(resources) else None
+
+    return Validators(
+        etag, last_modified, private=bool(user_id), vary_cookie=True,
+        version=versions.get("catalog", (0, None))[0]
+    )
+
+
+def comments_validators(db: Session, book_id: int, variant: str) -> Optional[Validators]:
+    """
+    Validators for a book's comment list, from the newest comment and the
+    number of comments (comments can't be edited).
+
+    Args:
+        db: Database session
+        book_id: ID of the book
+        variant: Anything else the response depends on (path and query string)
+
+    Returns:
+        Validators, or None if the book does not exist or HTTP caching is off
+    """
+    if not settings.HTTP_CACHE_ENABLED:
+        return None
+
+    row = db.query(
+        func.count(BookComment.comment_id),
+        func.max(BookComment.comment_id),
+        func.max(BookComment.created_at)
+    ).select_from(Book).outerjoin(
+        BookComment, BookComment.book_id == Book.book_id
+    ).filter(Book.book_id == book_id).group_by(Book.book_id).first()
+
+    if row is None:
+        return None
+
+    count, newest_id, newest_at = row
+    # created_at is stored as naive UTC
+    last_modified = newest_at.replace(tzinfo=timezone.utc).timestamp() if newest_at is not None else None
+    return Validators(make_etag(variant, count, newest_id), last_modified)
@@ -0,0 +1,88 @@
+"""
+Idempotency-Key support for write endpoints.
+A client sends the same Idempotency-Key header when retrying a request;
+the first successful response is stored and replayed for the retries, so
+the write itself only ever happens once.
+"""
+
+import json
+from datetime import datetime, timedelta
+from typing import Optional
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse
+from sqlalchemy.orm import Session
+from config import settings
+from models import IdempotencyKey
+
+
+def get_stored_response(db: Session, user_id: int, key: str, request_path: str) -> Optional[JSONResponse]:
+    """
+    Look up the stored response for an idempotency key.
+
+    Expired keys are deleted so the key can be used again.
+
+    Args:
+        db: Database session
+        user_id: ID of the user who sent the request
+        key: Value of the Idempotency-Key header
+        request_path: Path of the current request
+
+    Returns:
+        The original response, or None if the key hasn't been used yet
+
+    Raises:
+        HTTPException: If the key was already used for a different request
+    """
+    stored = db.query(IdempotencyKey).filter(
+        IdempotencyKey.user_id == user_id,
+        IdempotencyKey.key == key
+    ).first()
+
+    if not stored:
+        return None
+
+    expires_at = stored.created_at + timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS)
+    if expires_at < datetime.utcnow():
+        db.delete(stored)
+        db.commit()
+        return None
+
+    if stored.request_path != request_path:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Idempotency-Key was already used for a different request"
+        )
+
+    return JSONResponse(
+        status_code=stored.status_code,
+        content=json.loads(stored.response_body)
+    )
+
+
+def store_response(db: Session, user_id: int, key: str, request_path: str, status_code: int, body: dict):
+    """
+    Remember the response for an idempotency key.
+
+    Must be called in the same transaction as the write it describes, so
+    either both are committed or neither is; the caller commits.
+    """
+    db.add(IdempotencyKey(
+        user_id=user_id,
+        key=key,
+        request_path=request_path,
+        status_code=status_code,
+        response_body=json.dumps(body)
+    ))
+
+
+def purge_expired_keys(db: Session) -> int:
+    """
+    Delete stored responses older than IDEMPOTENCY_KEY_TTL_HOURS. The caller commits.
+
+    Returns:
+        Number of keys deleted
+    """
+    cutoff = datetime.utcnow() - timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS)
+    return db.query(IdempotencyKey).filter(
+        IdempotencyKey.created_at < cutoff
+    ).delete(synchronize_session=False)
@@ -0,0 +1,53 @@
+"""
+Fast JSON responses.
+FastAPI validates whatever an endpoint returns against its response_model
+and then serializes it with its generic encoder. For objects the endpoint
+has just built from pydantic schemas that work is done twice. Returning a
+FastJSONResponse skips it: pydantic models are dumped by their own
+(compiled) serializer and everything else by orjson when it is installed.
+"""
+
+from typing import Any
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response for content that is already valid.
+
+    Endpoints returning one keep their response_model for the API docs;
+    FastAPI does not re-validate a Response object.
+
+    Args:
+        content: A pydantic model, or plain data (which may contain models)
+        exclude_unset: Leave out model fields that were never set, like
+            response_model_exclude_unset=True
+        **kwargs: status_code, headers, ... as for JSONResponse
+    """
+
+    def __init__(self, content: Any, exclude_unset: bool = False, **kwargs):
+        # render() runs inside JSONResponse.__init__
+        self.exclude_unset = exclude_unset
+        super().__init__(content, **kwargs)
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, BaseModel):
+            return content.model_dump_json(exclude_unset=self.exclude_unset).encode("utf-8")
+
+        if orjson is not None:
+            return orjson.dumps(content, default=self._dump_model)
+
+        return super().render(jsonable_encoder(content, exclude_unset=self.exclude_unset))
+
+    def _dump_model(self, value: Any) -> Any:
+        """orjson hook for types it doesn't know (pydantic models in lists)."""
+        if isinstance(value, BaseModel):
+            return value.model_dump(mode="json", exclude_unset=self.exclude_unset)
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
@@ -0,0 +1,432 @@
+"""
+Book leaderboards: trending, top-rated and most-purchased.
+
+Each worker process keeps the three boards in memory as lists sorted by
+score, so GET /api/leaderboards/{board} reads the first K entries whatever
+the size of the catalog. The boards are kept up to date incrementally:
+triggers log every purchase, refund, rating and comment in
+PopularityEvents (see models.py), and every LEADERBOARD_REFRESH_SECONDS
+each worker folds the events after the last one it saw into its boards,
+in event_id order (one primary key range read). All workers see the same
+events in the same order, so they hold the same scores.
+
+- trending: purchases, new ratings and comments (TRENDING_WEIGHTS), each
+  decaying by half every LEADERBOARD_TRENDING_HALF_LIFE_HOURS. Decay is
+  never applied to stored scores: an event at time t adds
+  weight * 2^(t / half-life), which ranks books exactly as the decayed sum
+  does at any later time. Scores are kept as log2 of that sum, so they
+  never overflow; the current score is 2^(stored - now / half-life).
+- top-rated: average stars pulled towards RATING_PRIOR_MEAN by
+  LEADERBOARD_RATING_PRIOR imaginary ratings, so one 5-star rating does
+  not top the board (running totals from BookRatingStats)
+- most-purchased: purchases minus refunds, all time
+
+Every LEADERBOARD_SNAPSHOT_SECONDS the scores that changed are written to
+BookPopularity with the last event they include (PopularitySnapshot).
+A starting worker loads the snapshot and replays the events after it;
+events older than the snapshot and EVENT_RETENTION_SECONDS are purged.
+Snapshots can't be turned off: until one covers them, the events are
+the only record of purchases (most-purchased counts all of them), so
+without snapshots PopularityEvents would grow without bound.
+The first snapshot is built from the tables: purchases and ratings carry
+no time, so they count as of that moment; comments count from when they
+were written.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from bisect import bisect_left, insort
+from datetime import timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.engine import Connection, Engine
+from config import settings
+from models import BookComment, BookPopularity, BookRatingStats, PopularityEvent, PopularitySnapshot, UserBooksRead
+
+logger = logging.getLogger(__name__)
+
+# Board names, as used in the URL
+BOARDS = ("trending", "top-rated", "most-purchased")
+
+# How much each kind of event adds to a book's trending score
+TRENDING_WEIGHTS = {"purchase": 3.0, "rating": 1.0, "comment": 1.0}
+
+# Average the top-rated board pulls books with few ratings towards
+RATING_PRIOR_MEAN = 3.0
+
+# Events kept after they are in a snapshot, for workers that are behind
+EVENT_RETENTION_SECONDS = 3600
+
+# Events read per query
+EVENT_BATCH_SIZE = 1000
+
+# Ids per IN (...) list
+_CHUNK = 500
+
+# (event_id, book_id, kind, created_at)
+Event = Tuple[int, int, str, int]
+
+
+class RankedScores:
+    """Scores by book, plus the books ordered best first (ties: lower book_id)."""
+
+    def __init__(self, scores: Optional[Dict[int, float]] = None):
+        self._scores: Dict[int, float] = dict(scores or {})
+        self._order: List[Tuple[float, int]] = sorted((-score, book_id) for book_id, score in self._scores.items())
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def get(self, book_id: int) -> Optional[float]:
+        return self._scores.get(book_id)
+
+    def set(self, book_id: int, score: float):
+        self.remove(book_id)
+        self._scores[book_id] = score
+        insort(self._order, (-score, book_id))
+
+    def remove(self, book_id: int):
+        old = self._scores.pop(book_id, None)
+        if old is not None:
+            del self._order[bisect_left(self._order, (-old, book_id))]
+
+    def top(self, limit: int) -> List[Tuple[int, float]]:
+        """The best `limit` (book_id, score) pairs."""
+        return [(book_id, -score) for score, book_id in self._order[:limit]]
+
+
+def _log_add(a: Optional[float], b: float) -> float:
+    """log2(2^a + 2^b), without leaving log space."""
+    if a is None:
+        return b
+    high, low = max(a, b), min(a, b)
+    return high + math.log2(1.0 + 2.0 ** (low - high))
+
+
+def _half_life() -> float:
+    return settings.LEADERBOARD_TRENDING_HALF_LIFE_HOURS * 3600
+
+
+def _bayesian_average(rating_sum: int, rating_count: int) -> float:
+    prior = settings.LEADERBOARD_RATING_PRIOR
+    return (rating_sum + prior * RATING_PRIOR_MEAN) / (rating_count + prior)
+
+
+class Leaderboards:
+    """The boards of one worker process, as of event `event_id`."""
+
+    def __init__(self, event_id: int = 0, trending: Optional[Dict[int, float]] = None,
+                 purchases: Optional[Dict[int, int]] = None, top_rated: Optional[Dict[int, float]] = None):
+        self.event_id = event_id
+        self.trending = RankedScores(trending)
+        self.purchases = RankedScores(purchases)
+        self.top_rated = RankedScores(top_rated)
+        # Books whose trending / purchase scores changed since the last snapshot
+        self.dirty: Set[int] = set()
+
+    def top(self, board: str, limit: int) -> List[Tuple[int, float]]:
+        """
+        The best books of a board.
+
+        Args:
+            board: One of BOARDS
+            limit: Number of books
+
+        Returns:
+            (book_id, score) pairs, best first; trending scores are the
+            decayed activity as of now
+        """
+        if board == "trending":
+            now = time.time() / _half_life()
+            return [(book_id, 2.0 ** (score - now)) for book_id, score in self.trending.top(limit)]
+        if board == "top-rated":
+            return self.top_rated.top(limit)
+        return self.purchases.top(limit)
+
+    def apply(self, events: Iterable[Event], rating_stats: Dict[int, Tuple[int, int]]):
+        """
+        Fold new events into the boards.
+
+        Args:
+            events: Events after self.event_id, in event_id order
+            rating_stats: book_id -> (rating_sum, rating_count) of the books
+                with rating events
+        """
+        # Combine each book's events first, so a busy book is re-sorted once
+        half_life = _half_life()
+        trending: Dict[int, Optional[float]] = {}
+        purchases: Dict[int, int] = {}
+        for event_id, book_id, kind, created_at in events:
+            weight = TRENDING_WEIGHTS.get(kind)
+            if weight:
+                current = trending[book_id] if book_id in trending else self.trending.get(book_id)
+                trending[book_id] = _log_add(current, math.log2(weight) + created_at / half_life)
+            if kind in ("purchase", "refund"):
+                purchases[book_id] = purchases.get(book_id, 0) + (1 if kind == "purchase" else -1)
+            self.event_id = event_id
+
+        for book_id, score in trending.items():
+            self.trending.set(book_id, score)
+        for book_id, change in purchases.items():
+            count = (self.purchases.get(book_id) or 0) + change
+            if count > 0:
+                self.purchases.set(book_id, count)
+            else:
+                self.purchases.remove(book_id)
+        self.dirty.update(trending)
+        self.dirty.update(purchases)
+
+        for book_id, (rating_sum, rating_count) in rating_stats.items():
+            if rating_count:
+                self.top_rated.set(book_id, _bayesian_average(rating_sum, rating_count))
+            else:
+                self.top_rated.remove(book_id)
+
+    def take_snapshot(self) -> Tuple[int, List[Tuple[int, Optional[float], int]]]:
+        """The event id and the changed rows for write_snapshot; clears the dirty set."""
+        rows = [
+            (book_id, self.trending.get(book_id), int(self.purchases.get(book_id) or 0))
+            for book_id in sorted(self.dirty)
+        ]
+        self.dirty = set()
+        return self.event_id, rows
+
+
+# ============================================================================
+# Database
+# ============================================================================
+
+def _rating_stats(connection: Connection, book_ids: Optional[Iterable[int]] = None) -> Dict[int, Tuple[int, int]]:
+    """book_id -> (rating_sum, rating_count), for the given books or all of them."""
+    query = select(BookRatingStats.book_id, BookRatingStats.rating_sum, BookRatingStats.rating_count)
+    if book_ids is None:
+        return {book_id: (rating_sum, count) for book_id, rating_sum, count in connection.execute(query)}
+
+    book_ids = sorted(book_ids)
+    stats = {book_id: (0, 0) for book_id in book_ids}
+    for start in range(0, len(book_ids), _CHUNK):
+        stats.update(
+            (book_id, (rating_sum, count)) for book_id, rating_sum, count in connection.execute(
+                query.where(BookRatingStats.book_id.in_(book_ids[start:start + _CHUNK]))
+            )
+        )
+    return stats
+
+
+def read_events(engine: Engine, after: int) -> Tuple[List[Event], Dict[int, Tuple[int, int]], int]:
+    """
+    Read the events after an event id.
+
+    Returns:
+        Up to EVENT_BATCH_SIZE events, the rating totals of the books they
+        rate, and the event id PopularityEvents is purged through (a worker
+        behind that has missed events and must reload)
+    """
+    with engine.connect() as connection:
+        purged_through = connection.execute(select(PopularitySnapshot.purged_through)).scalar() or 0
+        events = [tuple(row) for row in connection.execute(
+            select(PopularityEvent.event_id, PopularityEvent.book_id, PopularityEvent.kind, PopularityEvent.created_at)
+            .where(PopularityEvent.event_id > after)
+            .order_by(PopularityEvent.event_id)
+            .limit(EVENT_BATCH_SIZE)
+        )]
+        rated = {book_id for _, book_id, kind, _ in events if kind in ("rating", "rating_change")}
+        stats = _rating_stats(connection, rated) if rated else {}
+    return events, stats, purged_through
+
+
+def _build_scores(connection: Connection) -> Tuple[Dict[int, float], Dict[int, int]]:
+    """Trending and purchase scores from the tables (for the first snapshot)."""
+    half_life = _half_life()
+    now = time.time() / half_life
+    trending: Dict[int, float] = {}
+
+    purchases = dict(connection.execute(
+        select(UserBooksRead.book_id, func.count()).group_by(UserBooksRead.book_id)
+    ).all())
+    for book_id, count in purchases.items():
+        trending[book_id] = math.log2(count * TRENDING_WEIGHTS["purchase"]) + now
+    for book_id, (_, count) in _rating_stats(connection).items():
+        if count:
+            trending[book_id] = _log_add(trending.get(book_id), math.log2(count * TRENDING_WEIGHTS["rating"]) + now)
+
+    comment = math.log2(TRENDING_WEIGHTS["comment"])
+    for book_id, created_at in connection.execute(select(BookComment.book_id, BookComment.created_at)):
+        if created_at is not None:
+            seconds = created_at.replace(tzinfo=timezone.utc).timestamp()
+            trending[book_id] = _log_add(trending.get(book_id), comment + seconds / half_life)
+
+    return trending, purchases
+
+
+def write_snapshot(engine: Engine, event_id: int, rows: List[Tuple[int, Optional[float], int]],
+                   replace: bool = False) -> bool:
+    """
+    Store changed scores as of an event, unless a newer snapshot exists,
+    and purge the events it makes unnecessary.
+
+    Args:
+        engine: Engine of the database
+        event_id: Last event the scores include
+        rows: (book_id, trending, purchases) of the books that changed
+        replace: The rows are every score (a rebuild): drop the old ones
+
+    Returns:
+        True if written, False if another worker already wrote a newer one
+    """
+    now = int(time.time())
+    with engine.begin() as connection:
+        if connection.dialect.name == "sqlite":
+            # Take the write lock before checking the snapshot's event id
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+        current = connection.execute(select(PopularitySnapshot)).first()
+        if current is not None and not replace and current.event_id >= event_id:
+            return False
+
+        if replace:
+            connection.execute(delete(BookPopularity))
+        else:
+            book_ids = [book_id for book_id, _, _ in rows]
+            for start in range(0, len(book_ids), _CHUNK):
+                connection.execute(delete(BookPopularity).where(BookPopularity.book_id.in_(book_ids[start:start + _CHUNK])))
+        kept = [
+            {"book_id": book_id, "trending": trending, "purchases": purchases}
+            for book_id, trending, purchases in rows if trending is not None or purchases
+        ]
+        if kept:
+            connection.execute(insert(BookPopularity), kept)
+
+        purge_to = connection.execute(
+            select(func.max(PopularityEvent.event_id)).where(
+                PopularityEvent.event_id <= event_id,
+                PopularityEvent.created_at < now - EVENT_RETENTION_SECONDS,
+            )
+        ).scalar() or 0
+        if purge_to:
+            connection.execute(delete(PopularityEvent).where(PopularityEvent.event_id <= purge_to))
+        purged_through = max(purge_to, current.purged_through if current is not None else 0)
+
+        if current is None:
+            connection.execute(insert(PopularitySnapshot).values(
+                snapshot_id=1, event_id=event_id, purged_through=purged_through, taken_at=now
+            ))
+        else:
+            connection.execute(update(PopularitySnapshot).values(
+                event_id=event_id, purged_through=purged_through, taken_at=now
+            ))
+    return True
+
+
+def rebuild(engine: Engine) -> int:
+    """
+    Recompute the snapshot from the tables (e.g. after changing the
+    weights or the half-life). Run it while the app is stopped: workers
+    only read the snapshot when they start.
+
+    Returns:
+        Number of books with a score
+    """
+    with engine.connect() as connection:
+        event_id = connection.execute(select(func.max(PopularityEvent.event_id))).scalar() or 0
+        trending, purchases = _build_scores(connection)
+
+    rows = [(book_id, trending.get(book_id), purchases.get(book_id, 0)) for book_id in sorted(set(trending) | set(purchases))]
+    write_snapshot(engine, event_id, rows, replace=True)
+    return len(rows)
+
+
+def load(engine: Engine) -> Leaderboards:
+    """
+    Load the boards from the snapshot (building it first if there is none)
+    and the rating totals. The events after the snapshot are folded in by
+    the next refresh.
+    """
+    with engine.connect() as connection:
+        has_snapshot = connection.execute(select(PopularitySnapshot.event_id)).first() is not None
+    if not has_snapshot:
+        rebuild(engine)
+
+    with engine.connect() as connection:
+        event_id = connection.execute(select(PopularitySnapshot.event_id)).scalar() or 0
+        trending, purchases = {}, {}
+        for book_id, score, count in connection.execute(
+            select(BookPopularity.book_id, BookPopularity.trending, BookPopularity.purchases)
+        ):
+            if score is not None:
+                trending[book_id] = score
+            if count:
+                purchases[book_id] = count
+        top_rated = {
+            book_id: _bayesian_average(rating_sum, count)
+            for book_id, (rating_sum, count) in _rating_stats(connection).items() if count
+        }
+    return Leaderboards(event_id, trending, purchases, top_rated)
+
+
+if settings.LEADERBOARD_SNAPSHOT_SECONDS <= 0:
+    raise ValueError(
+        f"LEADERBOARD_SNAPSHOT_SECONDS must be positive (got {settings.LEADERBOARD_SNAPSHOT_SECONDS}): "
+        "PopularityEvents is only purged up to the last snapshot"
+    )
+
+# The boards of this process (replaced by start())
+boards = Leaderboards()
+
+
+async def refresh(engine: Engine):
+    """Fold every new event into the boards (reloading them if too far behind)."""
+    global boards
+    while True:
+        events, stats, purged_through = await run_in_threadpool(read_events, engine, boards.event_id)
+        if purged_through > boards.event_id:
+            logger.warning("Leaderboards missed purged events; reloading the snapshot")
+            boards = await run_in_threadpool(load, engine)
+            continue
+        boards.apply(events, stats)
+        if len(events) < EVENT_BATCH_SIZE:
+            return
+
+
+async def save_snapshot(engine: Engine):
+    """Write the scores that changed since the last snapshot."""
+    event_id, rows = boards.take_snapshot()
+    try:
+        await run_in_threadpool(write_snapshot, engine, event_id, rows)
+    except Exception:
+        boards.dirty.update(book_id for book_id, _, _ in rows)
+        raise
+
+
+async def start(engine: Engine):
+    """Load the boards of this process and catch up with the events."""
+    global boards
+    boards = await run_in_threadpool(load, engine)
+    await refresh(engine)
+
+
+async def maintain(engine: Engine, refresh_interval: float, snapshot_interval: float):
+    """
+    Keep the boards current until cancelled: refresh every
+    `refresh_interval` seconds, snapshot every `snapshot_interval` seconds
+    and once more when cancelled.
+    """
+    last_snapshot = time.monotonic()
+    try:
+        while True:
+            await asyncio.sleep(refresh_interval)
+            try:
+                await refresh(engine)
+                if time.monotonic() - last_snapshot >= snapshot_interval:
+                    await save_snapshot(engine)
+                    last_snapshot = time.monotonic()
+            except Exception:
+                logger.exception("Updating the leaderboards failed")
+    finally:
+        if boards.dirty:
+            try:
+                await save_snapshot(engine)
+            except Exception:
+                logger.exception("Saving the leaderboard snapshot failed")
@@ -2,25 +2,87 @@
 Main FastAPI application for Book Club API.
 """
 
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, status
+from fastapi.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.middleware.sessions import SessionMiddleware
+from fastapi.concurrency import run_in_threadpool
+import catalog_cache
+import group_feed
+import leaderboards
+import media
+import metrics
+import recommendations
+import write_behind
 from config import settings
-from routes import auth_routes, book_routes
+from compression import CompressionMiddleware
+from database import SessionLocal, engine, init_db, dispose_engines
+from auth import shutdown_password_executor
+from sessions import ServerSessionMiddleware, create_session_store
+from routes import auth_routes, book_routes, group_routes, media_routes, recommendation_routes, leaderboard_routes
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Application startup/shutdown.
+    Makes sure the database has all tables and indexes before serving requests,
+    indexes the media files, loads the leaderboards and starts the group feed
+    publisher, the leaderboard refresh (and the recommendation refresh and
+    write-behind writer, if enabled); commits the queued writes and stops
+    them, the password hashing pool, async engines and session store on
+    shutdown.
+    """
+    init_db()
+    await run_in_threadpool(media.library.scan)
+    await leaderboards.start(engine)
+    tasks = [
+        asyncio.create_task(group_feed.watch_database(SessionLocal, settings.FEED_POLL_SECONDS)),
+        asyncio.create_task(leaderboards.maintain(
+            engine, settings.LEADERBOARD_REFRESH_SECONDS, settings.LEADERBOARD_SNAPSHOT_SECONDS
+        )),
+    ]
+    if settings.RECOMMENDATION_REFRESH_SECONDS > 0:
+        tasks.append(asyncio.create_task(
+            recommendations.refresh_periodically(engine, settings.RECOMMENDATION_REFRESH_SECONDS)
+        ))
+    writer = None
+    if settings.WRITE_BEHIND_ENABLED:
+        writer = write_behind.writer.start(SessionLocal)
+    yield
+    if writer is not None:
+        # Queued writes are committed before anything else stops
+        await write_behind.writer.stop()
+        await writer
+    for task in tasks:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    shutdown_password_executor()
+    await dispose_engines()
+    await session_store.close()
+
 
 # Create FastAPI application
 app = FastAPI(
     title=settings.APP_NAME,
-    debug=settings.DEBUG
+    debug=settings.DEBUG,
+    lifespan=lifespan
 )
 
 # Add session middleware for authentication
-# This allows us to store user sessions
+# Sessions live in the session store (SESSION_STORE); the cookie holds only
+# the session id
+session_store = create_session_store()
 app.add_middleware(
-    SessionMiddleware,
+    ServerSessionMiddleware,
+    store=session_store,
     secret_key=settings.SECRET_KEY,
     session_cookie=settings.SESSION_COOKIE_NAME,
-    max_age=86400,  # 24 hours in seconds
+    max_age=settings.SESSION_MAX_AGE,
     same_site="lax",
     https_only=False  # Set to True in production with HTTPS
 )
@@ -34,6 +96,22 @@ app.add_middleware(
     allow_headers=["*"],  # Allow all headers
 )
 
+# Compress large text/JSON responses (added last, so it wraps everything)
+app.add_middleware(
+    CompressionMiddleware,
+    encodings=[name.strip() for name in settings.COMPRESSION_ENCODINGS.split(",") if name.strip()],
+    minimum_size=settings.COMPRESSION_MINIMUM_SIZE,
+    levels={
+        "gzip": settings.GZIP_LEVEL,
+        "br": settings.BROTLI_QUALITY,
+        "zstd": settings.ZSTD_LEVEL,
+    }
+)
+
+# Per-route latency and SQL metrics for /metrics, plus the Server-Timing
+# header (outermost, so the timings cover every other middleware)
+app.add_middleware(metrics.MetricsMiddleware, server_timing=settings.SERVER_TIMING_ENABLED)
+
 
 @app.get("/")
 def root():
@@ -55,12 +133,62 @@ def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/health/cache")
+def cache_stats():
+    """
+    Catalog cache counters for this worker process (hits, misses,
+    evictions, ...), for sizing CATALOG_CACHE_SIZE / CATALOG_PAGE_CACHE_SIZE.
+    """
+    return catalog_cache.stats()
+
+
+@app.get("/health/feed")
+async def feed_stats():
+    """
+    Group feed counters for this worker process: open subscriptions,
+    published posts and subscribers dropped for reading too slowly.
+    """
+    return group_feed.broker.stats()
+
+
+@app.get("/health/writes")
+async def write_stats():
+    """
+    Write-behind queue counters for this worker process: queued writes,
+    batches committed, average batch size and writes shed with 503.
+    """
+    return write_behind.writer.stats()
+
+
+@app.get("/health/media")
+def media_stats():
+    """
+    Media index counters: files served, duplicate copies folded into one
+    URL, and whether thumbnails are available (Pillow installed).
+    """
+    return media.library.stats()
+
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """
+    Request, SQL and bcrypt metrics of this worker process in the
+    Prometheus text format (see metrics.py).
+    """
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    return Response(metrics.registry.expose(), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+
 # Include routers
 app.include_router(auth_routes.router)
 app.include_router(book_routes.router)
+app.include_router(group_routes.router)
+app.include_router(media_routes.router)
+app.include_router(recommendation_routes.router)
+app.include_router(leaderboard_routes.router)
 
 # We'll add more routers in the next phases:
-# - Groups endpoints
 # - User profile endpoints
 
 
@@ -0,0 +1,309 @@
+"""
+Command-line maintenance tasks for the Book Club database.
+
+Usage (from the server directory):
+    python manage.py verify-ratings
+    python manage.py rebuild-ratings
+    python manage.py verify-member-counts
+    python manage.py rebuild-member-counts
+    python manage.py purge-idempotency-keys
+    python manage.py import-books feed.csv --chunk-size 5000
+    python manage.py export-books catalog.jsonl
+    python manage.py build-thumbnails
+    python manage.py build-recommendations --full
+    python manage.py rebuild-leaderboards
+    python manage.py migrate --analyze
+    python manage.py check-query-plans
+    python manage.py dump-schema ../schema.sql
+"""
+
+import argparse
+import os
+import sys
+from datetime import datetime
+import catalog_io
+import leaderboards
+import media
+import migrations
+import query_plans
+import recommendations
+from database import SessionLocal, engine, init_db
+from ratings import rebuild_rating_stats, find_rating_stats_drift
+from memberships import rebuild_member_counts, find_member_count_drift
+from idempotency import purge_expired_keys
+
+
+def verify_ratings(args) -> int:
+    """Report books whose stored rating totals don't match BookRatings."""
+    db = SessionLocal()
+    try:
+        drift = find_rating_stats_drift(db)
+    finally:
+        db.close()
+
+    for book_id, (stored_sum, stored_count), (actual_sum, actual_count) in drift:
+        print(
+            f"book {book_id}: stored sum={stored_sum} count={stored_count}, "
+            f"actual sum={actual_sum} count={actual_count}"
+        )
+
+    if drift:
+        print(f"{len(drift)} book(s) with drift. Run 'python manage.py rebuild-ratings' to fix.")
+        return 1
+
+    print("Rating totals are consistent.")
+    return 0
+
+
+def rebuild_ratings(args) -> int:
+    """Recompute all rating totals from BookRatings."""
+    db = SessionLocal()
+    try:
+        rebuilt = rebuild_rating_stats(db)
+        db.commit()
+    finally:
+        db.close()
+
+    print(f"Rebuilt rating totals for {rebuilt} book(s).")
+    return 0
+
+
+def verify_members(args) -> int:
+    """Report groups whose stored member_count doesn't match UserGroups."""
+    db = SessionLocal()
+    try:
+        drift = find_member_count_drift(db)
+    finally:
+        db.close()
+
+    for group_id, stored, actual in drift:
+        print(f"group {group_id}: stored member_count={stored}, actual={actual}")
+
+    if drift:
+        print(f"{len(drift)} group(s) with drift. Run 'python manage.py rebuild-member-counts' to fix.")
+        return 1
+
+    print("Member counts are consistent.")
+    return 0
+
+
+def rebuild_members(args) -> int:
+    """Recompute every group's member_count from UserGroups."""
+    db = SessionLocal()
+    try:
+        rebuilt = rebuild_member_counts(db)
+        db.commit()
+    finally:
+        db.close()
+
+    print(f"Rebuilt member counts for {rebuilt} group(s).")
+    return 0
+
+
+def purge_idempotency_keys(args) -> int:
+    """Delete stored Idempotency-Key responses that have expired."""
+    db = SessionLocal()
+    try:
+        purged = purge_expired_keys(db)
+        db.commit()
+    finally:
+        db.close()
+
+    print(f"Purged {purged} expired idempotency key(s).")
+    return 0
+
+
+def import_books(args) -> int:
+    """Upsert books from a CSV / JSON Lines feed."""
+    if args.file != "-" and not os.path.isfile(args.file):
+        print(f"No such file: {args.file}", file=sys.stderr)
+        return 1
+    try:
+        file_format = catalog_io.detect_format(args.file, args.format)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 1
+
+    def progress(report):
+        print(f"  {report.read} rows read, {report.rows_per_second:.0f} rows/s", file=sys.stderr)
+
+    with catalog_io.open_text(args.file, "r") as stream:
+        report = catalog_io.import_books(engine, catalog_io.read_rows(stream, file_format),
+                                         args.chunk_size, progress if args.verbose else None)
+
+    print(f"Imported {report.read - report.rejected} of {report.read} row(s) "
+          f"({report.inserted} new, {report.updated} updated, {report.rejected} rejected) "
+          f"in {report.seconds:.1f} s, {report.rows_per_second:.0f} rows/s.")
+    if report.peak_memory_mb is not None:
+        print(f"Peak memory: {report.peak_memory_mb:.1f} MB.")
+
+    for line_number, message in report.errors:
+        print(f"line {line_number}: {message}")
+    if report.rejected > len(report.errors):
+        print(f"... and {report.rejected - len(report.errors)} more rejected row(s).")
+
+    return 1 if report.rejected else 0
+
+
+def export_books(args) -> int:
+    """Write the catalog as CSV / JSON Lines."""
+    file_format = catalog_io.detect_format(args.file, args.format)
+
+    with catalog_io.open_text(args.file, "w") as stream:
+        written = catalog_io.export_books(engine, stream, file_format)
+
+    print(f"Exported {written} book(s).", file=sys.stderr)
+    return 0
+
+
+def build_thumbnails(args) -> int:
+    """Index the media files and make the missing cover thumbnails."""
+    library = media.library.scan()
+    stats = library.stats()
+    print(f"{stats['paths']} media path(s), {stats['files']} distinct file(s) "
+          f"({stats['duplicate_files']} duplicate(s), {stats['duplicate_bytes'] // 1024} KB served once).")
+
+    if media.Image is None:
+        print("Pillow is not installed (pip install Pillow); no thumbnails made.")
+        return 1
+
+    made, existing = library.build_thumbnails()
+    print(f"Made {made} thumbnail(s), {existing} already there, in {library.cache_dir}.")
+    return 0
+
+
+def build_recommendations(args) -> int:
+    """Bring the similar book lists up to date (all of them with --full)."""
+    if not recommendations.is_available():
+        print("numpy and scipy are not installed (pip install numpy scipy); no recommendations built.")
+        return 1
+
+    update = recommendations.update_neighbors(engine, full=args.full)
+    if update.full:
+        print(f"Built {update.lists_written} similar book list(s) in {update.seconds:.1f} s.")
+    else:
+        print(f"{update.books_queued} book(s) changed: updated {update.lists_written} "
+              f"similar book list(s) in {update.seconds:.1f} s.")
+    return 0
+
+
+def rebuild_leaderboards(args) -> int:
+    """Recompute the leaderboard snapshot from purchases, ratings and comments."""
+    books = leaderboards.rebuild(engine)
+    print(f"Rebuilt the leaderboard snapshot: {books} book(s) with a score. Restart the app to load it.")
+    return 0
+
+
+def migrate(args) -> int:
+    """List the applied schema migrations (main() has just applied any pending ones)."""
+    with engine.begin() as connection:
+        applied = migrations.applied_migrations(connection)
+        if args.analyze:
+            migrations.analyze(connection)
+
+    for item in migrations.MIGRATIONS:
+        applied_at = applied.get(item.version)
+        when = datetime.fromtimestamp(applied_at).strftime("%Y-%m-%d %H:%M") if applied_at else "not applied"
+        print(f"{item.version:>4}  {item.name:<32}{when}")
+    print(f"Schema is at migration {max(applied, default=0)}." + (" Statistics refreshed." if args.analyze else ""))
+    return 0
+
+
+def check_query_plans(args) -> int:
+    """Fail if a hot-path statement reads a whole table."""
+    report = query_plans.check_query_plans(engine)
+
+    for scan in report.full_scans:
+        print(f"{scan.path}: full scan of {scan.table}")
+        print(f"  {scan.statement[:500]}")
+        for step in scan.plan:
+            print(f"    {step}")
+
+    if report.full_scans:
+        print(f"{len(report.full_scans)} full table scan(s) in {report.statements} hot-path statement(s).")
+        return 1
+
+    print(f"Checked {report.statements} hot-path statement(s): no full table scans.")
+    return 0
+
+
+def dump_schema(args) -> int:
+    """Write the DDL of a new, fully migrated database."""
+    with catalog_io.open_text(args.file, "w") as stream:
+        stream.write(migrations.schema_sql())
+
+    if args.file != "-":
+        print(f"Wrote the schema to {args.file}.", file=sys.stderr)
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Book Club database maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser(
+        "verify-ratings", help="check stored rating totals against BookRatings"
+    ).set_defaults(handler=verify_ratings)
+    commands.add_parser(
+        "rebuild-ratings", help="recompute stored rating totals from BookRatings"
+    ).set_defaults(handler=rebuild_ratings)
+    commands.add_parser(
+        "verify-member-counts", help="check stored group member counts against UserGroups"
+    ).set_defaults(handler=verify_members)
+    commands.add_parser(
+        "rebuild-member-counts", help="recompute stored group member counts from UserGroups"
+    ).set_defaults(handler=rebuild_members)
+    commands.add_parser(
+        "purge-idempotency-keys", help="delete expired Idempotency-Key responses"
+    ).set_defaults(handler=purge_idempotency_keys)
+
+    import_parser = commands.add_parser(
+        "import-books", help="upsert books from a CSV or JSON Lines file (rows with book_id update that book)"
+    )
+    import_parser.add_argument("file", help="input file, or - for stdin")
+    import_parser.add_argument("--format", choices=catalog_io.FORMATS, help="default: from the file extension")
+    import_parser.add_argument("--chunk-size", type=int, default=5000, help="rows per transaction (default 5000)")
+    import_parser.add_argument("--verbose", action="store_true", help="report progress after every chunk")
+    import_parser.set_defaults(handler=import_books)
+
+    export_parser = commands.add_parser("export-books", help="write the catalog as CSV or JSON Lines")
+    export_parser.add_argument("file", help="output file, or - for stdout")
+    export_parser.add_argument("--format", choices=catalog_io.FORMATS, help="default: from the file extension")
+    export_parser.set_defaults(handler=export_books)
+
+    commands.add_parser(
+        "build-thumbnails", help="make the WebP cover thumbnails served under /media/thumbs"
+    ).set_defaults(handler=build_thumbnails)
+
+    recommendations_parser = commands.add_parser(
+        "build-recommendations", help="update the similar book lists from new ratings and purchases"
+    )
+    recommendations_parser.add_argument("--full", action="store_true", help="recompute every list")
+    recommendations_parser.set_defaults(handler=build_recommendations)
+
+    commands.add_parser(
+        "rebuild-leaderboards", help="recompute the leaderboard snapshot (run with the app stopped)"
+    ).set_defaults(handler=rebuild_leaderboards)
+
+    migrate_parser = commands.add_parser("migrate", help="apply pending schema migrations and list them all")
+    migrate_parser.add_argument("--analyze", action="store_true", help="also refresh the query planner statistics")
+    migrate_parser.set_defaults(handler=migrate)
+
+    commands.add_parser(
+        "check-query-plans", help="fail if a hot-path query reads a whole table (run on realistic data)"
+    ).set_defaults(handler=check_query_plans)
+
+    schema_parser = commands.add_parser("dump-schema", help="write the DDL of a new database (schema.sql)")
+    schema_parser.add_argument("file", nargs="?", default="-", help="output file, or - for stdout (default)")
+    schema_parser.set_defaults(handler=dump_schema)
+
+    args = parser.parse_args(argv)
+
+    # Make sure the tables the commands rely on exist
+    init_db()
+
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,449 @@
+"""
+Media files: book covers, group covers and PDFs.
+The files under the media directories (by default images/ and
+client/images/) are indexed once at startup by the SHA-256 of their
+content. Every file is then served from a content-hashed URL,
+/media/<digest>/<name>, that never changes meaning and can be cached
+forever; files with the same content (such as the copies in images/ and
+client/images/) share one URL, one cache entry and one set of thumbnails.
+
+Cover thumbnails are resized WebP copies, written once to MEDIA_CACHE_DIR
+(by `python manage.py build-thumbnails`, or on first request) so the
+catalog grid never downloads full-size covers. They need Pillow; without
+it only the originals are served.
+
+Files are sent with HTTP Range support (PDF readers fetch pages on
+demand), either zero-copy by the ASGI server when it supports the
+http.response.zerocopysend extension, by a front proxy via
+X-Accel-Redirect (MEDIA_ACCEL_REDIRECT), or in chunks read in a thread.
+"""
+
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import threading
+from dataclasses import dataclass
+from email.utils import formatdate
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import quote
+import anyio
+from fastapi import Request, Response, status
+from starlette.types import Receive, Scope, Send
+from config import settings
+from http_cache import etag_matches
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # optional dependency
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Hex characters of the SHA-256 used in URLs (64 bits)
+DIGEST_LENGTH = 16
+
+# Content-hashed URLs never change meaning
+IMMUTABLE = "public, max-age=31536000, immutable"
+# URLs by file path may: keep a copy but revalidate it
+REVALIDATE = "public, no-cache"
+
+# Types Pillow can make thumbnails of
+THUMBNAIL_TYPES = ("image/jpeg", "image/png", "image/webp", "image/gif")
+
+# Bytes read per chunk when the server can't send the file itself
+CHUNK_SIZE = 256 * 1024
+
+_RANGE = re.compile(r"bytes=(\d*)-(\d*)")
+
+mimetypes.add_type("image/webp", ".webp")
+
+
+@dataclass(frozen=True)
+class Asset:
+    """One distinct media file (by content)."""
+    path: str         # file on disk (the first copy found)
+    relative_path: str
+    digest: str
+    size: int
+    mtime: float
+    media_type: str
+
+    @property
+    def etag(self) -> str:
+        # Strong: the digest is of the exact bytes sent
+        return f'"{self.digest}"'
+
+    @property
+    def url(self) -> str:
+        return f"/media/{self.digest}/{quote(os.path.basename(self.path))}"
+
+    @property
+    def has_thumbnails(self) -> bool:
+        return self.media_type in THUMBNAIL_TYPES
+
+    def thumbnail_url(self, width: int) -> str:
+        return f"/media/thumbs/{self.digest}/{width}.webp"
+
+
+def normalize_path(path: str) -> str:
+    """
+    Turn a stored media path into an index key.
+
+    Paths in the database use Windows separators and may be relative
+    ("images\\books\\mobyDick.jpg", "../images/books/mobyDick.jpg").
+    """
+    parts = [part for part in path.replace("\\", "/").split("/") if part not in ("", ".", "..")]
+    return "/".join(parts)
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 of a file's content, shortened to DIGEST_LENGTH hex chars."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as media_file:
+        for chunk in iter(lambda: media_file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:DIGEST_LENGTH]
+
+
+class MediaLibrary:
+    """
+    Index of the media files by path and by content digest, plus the
+    on-disk thumbnail cache.
+
+    Args:
+        root: Directory the stored paths are relative to
+        directories: Directories (under root) holding media files
+        cache_dir: Where thumbnails and the digest cache are written
+        thumbnail_widths: Widths (px) thumbnails are made in
+        thumbnail_quality: WebP quality (0-100)
+    """
+
+    def __init__(self, root: str, directories: Iterable[str], cache_dir: str,
+                 thumbnail_widths: Iterable[int], thumbnail_quality: int = 80):
+        self.root = os.path.abspath(root)
+        self.directories = list(directories)
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.thumbnail_widths = sorted(set(thumbnail_widths))
+        self.thumbnail_quality = thumbnail_quality
+        self._by_path: Dict[str, Asset] = {}
+        self._by_digest: Dict[str, Asset] = {}
+        self._lock = threading.Lock()
+        self.version = ""
+        self.duplicate_files = 0
+        self.duplicate_bytes = 0
+
+    @property
+    def _digest_cache_path(self) -> str:
+        return os.path.join(self.cache_dir, "digests.json")
+
+    def _load_digest_cache(self) -> Dict[str, list]:
+        try:
+            with open(self._digest_cache_path, encoding="utf-8") as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_digest_cache(self, entries: Dict[str, list]):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temporary = f"{self._digest_cache_path}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as cache_file:
+            json.dump(entries, cache_file)
+        os.replace(temporary, self._digest_cache_path)
+
+    def scan(self) -> "MediaLibrary":
+        """
+        (Re)build the index. Files whose size and mtime are unchanged since
+        the last scan keep their digest instead of being read again.
+        """
+        previous = self._load_digest_cache()
+        entries: Dict[str, list] = {}
+        by_path: Dict[str, Asset] = {}
+        by_digest: Dict[str, Asset] = {}
+        duplicate_files = duplicate_bytes = 0
+
+        for directory in self.directories:
+            top = os.path.join(self.root, directory)
+            for dirpath, dirnames, filenames in os.walk(top):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    path = os.path.join(dirpath, filename)
+                    media_type = mimetypes.guess_type(filename)[0]
+                    if media_type is None:
+                        continue
+
+                    stat_result = os.stat(path)
+                    relative_path = os.path.relpath(path, self.root).replace(os.sep, "/")
+                    cached = previous.get(relative_path)
+                    if cached and cached[1:] == [stat_result.st_size, stat_result.st_mtime]:
+                        digest = cached[0]
+                    else:
+                        digest = file_digest(path)
+                    entries[relative_path] = [digest, stat_result.st_size, stat_result.st_mtime]
+
+                    asset = by_digest.get(digest)
+                    if asset is None:
+                        asset = Asset(path, relative_path, digest, stat_result.st_size,
+                                      stat_result.st_mtime, media_type)
+                        by_digest[digest] = asset
+                    else:
+                        duplicate_files += 1
+                        duplicate_bytes += stat_result.st_size
+                    by_path[relative_path] = asset
+
+        if entries != previous:
+            try:
+                self._save_digest_cache(entries)
+            except OSError:
+                logger.warning("Can't write the media digest cache to %s", self.cache_dir)
+
+        version = hashlib.sha256(
+            json.dumps(sorted((path, asset.digest) for path, asset in by_path.items())).encode()
+        ).hexdigest()[:DIGEST_LENGTH]
+
+        with self._lock:
+            self._by_path, self._by_digest = by_path, by_digest
+            self.version = version
+            self.duplicate_files, self.duplicate_bytes = duplicate_files, duplicate_bytes
+        return self
+
+    def get(self, path: str) -> Optional[Asset]:
+        """The asset behind a stored path such as Book.cover_image."""
+        return self._by_path.get(normalize_path(path))
+
+    def by_digest(self, digest: str) -> Optional[Asset]:
+        return self._by_digest.get(digest)
+
+    def manifest(self) -> Dict[str, dict]:
+        """
+        Map every media path to its content-hashed URL (and thumbnail URLs),
+        so clients can turn stored paths into cacheable URLs.
+        """
+        manifest = {}
+        for path, asset in self._by_path.items():
+            entry = {"url": asset.url}
+            if asset.has_thumbnails and Image is not None:
+                entry["thumbnails"] = {str(width): asset.thumbnail_url(width) for width in self.thumbnail_widths}
+            manifest[path] = entry
+        return manifest
+
+    def thumbnail_path(self, asset: Asset, width: int) -> str:
+        return os.path.join(self.cache_dir, "thumbs", f"{asset.digest}-{width}.webp")
+
+    def thumbnail(self, asset: Asset, width: int) -> Optional[str]:
+        """
+        The thumbnail file of an image at one of the configured widths,
+        made (once) if it doesn't exist yet. Blocking: call it in a thread.
+
+        Returns:
+            Path of the WebP file, or None if the asset has no thumbnails
+            (not an image, unknown width or Pillow missing)
+        """
+        if Image is None or not asset.has_thumbnails or width not in self.thumbnail_widths:
+            return None
+
+        path = self.thumbnail_path(asset, width)
+        if not os.path.exists(path):
+            self._make_thumbnail(asset, width, path)
+        return path
+
+    def _make_thumbnail(self, asset: Asset, width: int, path: str):
+        with Image.open(asset.path) as image:
+            # Let the JPEG decoder downscale while decoding (much faster)
+            image.draft("RGB", (width, image.height * width // max(image.width, 1)))
+            image = ImageOps.exif_transpose(image)
+            if image.width > width:
+                height = max(1, round(image.height * width / image.width))
+                image = image.resize((width, height), Image.LANCZOS)
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write under a temporary name so no one reads a half-written file
+            temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            image.save(temporary, "WEBP", quality=self.thumbnail_quality, method=4)
+        os.replace(temporary, path)
+
+    def build_thumbnails(self) -> Tuple[int, int]:
+        """
+        Make every missing thumbnail.
+
+        Returns:
+            (thumbnails made, thumbnails already there)
+        """
+        made = existing = 0
+        for asset in list(self._by_digest.values()):
+            if not asset.has_thumbnails:
+                continue
+            for width in self.thumbnail_widths:
+                if os.path.exists(self.thumbnail_path(asset, width)):
+                    existing += 1
+                elif self.thumbnail(asset, width):
+                    made += 1
+        return made, existing
+
+    def stats(self) -> dict:
+        """Counters for /health/media."""
+        return {
+            "paths": len(self._by_path),
+            "files": len(self._by_digest),
+            "duplicate_files": self.duplicate_files,
+            "duplicate_bytes": self.duplicate_bytes,
+            "thumbnails": Image is not None,
+            "thumbnail_widths": self.thumbnail_widths,
+        }
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range Range header.
+
+    Args:
+        header: e.g. "bytes=0-1023", "bytes=1024-" or "bytes=-500"
+        size: File size
+
+    Returns:
+        (first byte, last byte), inclusive, or None when the header should
+        be ignored (malformed or several ranges: the whole file is sent)
+
+    Raises:
+        ValueError: The range lies outside the file (416)
+    """
+    match = _RANGE.fullmatch(header.strip())
+    if match is None:
+        return None
+
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("empty suffix range")
+        return max(0, size - length), size - 1
+
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first >= size or first > last:
+        raise ValueError("range not satisfiable")
+    return first, last
+
+
+class MediaFileResponse(Response):
+    """
+    Sends a file (or one byte range of it) with strong validators.
+
+    Answers 304 when the client's copy is current, 206 for a satisfiable
+    Range, and 416 for one outside the file.
+
+    Args:
+        request: The request being answered (conditional and Range headers)
+        path: File to send
+        etag: Strong ETag of the file's content
+        media_type: Content-Type
+        cache_control: Cache-Control header
+        stat_result: os.stat of the file
+        accel_path: Internal path for the front proxy to send instead
+            (X-Accel-Redirect); the proxy then handles Range itself
+    """
+
+    def __init__(self, request: Request, path: str, etag: str, media_type: str,
+                 cache_control: str, stat_result: os.stat_result, accel_path: Optional[str] = None):
+        self.path = path
+        self.background = None
+        self.media_type = media_type
+        self.accel_path = accel_path
+        self.send_file = request.method != "HEAD" and accel_path is None
+        size = stat_result.st_size
+        self.offset, self.count = 0, size
+
+        headers = {
+            "ETag": etag,
+            "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+            "Cache-Control": cache_control,
+            "Accept-Ranges": "bytes",
+        }
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None and etag_matches(if_none_match, etag):
+            self.status_code = status.HTTP_304_NOT_MODIFIED
+            self.send_file = False
+            self.init_headers(headers)
+            return
+
+        if accel_path is not None:
+            headers["X-Accel-Redirect"] = accel_path
+            self.status_code = status.HTTP_200_OK
+            self.init_headers(headers)
+            return
+
+        self.status_code = status.HTTP_200_OK
+        range_header = request.headers.get("range")
+        if_range = request.headers.get("if-range")
+        # If-Range: send the range only if the client's copy is this version
+        if range_header and (if_range is None or if_range.strip() == etag):
+            try:
+                byte_range = parse_range(range_header, size)
+            except ValueError:
+                self.status_code = status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+                self.send_file = False
+                headers["Content-Range"] = f"bytes */{size}"
+                headers["Content-Length"] = "0"
+                self.init_headers(headers)
+                return
+            if byte_range is not None:
+                first, last = byte_range
+                self.status_code = status.HTTP_206_PARTIAL_CONTENT
+                self.offset, self.count = first, last - first + 1
+                headers["Content-Range"] = f"bytes {first}-{last}/{size}"
+
+        headers["Content-Length"] = str(self.count)
+        self.init_headers(headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+
+        if not self.send_file or self.count == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            # The server copies straight from the file to the socket
+            with open(self.path, "rb") as media_file:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": media_file,
+                    "offset": self.offset,
+                    "count": self.count,
+                    "more_body": False,
+                })
+            return
+
+        async with await anyio.open_file(self.path, "rb") as media_file:
+            await media_file.seek(self.offset)
+            remaining = self.count
+            while remaining:
+                chunk = await media_file.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    # The file shrank under us; end the response short
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def _parse_widths(value: str) -> List[int]:
+    return [int(width) for width in value.split(",") if width.strip()]
+
+
+library = MediaLibrary(
+    settings.MEDIA_ROOT,
+    [directory.strip() for directory in settings.MEDIA_DIRS.split(",") if directory.strip()],
+    settings.MEDIA_CACHE_DIR,
+    _parse_widths(settings.MEDIA_THUMBNAIL_WIDTHS),
+    settings.MEDIA_THUMBNAIL_QUALITY,
+)
@@ -0,0 +1,111 @@
+"""
+Group membership maintenance.
+Groups.member_count holds the number of UserGroups rows of each group, so
+group listings can show member counts without counting thousands of rows
+per group on every read.
+"""
+
+from typing import Dict, List, Tuple
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from models import Group, UserGroup
+
+
+def join_group(db: Session, user_id: int, group_id: int) -> bool:
+    """
+    Add a user to a group and count them in member_count.
+
+    Joining a group the user is already in changes nothing. The caller
+    commits.
+
+    Args:
+        db: Database session
+        user_id: ID of the joining user
+        group_id: ID of the group (must exist)
+
+    Returns:
+        True if the user became a member, False if they already were
+    """
+    if db.get_bind().dialect.name == "sqlite":
+        statement = sqlite_insert(UserGroup).values(user_id=user_id, group_id=group_id).on_conflict_do_nothing()
+        joined = db.execute(statement).rowcount == 1
+    else:
+        joined = db.get(UserGroup, (user_id, group_id)) is None
+        if joined:
+            db.add(UserGroup(user_id=user_id, group_id=group_id))
+            db.flush()
+
+    if joined:
+        _add_to_member_count(db, group_id, 1)
+    return joined
+
+
+def leave_group(db: Session, user_id: int, group_id: int) -> bool:
+    """
+    Remove a user from a group and from its member_count. The caller commits.
+
+    Args:
+        db: Database session
+        user_id: ID of the leaving user
+        group_id: ID of the group
+
+    Returns:
+        True if the user was a member, False otherwise
+    """
+    left = db.query(UserGroup).filter(
+        UserGroup.user_id == user_id,
+        UserGroup.group_id == group_id
+    ).delete(synchronize_session=False) == 1
+
+    if left:
+        _add_to_member_count(db, group_id, -1)
+    return left
+
+
+def _add_to_member_count(db: Session, group_id: int, delta: int):
+    """Change a group's member_count in place (no read-modify-write race)."""
+    db.execute(
+        update(Group)
+        .where(Group.group_id == group_id)
+        .values(member_count=Group.member_count + delta)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def rebuild_member_counts(db: Session) -> int:
+    """
+    Recompute every group's member_count from UserGroups. The caller commits.
+
+    Returns:
+        Number of groups
+    """
+    result = db.execute(
+        update(Group)
+        .values(member_count=select(func.count())
+                .where(UserGroup.group_id == Group.group_id)
+                .scalar_subquery())
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+def find_member_count_drift(db: Session) -> List[Tuple[int, int, int]]:
+    """
+    Compare stored member counts with counts recomputed from UserGroups.
+
+    Returns:
+        (group_id, stored_count, actual_count) for every group whose
+        count doesn't match
+    """
+    actual: Dict[int, int] = dict(db.execute(
+        select(UserGroup.group_id, func.count()).group_by(UserGroup.group_id)
+    ).all())
+
+    return [
+        (group_id, stored, actual.get(group_id, 0))
+        for group_id, stored in db.execute(
+            select(Group.group_id, Group.member_count).order_by(Group.group_id)
+        )
+        if stored != actual.get(group_id, 0)
+    ]
@@ -0,0 +1,343 @@
+"""
+Request performance metrics.
+Every HTTP request is timed per route, and every SQL statement it runs is
+counted and timed through cursor-execute hooks on the engines in
+database.py, along with the ORM objects it loads, the rows it writes and
+the time it spends waiting for bcrypt. The numbers are published in the
+Prometheus text format on GET /metrics and, per response, in a
+Server-Timing header that browser devtools show next to the request.
+
+Statements slower than SLOW_QUERY_SECONDS are logged, and so are requests
+that run the same statement REPEATED_QUERY_WARNING times or more (the
+usual sign of an N+1 query pattern).
+
+Metrics are kept per worker process, like the catalog cache counters;
+Prometheus adds up the workers when it scrapes each of them.
+"""
+
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as StatementCounter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Route label of work done outside any request (startup, feed watcher)
+BACKGROUND = "(background)"
+# Route label of requests that matched no route (404s)
+UNMATCHED = "(unmatched)"
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """A monotonically increasing value per label combination."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0)
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}"
+
+
+class Histogram:
+    """Observations counted into cumulative buckets, per label combination."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket (+Inf last), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def count(self, *label_values: str) -> int:
+        series = self._series.get(label_values)
+        return sum(series[0]) if series else 0
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            series = sorted((labels, ([*counts], total)) for labels, (counts, total) in self._series.items())
+        for label_values, (counts, total) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                labels = _format_labels(self.labels, label_values, f'le="{le}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Registry:
+    """The metrics published on /metrics."""
+
+    def __init__(self):
+        self._metrics: List[object] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def expose(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUESTS = registry.register(Counter(
+    "bookclub_http_requests_total", "HTTP requests by route and status.",
+    ["method", "route", "status"]
+))
+REQUEST_SECONDS = registry.register(Histogram(
+    "bookclub_http_request_duration_seconds", "Time from request to the end of the response.",
+    ["method", "route"]
+))
+STATEMENTS_PER_REQUEST = registry.register(Histogram(
+    "bookclub_db_statements_per_request", "SQL statements run by one request.",
+    ["route"], STATEMENT_BUCKETS
+))
+DB_SECONDS_PER_REQUEST = registry.register(Histogram(
+    "bookclub_db_seconds_per_request", "Time one request spent executing SQL statements.",
+    ["route"]
+))
+STATEMENTS = registry.register(Counter(
+    "bookclub_db_statements_total", "SQL statements executed.", ["route"]
+))
+ROWS = registry.register(Counter(
+    "bookclub_db_rows_total", "ORM objects loaded and rows changed by INSERT/UPDATE/DELETE.",
+    ["route", "kind"]
+))
+SLOW_STATEMENTS = registry.register(Counter(
+    "bookclub_db_slow_statements_total", "SQL statements slower than SLOW_QUERY_SECONDS.", ["route"]
+))
+REPEATED_STATEMENT_REQUESTS = registry.register(Counter(
+    "bookclub_db_repeated_statement_requests_total",
+    "Requests that ran one statement REPEATED_QUERY_WARNING times or more (likely N+1).", ["route"]
+))
+PASSWORD_HASH_SECONDS = registry.register(Histogram(
+    "bookclub_password_hash_seconds", "bcrypt hash/verify time, including the wait for the executor.",
+    ["operation"], (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+))
+
+
+@dataclass
+class RequestStats:
+    """What one request has done so far."""
+    scope: Scope
+    statements: int = 0
+    db_seconds: float = 0.0
+    rows_loaded: int = 0
+    rows_written: int = 0
+    password_hash_seconds: float = 0.0
+    # statement text -> times run, to spot N+1 patterns
+    statement_counts: StatementCounter = field(default_factory=StatementCounter)
+
+    @property
+    def route(self) -> str:
+        # The route template, not the raw path (which would make a label
+        # per book id); set once routing has matched the request
+        route = self.scope.get("route")
+        return getattr(route, "path", None) or UNMATCHED
+
+
+# Stats of the request being handled. Worker threads (run_in_threadpool)
+# and async sessions run in a copy of the request's context, so they see
+# the same RequestStats object.
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def current_stats() -> Optional[RequestStats]:
+    return _current.get()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    stats = _current.get()
+    route = stats.route if stats else BACKGROUND
+
+    STATEMENTS.inc(route)
+    if cursor.rowcount > 0 and not statement.lstrip()[:6].upper().startswith("SELECT"):
+        ROWS.inc(route, "written", amount=cursor.rowcount)
+        if stats:
+            stats.rows_written += cursor.rowcount
+
+    if stats:
+        stats.statements += 1
+        stats.db_seconds += elapsed
+        stats.statement_counts[statement] += 1
+
+    if settings.SLOW_QUERY_SECONDS and elapsed >= settings.SLOW_QUERY_SECONDS:
+        SLOW_STATEMENTS.inc(route)
+        logger.warning("Slow query (%.1f ms) in %s: %s", elapsed * 1000, route, " ".join(statement.split())[:1000])
+
+
+def instrument_engine(engine: Engine):
+    """Count and time the SQL statements run on an engine (sync engines only;
+    pass async_engine.sync_engine for an async one)."""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _on_load(target, context):
+    stats = _current.get()
+    ROWS.inc(stats.route if stats else BACKGROUND, "loaded")
+    if stats:
+        stats.rows_loaded += 1
+
+
+def instrument_orm(base):
+    """Count the ORM objects loaded from the database, for every model of a declarative base."""
+    if not event.contains(base, "load", _on_load):
+        event.listen(base, "load", _on_load, propagate=True)
+
+
+@contextmanager
+def time_password_hash(operation: str):
+    """Time a bcrypt job (hash or verify) for the metrics and the current request."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        PASSWORD_HASH_SECONDS.observe(elapsed, operation)
+        stats = _current.get()
+        if stats:
+            stats.password_hash_seconds += elapsed
+
+
+def server_timing(stats: RequestStats, elapsed: float) -> str:
+    """The Server-Timing header value for a response."""
+    entries = [
+        f"app;dur={elapsed * 1000:.1f}",
+        f'db;dur={stats.db_seconds * 1000:.1f};desc="SQL x{stats.statements}"',
+    ]
+    if stats.password_hash_seconds:
+        entries.append(f"bcrypt;dur={stats.password_hash_seconds * 1000:.1f}")
+    return ", ".join(entries)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that records the request metrics and, optionally,
+    adds the Server-Timing header.
+
+    Args:
+        app: The wrapped application
+        server_timing: Add a Server-Timing header to every response
+    """
+
+    def __init__(self, app: ASGIApp, server_timing: bool = True):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = _current.set(stats)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_timing(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if self.server_timing:
+                    headers = MutableHeaders(scope=message)
+                    headers.append("Server-Timing", server_timing(stats, time.perf_counter() - started))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            self._record(stats, status_code, time.perf_counter() - started)
+
+    def _record(self, stats: RequestStats, status_code: int, elapsed: float):
+        route = stats.route
+        method = stats.scope["method"]
+
+        REQUESTS.inc(method, route, str(status_code))
+        REQUEST_SECONDS.observe(elapsed, method, route)
+        STATEMENTS_PER_REQUEST.observe(stats.statements, route)
+        DB_SECONDS_PER_REQUEST.observe(stats.db_seconds, route)
+
+        if settings.REPEATED_QUERY_WARNING and stats.statement_counts:
+            statement, times = stats.statement_counts.most_common(1)[0]
+            if times >= settings.REPEATED_QUERY_WARNING:
+                REPEATED_STATEMENT_REQUESTS.inc(route)
+                logger.warning("%s %s ran one statement %d times (N+1?): %s",
+                               method, route, times, " ".join(statement.split())[:500])
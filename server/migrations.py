@@ -0,0 +1,224 @@
+"""
+Versioned schema migrations.
+
+init_db creates missing tables from the models (Base.metadata), but
+create_all never changes a table that already exists: it adds neither
+columns nor indexes to it. Those changes are migrations. They are applied
+in version order, once per database, and recorded in SchemaMigrations, so
+the committed bookclub.db, a deployment's copy and a generated benchmark
+database all end up with the same schema.
+
+A new database gets its tables, columns and indexes straight from the
+models, so every migration must also be safe on a database that already
+has its change (CREATE INDEX IF NOT EXISTS, add a column only if it is
+missing). The runner then simply applies every migration not recorded yet.
+
+To change the schema: change the model, then append a migration with the
+next version number that makes the same change to existing databases.
+"""
+
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List
+from sqlalchemy import create_engine, insert, inspect, select
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex
+from database import Base
+from memberships import rebuild_member_counts
+from models import (
+    Group, SchemaMigration, create_neighbor_queue_triggers, create_popularity_triggers, create_search_index,
+    create_version_triggers
+)
+from ratings import rebuild_rating_stats
+
+
+@dataclass(frozen=True)
+class Migration:
+    """One schema change."""
+    version: int
+    name: str
+    upgrade: Callable[[Connection], None]
+
+
+# Every migration, in version order
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, name: str):
+    """Register a function as the migration with this version number."""
+    def register(upgrade: Callable[[Connection], None]):
+        if MIGRATIONS and version <= MIGRATIONS[-1].version:
+            raise ValueError(f"Migration {version} ({name}) must come after {MIGRATIONS[-1].version}")
+        MIGRATIONS.append(Migration(version, name, upgrade))
+        return upgrade
+    return register
+
+
+def create_indexes(connection: Connection, *names: str):
+    """
+    Create indexes declared on the models, by name, unless they exist.
+
+    Args:
+        connection: SQLAlchemy connection inside a transaction
+        names: Index names, as given in the models
+    """
+    indexes = {index.name: index for table in Base.metadata.tables.values() for index in table.indexes}
+    for name in names:
+        connection.execute(CreateIndex(indexes[name], if_not_exists=True))
+
+
+# ============================================================================
+# Migrations
+# ============================================================================
+
+@migration(1, "catalog_and_group_indexes")
+def _catalog_and_group_indexes(connection: Connection):
+    create_indexes(
+        connection,
+        "ix_Books_title",
+        "ix_Groups_current_book_id",
+        "ix_UserGroups_group_id_user_id",
+        "ix_GroupPosts_group_id_post_id",
+    )
+
+
+@migration(2, "rating_totals")
+def _rating_totals(connection: Connection):
+    # BookRatingStats starts out empty on databases that predate it
+    rebuild_rating_stats(Session(bind=connection))
+
+
+@migration(3, "group_member_count")
+def _group_member_count(connection: Connection):
+    columns = {column["name"] for column in inspect(connection).get_columns(Group.__tablename__)}
+    if "member_count" not in columns:
+        connection.exec_driver_sql(
+            f"ALTER TABLE {Group.__tablename__} ADD COLUMN member_count INTEGER NOT NULL DEFAULT 0"
+        )
+    rebuild_member_counts(Session(bind=connection))
+
+
+@migration(4, "hot_path_indexes")
+def _hot_path_indexes(connection: Connection):
+    create_indexes(
+        connection,
+        "ix_BookRatings_book_id_stars",
+        "ix_BookRatingStats_average_rating",
+        "ix_GroupReadingHistory_book_id",
+        "ix_IdempotencyKeys_created_at",
+    )
+
+
+@migration(5, "book_neighbors")
+def _book_neighbors(connection: Connection):
+    # The tables come from create_all; recommendations.update_neighbors()
+    # fills BookNeighbors with a full build the first time it runs
+    create_indexes(connection, "ix_BookNeighbors_neighbor_id")
+    create_neighbor_queue_triggers(connection)
+
+
+@migration(6, "popularity_events")
+def _popularity_events(connection: Connection):
+    # leaderboards.py builds the first BookPopularity snapshot from the
+    # tables; events are only logged from here on
+    create_popularity_triggers(connection)
+
+
+@migration(7, "comment_time_index")
+def _comment_time_index(connection: Connection):
+    # Comment feeds order by coalesce(created_at, ...) (models.COMMENT_TIME);
+    # this index replaces the one on (book_id, created_at), which migration 1
+    # used to create
+    create_indexes(connection, "ix_BookComments_book_id_comment_time")
+    connection.exec_driver_sql('DROP INDEX IF EXISTS "ix_BookComments_book_id_created_at"')
+
+
+# ============================================================================
+# Runner
+# ============================================================================
+
+def applied_migrations(connection: Connection) -> Dict[int, int]:
+    """Version -> Unix time applied, for the migrations this database has had."""
+    if not inspect(connection).has_table(SchemaMigration.__tablename__):
+        return {}
+    return dict(connection.execute(select(SchemaMigration.version, SchemaMigration.applied_at)).all())
+
+
+def pending_migrations(connection: Connection) -> List[Migration]:
+    """Migrations this database hasn't had yet, in the order they would run."""
+    applied = applied_migrations(connection)
+    return [item for item in MIGRATIONS if item.version not in applied]
+
+
+def upgrade(connection: Connection) -> List[Migration]:
+    """
+    Apply every pending migration, then refresh the planner statistics if
+    any ran (new indexes are only used well once ANALYZE has seen them).
+
+    Args:
+        connection: SQLAlchemy connection inside a transaction; the caller
+            commits, so a failed migration leaves the database untouched
+
+    Returns:
+        The migrations applied
+    """
+    SchemaMigration.__table__.create(bind=connection, checkfirst=True)
+
+    pending = pending_migrations(connection)
+    for item in pending:
+        item.upgrade(connection)
+        connection.execute(insert(SchemaMigration).values(
+            version=item.version, name=item.name, applied_at=int(time.time())
+        ))
+
+    if pending:
+        analyze(connection)
+    return pending
+
+
+def analyze(connection: Connection):
+    """Gather the table and index statistics the query planner chooses indexes by."""
+    connection.exec_driver_sql("ANALYZE")
+
+
+def optimize(connection: Connection):
+    """
+    Let SQLite re-analyze the tables whose statistics have gone stale
+    (PRAGMA optimize; usually a no-op, so cheap enough for every startup).
+    """
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql("PRAGMA optimize")
+
+
+def schema_sql() -> str:
+    """
+    The DDL of a new, fully migrated SQLite database: tables, indexes,
+    search index and triggers, as kept in schema.sql.
+    """
+    engine = create_engine("sqlite://")
+    with engine.begin() as connection:
+        Base.metadata.create_all(bind=connection)
+        create_search_index(connection)
+        create_version_triggers(connection)
+        upgrade(connection)
+
+        rows = connection.exec_driver_sql(
+            "SELECT name, sql FROM sqlite_master "
+            "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite\\_%' ESCAPE '\\' ORDER BY rowid"
+        ).all()
+    engine.dispose()
+
+    # Shadow tables of the FTS5 index are created by CREATE VIRTUAL TABLE
+    virtual_tables = [name for name, sql in rows if sql.upper().startswith("CREATE VIRTUAL TABLE")]
+    statements = [
+        "\n".join(line.rstrip() for line in sql.splitlines()) for name, sql in rows
+        if not any(name.startswith(f"{table}_") for table in virtual_tables)
+    ]
+
+    version = MIGRATIONS[-1].version if MIGRATIONS else 0
+    header = (
+        f"-- Book Club database schema (migration {version}).\n"
+        "-- Generated from the models by `python manage.py dump-schema`; don't edit by hand.\n"
+    )
+    return header + "\n" + "".join(f"{statement};\n\n" for statement in statements).rstrip() + "\n"
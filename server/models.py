@@ -3,7 +3,11 @@ SQLAlchemy models representing the database tables.
 These classes map to the existing tables in bookclub.db.
 """
 
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, CheckConstraint
+from typing import List
+from sqlalchemy import (
+    Column, Integer, String, Text, Float, ForeignKey, DateTime, CheckConstraint, Index, cast, func, literal_column, text
+)
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime
@@ -36,7 +40,7 @@ class Book(Base):
     __tablename__ = "Books"
 
     book_id = Column(Integer, primary_key=True, autoincrement=True)
-    title = Column(Text, nullable=False)
+    title = Column(Text, nullable=False, index=True)
     author = Column(Text, nullable=False)
     release_year = Column(Integer)
     summary = Column(Text)
@@ -46,6 +50,7 @@ class Book(Base):
 
     # Relationships
     ratings = relationship("BookRating", back_populates="book")
+    rating_stats = relationship("BookRatingStats", back_populates="book", uselist=False)
     comments = relationship("BookComment", back_populates="book")
     users_read = relationship("UserBooksRead", back_populates="book")
     groups = relationship("Group", back_populates="current_book")
@@ -56,14 +61,17 @@ class Book(Base):
 class Group(Base):
     """
     Groups table - stores reading group information.
+    member_count is kept in step with UserGroups on every join and leave
+    (see memberships.py), so listings never count members.
     """
     __tablename__ = "Groups"
 
     group_id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(Text, nullable=False)
     cover_image = Column(Text)
-    current_book_id = Column(Integer, ForeignKey("Books.book_id"))
+    current_book_id = Column(Integer, ForeignKey("Books.book_id"), index=True)
     created_at = Column(Text, nullable=False, default=lambda: datetime.utcnow().isoformat())
+    member_count = Column(Integer, nullable=False, default=0, server_default=text("0"))
 
     # Relationships
     current_book = relationship("Book", back_populates="groups")
@@ -82,9 +90,12 @@ class BookRating(Base):
     book_id = Column(Integer, ForeignKey("Books.book_id"), primary_key=True)
     stars = Column(Integer, nullable=False)
 
-    # Check constraint: stars must be between 1 and 5
+    # Check constraint: stars must be between 1 and 5. The primary key
+    # serves "ratings of a user"; the index serves "ratings of a book" and
+    # per-book aggregates without reading the table
     __table_args__ = (
         CheckConstraint('stars BETWEEN 1 AND 5', name='check_stars_range'),
+        Index("ix_BookRatings_book_id_stars", "book_id", "stars"),
     )
 
     # Relationships
@@ -92,6 +103,31 @@ class BookRating(Base):
     book = relationship("Book", back_populates="ratings")
 
 
+class BookRatingStats(Base):
+    """
+    BookRatingStats table - running rating totals per book.
+    Updated in the same transaction as every rating write, so reads never
+    have to aggregate BookRatings (see ratings.py).
+    """
+    __tablename__ = "BookRatingStats"
+
+    book_id = Column(Integer, ForeignKey("Books.book_id"), primary_key=True)
+    rating_sum = Column(Integer, nullable=False, default=0)
+    rating_count = Column(Integer, nullable=False, default=0)
+
+    # Relationships
+    book = relationship("Book", back_populates="rating_stats")
+
+
+# Average stars from the running totals (NULL for books without ratings)
+AVERAGE_RATING = cast(BookRatingStats.rating_sum, Float) / BookRatingStats.rating_count
+
+# Serves the catalog's "rating" order: rated books are read best first
+# straight from this index (the rowid book_id breaks ties) instead of
+# sorting the whole catalog
+Index("ix_BookRatingStats_average_rating", AVERAGE_RATING)
+
+
 class BookComment(Base):
     """
     BookComments table - stores user comments on books.
@@ -109,6 +145,15 @@ class BookComment(Base):
     user = relationship("User", back_populates="comments")
 
 
+# When a comment was written, for ordering and cursors: comments without a
+# created_at sort as the oldest instead of dropping out of row comparisons
+COMMENT_TIME = func.coalesce(BookComment.created_at, literal_column("'1970-01-01 00:00:00.000000'", DateTime))
+
+# Serves "comments of a book, newest first" (the rowid comment_id breaks
+# ties, so keyset pagination needs no sort step)
+Index("ix_BookComments_book_id_comment_time", BookComment.book_id, COMMENT_TIME)
+
+
 class UserBooksRead(Base):
     """
     UserBooksRead table - tracks which books users have purchased/read.
@@ -132,6 +177,11 @@ class UserGroup(Base):
     user_id = Column(Integer, ForeignKey("Users.user_id"), primary_key=True)
     group_id = Column(Integer, ForeignKey("Groups.group_id"), primary_key=True)
 
+    # The primary key serves "groups of a user"; this serves "members of a group"
+    __table_args__ = (
+        Index("ix_UserGroups_group_id_user_id", "group_id", "user_id"),
+    )
+
     # Relationships
     user = relationship("User", back_populates="groups")
     group = relationship("Group", back_populates="members")
@@ -146,6 +196,11 @@ class GroupReadingHistory(Base):
     group_id = Column(Integer, ForeignKey("Groups.group_id"), primary_key=True)
     book_id = Column(Integer, ForeignKey("Books.book_id"), primary_key=True)
 
+    # The primary key serves "books a group read"; this serves "groups that read a book"
+    __table_args__ = (
+        Index("ix_GroupReadingHistory_book_id", "book_id"),
+    )
+
     # Relationships
     group = relationship("Group", back_populates="reading_history")
     book = relationship("Book", back_populates="group_history")
@@ -163,7 +218,451 @@ class GroupPost(Base):
     user_id = Column(Integer, ForeignKey("Users.user_id"), nullable=False)
     content = Column(Text, nullable=False)
 
+    # Group feeds read a group's posts by post_id
+    __table_args__ = (
+        Index("ix_GroupPosts_group_id_post_id", "group_id", "post_id"),
+    )
+
     # Relationships
     group = relationship("Group", back_populates="posts")
     book = relationship("Book", back_populates="posts")
     user = relationship("User", back_populates="posts")
+
+
+class IdempotencyKey(Base):
+    """
+    IdempotencyKeys table - remembers the response to a request sent with an
+    Idempotency-Key header so a retried request gets the same answer
+    instead of running again (see idempotency.py).
+    """
+    __tablename__ = "IdempotencyKeys"
+
+    user_id = Column(Integer, ForeignKey("Users.user_id"), primary_key=True)
+    key = Column(Text, primary_key=True)
+    request_path = Column(Text, nullable=False)
+    status_code = Column(Integer, nullable=False)
+    response_body = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    # Expired keys are purged by age
+    __table_args__ = (
+        Index("ix_IdempotencyKeys_created_at", "created_at"),
+    )
+
+
+class ResourceVersion(Base):
+    """
+    ResourceVersions table - a counter per cacheable resource, bumped by the
+    triggers below on every write. HTTP caching (http_cache.py) builds ETags
+    from these instead of from the response body.
+
+    Resources: "catalog" (Books and rating totals) and "user:<user_id>"
+    (that user's purchases and ratings).
+    """
+    __tablename__ = "ResourceVersions"
+
+    resource = Column(Text, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(Integer, nullable=False)  # Unix time of the last bump
+
+
+class BookNeighbor(Base):
+    """
+    BookNeighbors table - the books most similar to each book ("readers of
+    this also read"), precomputed by recommendations.py. Rank 0 is the
+    most similar, so a book's list is one primary key range.
+    """
+    __tablename__ = "BookNeighbors"
+
+    book_id = Column(Integer, ForeignKey("Books.book_id"), primary_key=True)
+    rank = Column(Integer, primary_key=True)
+    neighbor_id = Column(Integer, ForeignKey("Books.book_id"), nullable=False)
+    score = Column(Float, nullable=False)  # cosine similarity, 0..1
+
+    # Incremental updates look up the lists a changed book appears in
+    __table_args__ = (
+        Index("ix_BookNeighbors_neighbor_id", "neighbor_id"),
+    )
+
+
+class BookNeighborQueue(Base):
+    """
+    BookNeighborQueue table - books whose readers changed since their
+    neighbors were computed. Filled by the triggers below, emptied by
+    recommendations.update_neighbors().
+    """
+    __tablename__ = "BookNeighborQueue"
+
+    book_id = Column(Integer, primary_key=True)
+    changes = Column(Integer, nullable=False, default=0)  # writes since queued
+
+
+class PopularityEvent(Base):
+    """
+    PopularityEvents table - purchases, ratings and comments in the order
+    they happened, written by the triggers below. Every worker folds them
+    into its in-memory leaderboards (see leaderboards.py); events older
+    than the last snapshot are purged.
+    """
+    __tablename__ = "PopularityEvents"
+
+    event_id = Column(Integer, primary_key=True, autoincrement=True)
+    book_id = Column(Integer, nullable=False)
+    kind = Column(Text, nullable=False)  # purchase, refund, rating, rating_change, comment
+    created_at = Column(Integer, nullable=False)  # Unix time
+
+
+class BookPopularity(Base):
+    """
+    BookPopularity table - snapshot of the leaderboard scores per book, as
+    of PopularitySnapshot.event_id. Workers start from it instead of
+    recounting purchases and comments.
+    """
+    __tablename__ = "BookPopularity"
+
+    book_id = Column(Integer, ForeignKey("Books.book_id"), primary_key=True)
+    # log2 of the time-decayed activity, anchored at the Unix epoch (see leaderboards.py)
+    trending = Column(Float)
+    purchases = Column(Integer, nullable=False, default=0)
+
+
+class PopularitySnapshot(Base):
+    """
+    PopularitySnapshot table - one row: the last event BookPopularity
+    includes, and up to which event PopularityEvents has been purged.
+    """
+    __tablename__ = "PopularitySnapshot"
+
+    snapshot_id = Column(Integer, primary_key=True)  # always 1
+    event_id = Column(Integer, nullable=False)
+    purged_through = Column(Integer, nullable=False, default=0)
+    taken_at = Column(Integer, nullable=False)  # Unix time
+
+
+class SchemaMigration(Base):
+    """
+    SchemaMigrations table - one row per schema migration applied to this
+    database (see migrations.py).
+    """
+    __tablename__ = "SchemaMigrations"
+
+    version = Column(Integer, primary_key=True)
+    name = Column(Text, nullable=False)
+    applied_at = Column(Integer, nullable=False)  # Unix time
+
+
+# ============================================================================
+# Full-text search index
+# ============================================================================
+
+# FTS5 virtual table over Books(title, author, summary). It is an
+# external-content table: the text lives in Books and the triggers below
+# keep the index in sync on every insert, update and delete.
+BOOKS_SEARCH_TABLE = "BooksSearch"
+
+BOOKS_SEARCH_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS BooksSearch USING fts5(
+        title, author, summary,
+        content='Books', content_rowid='book_id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS Books_search_insert AFTER INSERT ON Books BEGIN
+        INSERT INTO BooksSearch(rowid, title, author, summary)
+        VALUES (new.book_id, new.title, new.author, new.summary);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS Books_search_delete AFTER DELETE ON Books BEGIN
+        INSERT INTO BooksSearch(BooksSearch, rowid, title, author, summary)
+        VALUES ('delete', old.book_id, old.title, old.author, old.summary);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS Books_search_update AFTER UPDATE OF title, author, summary ON Books BEGIN
+        INSERT INTO BooksSearch(BooksSearch, rowid, title, author, summary)
+        VALUES ('delete', old.book_id, old.title, old.author, old.summary);
+        INSERT INTO BooksSearch(rowid, title, author, summary)
+        VALUES (new.book_id, new.title, new.author, new.summary);
+    END
+    """,
+]
+
+# Names of the sync triggers in BOOKS_SEARCH_DDL
+BOOKS_SEARCH_TRIGGERS = ("Books_search_insert", "Books_search_delete", "Books_search_update")
+
+# Whether each database (by URL) has the search index, checked once
+_search_index_available = {}
+
+
+def _missing_triggers(connection, names) -> List[str]:
+    """The triggers among `names` that don't exist in the SQLite database."""
+    existing = set(connection.scalars(text("SELECT name FROM sqlite_master WHERE type = 'trigger'")))
+    return [name for name in names if name not in existing]
+
+
+def create_search_index(connection) -> bool:
+    """
+    Create the FTS5 search index and its sync triggers if they are missing.
+
+    Only SQLite builds with FTS5 support get the index; everything else
+    keeps using the LIKE fallback. A bulk import drops the sync triggers
+    for its duration (catalog_io.py); if it was killed before putting them
+    back, they are recreated here and the index is rebuilt, since books
+    may have changed without it.
+
+    Args:
+        connection: SQLAlchemy connection inside a transaction
+
+    Returns:
+        True if the search index exists, False otherwise
+    """
+    if connection.dialect.name != "sqlite":
+        return False
+
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE name = :name"),
+        {"name": BOOKS_SEARCH_TABLE}
+    ).first() is not None
+
+    if not exists:
+        try:
+            for statement in BOOKS_SEARCH_DDL:
+                connection.execute(text(statement))
+        except OperationalError:
+            # SQLite was built without FTS5
+            return False
+
+        # Index the books that already exist
+        connection.execute(text("INSERT INTO BooksSearch(BooksSearch) VALUES ('rebuild')"))
+    elif _missing_triggers(connection, BOOKS_SEARCH_TRIGGERS):
+        for statement in BOOKS_SEARCH_DDL[1:]:
+            connection.execute(text(statement))
+        connection.execute(text("INSERT INTO BooksSearch(BooksSearch) VALUES ('rebuild')"))
+
+    _search_index_available[str(connection.engine.url)] = True
+    return True
+
+
+def has_search_index(db) -> bool:
+    """
+    Check whether the database behind a session has the FTS5 search index.
+
+    Args:
+        db: Database session
+
+    Returns:
+        True if full-text search can be used
+    """
+    bind = db.get_bind()
+    key = str(bind.engine.url)
+
+    if key not in _search_index_available:
+        _search_index_available[key] = bind.dialect.name == "sqlite" and db.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = :name"),
+            {"name": BOOKS_SEARCH_TABLE}
+        ).first() is not None
+
+    return _search_index_available[key]
+
+
+# ============================================================================
+# Resource version triggers
+# ============================================================================
+
+# SQL that bumps the version of one resource (an expression over new/old)
+_BUMP_VERSION = """
+        INSERT INTO ResourceVersions(resource, version, updated_at)
+        VALUES ({resource}, 1, CAST(strftime('%s', 'now') AS INTEGER))
+        ON CONFLICT(resource) DO UPDATE SET
+            version = version + 1,
+            updated_at = excluded.updated_at;
+"""
+
+# (trigger name, event, table, resource expression)
+_VERSION_TRIGGERS = [
+    ("Books_version_insert", "INSERT", "Books", "'catalog'"),
+    ("Books_version_update", "UPDATE", "Books", "'catalog'"),
+    ("Books_version_delete", "DELETE", "Books", "'catalog'"),
+    ("BookRatingStats_version_insert", "INSERT", "BookRatingStats", "'catalog'"),
+    ("BookRatingStats_version_update", "UPDATE", "BookRatingStats", "'catalog'"),
+    ("BookRatingStats_version_delete", "DELETE", "BookRatingStats", "'catalog'"),
+    ("BookRatings_version_insert", "INSERT", "BookRatings", "'user:' || new.user_id"),
+    ("BookRatings_version_update", "UPDATE", "BookRatings", "'user:' || new.user_id"),
+    ("BookRatings_version_delete", "DELETE", "BookRatings", "'user:' || old.user_id"),
+    ("UserBooksRead_version_insert", "INSERT", "UserBooksRead", "'user:' || new.user_id"),
+    ("UserBooksRead_version_delete", "DELETE", "UserBooksRead", "'user:' || old.user_id"),
+]
+
+RESOURCE_VERSION_DDL = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table} BEGIN
+        {_BUMP_VERSION.format(resource=resource).strip()}
+    END
+    """
+    for name, event, table, resource in _VERSION_TRIGGERS
+]
+
+
+def create_version_triggers(connection) -> bool:
+    """
+    Create the triggers that maintain ResourceVersions if they are missing.
+
+    Only SQLite gets the triggers; on other databases resource versions are
+    not tracked and HTTP caching stays off. If the Books triggers were
+    missing (a bulk import killed while they were dropped), the catalog
+    version is bumped, since books may have changed without it.
+
+    Args:
+        connection: SQLAlchemy connection inside a transaction
+
+    Returns:
+        True if resource versions are tracked, False otherwise
+    """
+    if connection.dialect.name != "sqlite":
+        return False
+
+    books_triggers = [name for name, _, table, _ in _VERSION_TRIGGERS if table == Book.__tablename__]
+    catalog_untracked = bool(_missing_triggers(connection, books_triggers))
+
+    for statement in RESOURCE_VERSION_DDL:
+        connection.execute(text(statement))
+
+    if catalog_untracked:
+        bump_resource_version(connection, "catalog")
+    return True
+
+
+def bump_resource_version(connection, resource: str):
+    """
+    Bump a resource's version by hand, for bulk writes made with the
+    triggers switched off (see catalog_io.py). SQLite only.
+
+    Args:
+        connection: SQLAlchemy connection inside a transaction
+        resource: Resource name, e.g. "catalog"
+    """
+    connection.execute(text(_BUMP_VERSION.format(resource=":resource")), {"resource": resource})
+
+
+def has_version_triggers(db) -> bool:
+    """
+    Check whether resource versions are tracked for the database behind a session.
+
+    Args:
+        db: Database session
+
+    Returns:
+        True if ResourceVersions can be used to build ETags
+    """
+    return db.get_bind().dialect.name == "sqlite"
+
+
+# ============================================================================
+# Book neighbor queue triggers
+# ============================================================================
+
+# SQL that queues one book for recommendations.update_neighbors()
+_QUEUE_NEIGHBORS = """
+        INSERT INTO BookNeighborQueue(book_id, changes) VALUES ({book}, 1)
+        ON CONFLICT(book_id) DO UPDATE SET changes = changes + 1;
+"""
+
+# (trigger name, event, table, book id expressions): every write that
+# changes who read a book
+_NEIGHBOR_QUEUE_TRIGGERS = [
+    ("BookRatings_neighbors_insert", "INSERT", "BookRatings", ["new.book_id"]),
+    ("BookRatings_neighbors_update", "UPDATE", "BookRatings", ["old.book_id", "new.book_id"]),
+    ("BookRatings_neighbors_delete", "DELETE", "BookRatings", ["old.book_id"]),
+    ("UserBooksRead_neighbors_insert", "INSERT", "UserBooksRead", ["new.book_id"]),
+    ("UserBooksRead_neighbors_delete", "DELETE", "UserBooksRead", ["old.book_id"]),
+    ("GroupReadingHistory_neighbors_insert", "INSERT", "GroupReadingHistory", ["new.book_id"]),
+    ("GroupReadingHistory_neighbors_delete", "DELETE", "GroupReadingHistory", ["old.book_id"]),
+]
+
+_NEWLINE = "\n        "
+
+NEIGHBOR_QUEUE_DDL = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table} BEGIN
+        {_NEWLINE.join(_QUEUE_NEIGHBORS.format(book=book).strip() for book in books)}
+    END
+    """
+    for name, event, table, books in _NEIGHBOR_QUEUE_TRIGGERS
+]
+
+
+def create_neighbor_queue_triggers(connection) -> bool:
+    """
+    Create the triggers that fill BookNeighborQueue if they are missing.
+
+    Only SQLite gets the triggers; elsewhere recommendations are only
+    refreshed by a full rebuild.
+
+    Args:
+        connection: SQLAlchemy connection inside a transaction
+
+    Returns:
+        True if changed books are queued, False otherwise
+    """
+    if connection.dialect.name != "sqlite":
+        return False
+
+    for statement in NEIGHBOR_QUEUE_DDL:
+        connection.execute(text(statement))
+    return True
+
+
+
+# ============================================================================
+# Popularity event triggers
+# ============================================================================
+
+# SQL that logs one event for the leaderboards
+_LOG_POPULARITY_EVENT = """
+        INSERT INTO PopularityEvents(book_id, kind, created_at)
+        VALUES ({book}, '{kind}', CAST(strftime('%s', 'now') AS INTEGER));
+"""
+
+# (trigger name, event, table, book id expression, event kind)
+_POPULARITY_TRIGGERS = [
+    ("UserBooksRead_popularity_insert", "INSERT", "UserBooksRead", "new.book_id", "purchase"),
+    ("UserBooksRead_popularity_delete", "DELETE", "UserBooksRead", "old.book_id", "refund"),
+    ("BookRatings_popularity_insert", "INSERT", "BookRatings", "new.book_id", "rating"),
+    ("BookRatings_popularity_update", "UPDATE", "BookRatings", "new.book_id", "rating_change"),
+    ("BookRatings_popularity_delete", "DELETE", "BookRatings", "old.book_id", "rating_change"),
+    ("BookComments_popularity_insert", "INSERT", "BookComments", "new.book_id", "comment"),
+]
+
+POPULARITY_EVENT_DDL = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table} BEGIN
+        {_LOG_POPULARITY_EVENT.format(book=book, kind=kind).strip()}
+    END
+    """
+    for name, event, table, book, kind in _POPULARITY_TRIGGERS
+]
+
+
+def create_popularity_triggers(connection) -> bool:
+    """
+    Create the triggers that fill PopularityEvents if they are missing.
+
+    Only SQLite gets the triggers; elsewhere the leaderboards only change
+    when they are rebuilt from the tables.
+
+    Args:
+        connection: SQLAlchemy connection inside a transaction
+
+    Returns:
+        True if events are logged, False otherwise
+    """
+    if connection.dialect.name != "sqlite":
+        return False
+
+    for statement in POPULARITY_EVENT_DDL:
+        connection.execute(text(statement))
+    return True
@@ -0,0 +1,62 @@
+"""
+Opaque cursors for keyset pagination.
+A cursor holds the sort key values of the last row of a page, tagged with
+the kind of listing (and sort order) it was issued for, so a cursor from
+one listing can't be replayed against another.
+"""
+
+import base64
+import json
+from typing import Sequence, Tuple, Type, Union
+from fastapi import HTTPException, status
+
+# Type of one cursor value: a type, or a tuple of types (as for isinstance)
+ValueType = Union[Type, Tuple[Type, ...]]
+
+# Range of an SQLite INTEGER; larger ints can't be bound as parameters
+_MIN_INTEGER, _MAX_INTEGER = -(1 << 63), (1 << 63) - 1
+
+
+def _valid_value(value, expected: ValueType) -> bool:
+    """Whether a decoded cursor value has the expected scalar type."""
+    # JSON true/false decode to bool, which is also an int
+    if isinstance(value, bool) or not isinstance(value, expected):
+        return False
+    if isinstance(value, int):
+        return _MIN_INTEGER <= value <= _MAX_INTEGER
+    return True
+
+
+def pack_cursor(kind: str, values: list) -> str:
+    """Encode a keyset position as an opaque cursor string."""
+    payload = json.dumps([kind, values], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+
+def unpack_cursor(kind: str, cursor: str, types: Sequence[ValueType]) -> list:
+    """
+    Decode a cursor produced by pack_cursor.
+
+    Args:
+        kind: Kind of listing (and sort order) the cursor must be for
+        cursor: The cursor string from the client
+        types: Expected type of each value, e.g. [str, int]; the values go
+            into SQL comparisons, so anything else is rejected here
+
+    Raises a 400 error if the cursor is malformed, holds values of other
+    types or was issued for a different kind of listing (or sort order).
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_kind, values = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        cursor_kind, values = None, None
+
+    if (cursor_kind != kind or not isinstance(values, list) or len(values) != len(types)
+            or not all(_valid_value(value, expected) for value, expected in zip(values, types))):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+    return values
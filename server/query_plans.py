@@ -0,0 +1,224 @@
+"""
+Query plan checks for the hot paths.
+
+Runs the route code the API spends its time in (catalog pages, book
+details, similar books, leaderboards, comments, ratings, purchases,
+groups, posts, logins) against the configured database, inside a
+transaction that is rolled back, records every SQL statement it executes
+and asks SQLite for each statement's EXPLAIN QUERY PLAN. Statements that
+read a whole table are reported, and `python manage.py check-query-plans`
+exits with status 1 when there are any, so a CI job catches a query or
+schema change that loses an index.
+
+A scan (SCAN in the plan, through an index or not) is not reported when
+- the statement has a LIMIT but neither a WHERE clause nor a sort step
+  (USE TEMP B-TREE): rows come out in index or rowid order and reading
+  stops at the LIMIT, as for the first catalog page by book_id. With a
+  WHERE clause the scan may have to skip any number of rows first.
+- the table has fewer than SMALL_TABLE_ROWS rows, where reading the table
+  is what the planner should do
+- the table is in BOUNDED_TABLES, which never grow past a few rows
+
+So the check means something on a database of realistic size, such as
+one made by benchmarks/dataset.py. tests/test_query_plans.py runs it
+with no small-table allowance on such a database, so tables the dataset
+leaves empty or small are checked too.
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy import event, func, select
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+import group_feed
+from database import Base
+from http_cache import catalog_validators, comments_validators
+from idempotency import get_stored_response, purge_expired_keys
+from models import BookRatingStats, BookRating, Group, User
+from pagination import pack_cursor
+from routes import auth_routes, book_routes, group_routes, leaderboard_routes, recommendation_routes
+from schemas import PostCreate
+
+# Tables smaller than this may be scanned
+SMALL_TABLE_ROWS = 1000
+
+# Tables with one row per kind of resource, read whole by design
+BOUNDED_TABLES = {"ResourceVersions"}
+
+# "SCAN Books", "SCAN Books_1 USING COVERING INDEX ...", "SCAN BooksSearch VIRTUAL TABLE ..."
+_SCAN = re.compile(r"^SCAN (?:TABLE )?(\S+)(?: AS \S+)?(.*)$")
+_LIMIT = re.compile(r"\bLIMIT\b", re.IGNORECASE)
+_WHERE = re.compile(r"\bWHERE\b", re.IGNORECASE)
+
+
+@dataclass
+class Sample:
+    """Ids the hot paths are run with: the most popular book and group, and a reader."""
+    user_id: int = 1
+    email: str = ""
+    book_id: int = 1
+    group_id: int = 1
+
+
+@dataclass
+class FullScan:
+    """A hot-path statement that reads a whole table."""
+    path: str
+    table: str
+    statement: str
+    plan: List[str]
+
+
+@dataclass
+class PlanReport:
+    """What check_query_plans found."""
+    statements: int = 0
+    full_scans: List[FullScan] = field(default_factory=list)
+
+
+def _pick_sample(db: Session) -> Sample:
+    """Use the busiest rows, where a missing index hurts the most."""
+    sample = Sample()
+    book_id = db.scalar(select(BookRatingStats.book_id).order_by(BookRatingStats.rating_count.desc()).limit(1))
+    if book_id is not None:
+        sample.book_id = book_id
+        sample.user_id = db.scalar(select(BookRating.user_id).where(BookRating.book_id == book_id).limit(1))
+    else:
+        sample.user_id = db.scalar(select(func.min(User.user_id))) or sample.user_id
+    sample.email = db.scalar(select(User.email).where(User.user_id == sample.user_id)) or sample.email
+    group_id = db.scalar(select(Group.group_id).order_by(Group.member_count.desc()).limit(1))
+    if group_id is not None:
+        sample.group_id = group_id
+    return sample
+
+
+# (name, function run with a session and a Sample), in the order a
+# client typically calls them
+HOT_PATHS: List[Tuple[str, Callable[[Session, Sample], object]]] = [
+    ("login", lambda db, s: auth_routes._get_user_by_email(db, s.email)),
+    ("current user", lambda db, s: auth_routes._get_user_by_id(db, s.user_id)),
+    ("catalog validators", lambda db, s: catalog_validators(db, s.user_id, "/api/books")),
+    ("catalog by id", lambda db, s: book_routes._list_books(db, None, 50, None, "book_id", None)),
+    ("catalog by title", lambda db, s: book_routes._list_books(db, None, 50, None, "title", None)),
+    ("catalog by rating", lambda db, s: book_routes._list_books(db, None, 50, None, "rating", None)),
+    ("catalog by rating, next page", lambda db, s: book_routes._list_books(
+        db, None, 50, pack_cursor("rating", [3.0, 1]), "rating", None)),
+    ("catalog by rating, unrated books", lambda db, s: book_routes._list_books(
+        db, None, 50, pack_cursor("rating", [0.0, 1 << 62]), "rating", None)),
+    ("catalog search", lambda db, s: book_routes._list_books(db, "the", 50, None, "title", None)),
+    ("search", lambda db, s: book_routes._search_books(db, "the", 10)),
+    ("book", lambda db, s: book_routes._get_book(db, s.book_id)),
+    ("books batch", lambda db, s: book_routes._get_books(db, [s.book_id, s.book_id + 1])),
+    ("user data", lambda db, s: book_routes._user_book_data(db, s.user_id, [s.book_id, s.book_id + 1])),
+    ("similar books", lambda db, s: recommendation_routes._similar_books(db, s.book_id, 10)),
+    ("recommendations", lambda db, s: recommendation_routes._recommendations(db, s.user_id, 10)),
+    ("leaderboard", lambda db, s: leaderboard_routes._leaderboard_entries(db, [(s.book_id, 1.0), (s.book_id + 1, 0.5)])),
+    ("comment validators", lambda db, s: comments_validators(db, s.book_id, "/comments")),
+    ("comments", lambda db, s: book_routes._list_comments(db, s.book_id, None, 20)),
+    ("add comment", lambda db, s: book_routes._add_comment(db, s.user_id, s.book_id, "Plan check")),
+    ("rate", lambda db, s: book_routes._rate_book(db, s.user_id, s.book_id, 4)),
+    ("idempotent retry", lambda db, s: get_stored_response(db, s.user_id, "plan-check", "/purchase")),
+    ("purchase", lambda db, s: book_routes._purchase_book(db, s.user_id, s.book_id + 1, "plan-check", "/purchase")),
+    ("groups", lambda db, s: group_routes._list_groups(db, None, None, 50, None)),
+    ("groups of a user", lambda db, s: group_routes._list_groups(db, s.user_id, None, 50, None)),
+    ("groups reading a book", lambda db, s: group_routes._list_groups(db, None, s.book_id, 50, None)),
+    ("group", lambda db, s: group_routes._get_group(db, s.group_id)),
+    ("join group", lambda db, s: group_routes._change_membership(db, s.user_id, s.group_id, True)),
+    ("posts", lambda db, s: group_routes._list_posts(db, s.group_id, None, 50)),
+    ("add post", lambda db, s: group_routes._create_post(db, s.user_id, s.group_id, PostCreate(content="Plan check"))),
+    ("feed backfill", lambda db, s: group_feed.posts_after(db, 0, 50, s.group_id)),
+    ("purge idempotency keys", lambda db, s: purge_expired_keys(db)),
+]
+
+
+def _record_statements(connection: Connection, sample: Sample) -> List[Tuple[str, str, object]]:
+    """Run the hot paths; return (path, statement, parameters) for every statement."""
+    recorded = []
+    current = [""]
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        recorded.append((current[0], statement, parameters[0] if executemany else parameters))
+
+    # Route code commits; in savepoint mode that only ends a savepoint of
+    # the outer transaction, which the caller rolls back
+    db = Session(bind=connection, join_transaction_mode="create_savepoint")
+    event.listen(connection, "before_cursor_execute", record)
+    try:
+        for name, run in HOT_PATHS:
+            current[0] = name
+            try:
+                run(db, sample)
+            except HTTPException:
+                # e.g. 409 already owned: the statements up to it still count
+                db.rollback()
+    finally:
+        event.remove(connection, "before_cursor_execute", record)
+        db.close()
+    return recorded
+
+
+def _scanned_table(detail: str) -> Optional[str]:
+    """The table a plan step reads in full, or None."""
+    match = _SCAN.match(detail)
+    if not match:
+        return None
+    name, rest = match.groups()
+    if "VIRTUAL TABLE" in rest:
+        return None
+
+    # Plans name tables by their alias ("Books_1" for aliased(Book))
+    tables = Base.metadata.tables
+    if name in tables:
+        return name
+    base_name = re.sub(r"_\d+$", "", name)
+    return base_name if base_name in tables else None
+
+
+def check_query_plans(engine: Engine, small_table_rows: int = SMALL_TABLE_ROWS) -> PlanReport:
+    """
+    Run the hot paths and look for full table scans in their query plans.
+    Nothing they write is kept.
+
+    Args:
+        engine: Engine of the (SQLite) database to check
+        small_table_rows: Tables with fewer rows may be scanned (0 = none may)
+
+    Returns:
+        Number of distinct statements checked and the full scans found
+    """
+    report = PlanReport()
+    row_counts: Dict[str, int] = {}
+
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        try:
+            with Session(bind=connection) as db:
+                sample = _pick_sample(db)
+            seen = set()
+            for path, statement, parameters in _record_statements(connection, sample):
+                if statement in seen or not statement.lstrip().upper().startswith(
+                    ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+                ):
+                    continue
+                seen.add(statement)
+                report.statements += 1
+
+                plan = [row[3] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+                # Reading in index/rowid order up to the LIMIT is not a full scan
+                bounded = (_LIMIT.search(statement) and not _WHERE.search(statement)
+                           and not any("TEMP B-TREE" in step for step in plan))
+
+                for step in plan:
+                    table = _scanned_table(step)
+                    if table is None or bounded or table in BOUNDED_TABLES:
+                        continue
+                    if table not in row_counts:
+                        row_counts[table] = connection.exec_driver_sql(f'SELECT count(*) FROM "{table}"').scalar()
+                    if row_counts[table] >= small_table_rows:
+                        report.full_scans.append(FullScan(path, table, " ".join(statement.split()), plan))
+        finally:
+            transaction.rollback()
+
+    return report
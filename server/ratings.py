@@ -0,0 +1,109 @@
+"""
+Rating aggregate maintenance.
+BookRatingStats holds the running sum and count of stars per book so the
+catalog can show (and sort by) average ratings without aggregating
+BookRatings on every read.
+"""
+
+from typing import Dict, List, Tuple
+from sqlalchemy import func, delete, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from models import BookRating, BookRatingStats
+
+
+def update_rating_stats(db: Session, book_id: int, stars_delta: int, count_delta: int):
+    """
+    Apply a rating change to a book's running totals.
+
+    Must be called in the same transaction as the BookRatings write it
+    describes; the caller commits.
+
+    Args:
+        db: Database session
+        book_id: ID of the rated book
+        stars_delta: Change in the sum of stars (new stars, or new - old)
+        count_delta: Change in the number of ratings (1 for a new rating, 0 for an update)
+    """
+    if db.get_bind().dialect.name == "sqlite":
+        # One statement, so two first ratings of a book can't both insert its row
+        statement = sqlite_insert(BookRatingStats).values(
+            book_id=book_id,
+            rating_sum=stars_delta,
+            rating_count=count_delta
+        )
+        db.execute(statement.on_conflict_do_update(
+            index_elements=[BookRatingStats.book_id],
+            set_={
+                BookRatingStats.rating_sum: BookRatingStats.rating_sum + statement.excluded.rating_sum,
+                BookRatingStats.rating_count: BookRatingStats.rating_count + statement.excluded.rating_count
+            }
+        ))
+        return
+
+    updated = db.query(BookRatingStats).filter(
+        BookRatingStats.book_id == book_id
+    ).update({
+        BookRatingStats.rating_sum: BookRatingStats.rating_sum + stars_delta,
+        BookRatingStats.rating_count: BookRatingStats.rating_count + count_delta
+    }, synchronize_session=False)
+
+    if not updated:
+        db.add(BookRatingStats(
+            book_id=book_id,
+            rating_sum=stars_delta,
+            rating_count=count_delta
+        ))
+
+
+def rebuild_rating_stats(db: Session) -> int:
+    """
+    Recompute every book's totals from BookRatings. The caller commits.
+
+    Returns:
+        Number of books that have ratings
+    """
+    db.execute(delete(BookRatingStats))
+    result = db.execute(insert(BookRatingStats).from_select(
+        ["book_id", "rating_sum", "rating_count"],
+        select(
+            BookRating.book_id,
+            func.sum(BookRating.stars),
+            func.count(BookRating.stars)
+        ).group_by(BookRating.book_id)
+    ))
+    return result.rowcount
+
+
+def find_rating_stats_drift(db: Session) -> List[Tuple[int, Tuple[int, int], Tuple[int, int]]]:
+    """
+    Compare the stored totals with totals recomputed from BookRatings.
+
+    Returns:
+        (book_id, (stored_sum, stored_count), (actual_sum, actual_count))
+        for every book whose totals don't match
+    """
+    actual: Dict[int, Tuple[int, int]] = {
+        book_id: (stars_sum, stars_count)
+        for book_id, stars_sum, stars_count in db.query(
+            BookRating.book_id,
+            func.sum(BookRating.stars),
+            func.count(BookRating.stars)
+        ).group_by(BookRating.book_id)
+    }
+    stored: Dict[int, Tuple[int, int]] = {
+        book_id: (rating_sum, rating_count)
+        for book_id, rating_sum, rating_count in db.query(
+            BookRatingStats.book_id,
+            BookRatingStats.rating_sum,
+            BookRatingStats.rating_count
+        )
+    }
+
+    drift = []
+    for book_id in sorted(actual.keys() | stored.keys()):
+        expected = actual.get(book_id, (0, 0))
+        found = stored.get(book_id, (0, 0))
+        if expected != found:
+            drift.append((book_id, found, expected))
+    return drift
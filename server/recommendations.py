@@ -0,0 +1,383 @@
+"""
+"Readers like you also read" recommendations.
+
+Every book gets a short list of its most similar books, kept in
+BookNeighbors, so the API answers /api/books/{id}/similar and
+/api/me/recommendations with a primary key range read per book instead of
+looking at other readers.
+
+Similarity is item-item cosine over a sparse matrix with one row per
+reader and one column per book:
+- a rating counts stars / 5
+- a purchase the reader hasn't rated counts PURCHASE_WEIGHT
+- a reading group that read the book (GroupReadingHistory) is a row of
+  its own, weighted RECOMMENDATION_GROUP_WEIGHT: books a group read
+  together are co-read
+
+The cosine of two books depends on their two columns only, so when the
+readers of some books change (the triggers in models.py queue them in
+BookNeighborQueue) update_neighbors() recomputes the similarities of just
+those books against the catalog and patches the lists they appear in.
+A full build computes every list, in blocks of BLOCK_SIZE books to bound
+memory.
+
+Needs NumPy and SciPy (optional dependencies); without them the lists
+are simply not refreshed.
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import bindparam, delete, insert, literal, select
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateIndex, DropIndex
+from config import settings
+from models import BookNeighbor, BookNeighborQueue, BookRating, GroupReadingHistory, UserBooksRead
+
+try:
+    import numpy
+    from scipy import sparse
+except ImportError:  # optional dependency
+    numpy = None
+    sparse = None
+
+logger = logging.getLogger(__name__)
+
+# Weight of a purchase without a rating (a middling, 3-star rating)
+PURCHASE_WEIGHT = 0.6
+
+# Books whose similarities are computed at once by a full build
+BLOCK_SIZE = 512
+
+# Scores are rounded before ranking, so a full build and an update rank
+# equal similarities the same way (ties go to the lower book id)
+SCORE_DECIMALS = 6
+
+# Ids per IN (...) list
+_CHUNK = 500
+
+# A neighbor list: (neighbor book id, score), best first
+Neighbors = List[Tuple[int, float]]
+
+
+@dataclass
+class NeighborUpdate:
+    """What update_neighbors did."""
+    full: bool = False
+    books_queued: int = 0
+    lists_written: int = 0
+    seconds: float = 0.0
+
+
+def is_available() -> bool:
+    """Whether NumPy and SciPy are installed."""
+    return sparse is not None
+
+
+# ============================================================================
+# Matrix
+# ============================================================================
+
+def _load_matrix(connection: Connection):
+    """
+    Read the reader x book matrix, columns scaled to unit length.
+
+    Returns:
+        CSC matrix; column b is book_id b (unread books are empty columns)
+    """
+    rated = select(BookRating.user_id, BookRating.book_id, BookRating.stars / 5.0)
+    purchased = select(UserBooksRead.user_id, UserBooksRead.book_id, literal(PURCHASE_WEIGHT)).where(
+        ~select(BookRating.user_id).where(
+            BookRating.user_id == UserBooksRead.user_id,
+            BookRating.book_id == UserBooksRead.book_id,
+        ).exists()
+    )
+    readers = connection.execute(rated.union_all(purchased)).all()
+    groups = connection.execute(select(GroupReadingHistory.group_id, GroupReadingHistory.book_id)).all()
+
+    def columns(rows, count):
+        return [numpy.fromiter((row[i] for row in rows), dtype=float, count=len(rows)) for i in range(count)]
+
+    user_ids, book_ids, weights = columns(readers, 3)
+    group_ids, group_book_ids = columns(groups, 2)
+
+    # Rows: readers, then groups (numbered after the readers)
+    _, reader_rows = numpy.unique(user_ids, return_inverse=True)
+    _, group_rows = numpy.unique(group_ids, return_inverse=True)
+    reader_count = int(reader_rows.max()) + 1 if len(reader_rows) else 0
+    rows = numpy.concatenate([reader_rows, group_rows + reader_count]).astype(numpy.int64)
+    cols = numpy.concatenate([book_ids, group_book_ids]).astype(numpy.int64)
+    data = numpy.concatenate([weights, numpy.full(len(group_rows), settings.RECOMMENDATION_GROUP_WEIGHT)])
+
+    shape = (int(rows.max()) + 1 if len(rows) else 0, int(cols.max()) + 1 if len(cols) else 0)
+    matrix = sparse.csc_matrix((data, (rows, cols)), shape=shape)
+    norms = numpy.sqrt(numpy.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+    scale = numpy.divide(1.0, norms, out=numpy.zeros_like(norms), where=norms > 0)
+    return (matrix @ sparse.diags(scale)).tocsc()
+
+
+def _similarities(matrix, transposed, book_ids: Sequence[int]):
+    """Cosines of the given books (columns) with every book (rows), as CSC."""
+    book_ids = [book_id for book_id in book_ids if book_id < matrix.shape[1]]
+    if not book_ids:
+        return book_ids, sparse.csc_matrix((matrix.shape[1], 0))
+    product = transposed @ matrix[:, book_ids]
+    product.data = numpy.round(product.data, SCORE_DECIMALS)
+    return book_ids, product.tocsc()
+
+
+def _top(neighbors: Iterable[Tuple[int, float]], limit: int) -> Neighbors:
+    """The best `limit` neighbors with a positive score."""
+    ranked = sorted((item for item in neighbors if item[1] > 0), key=lambda item: (-item[1], item[0]))
+    return ranked[:limit]
+
+
+def _neighbor_lists(similarities, book_ids: Sequence[int], limit: int) -> Dict[int, Neighbors]:
+    """Top neighbors of each computed book (column), leaving out the book itself."""
+    lists = {}
+    for position, book_id in enumerate(book_ids):
+        start, end = similarities.indptr[position], similarities.indptr[position + 1]
+        others, scores = similarities.indices[start:end], similarities.data[start:end]
+        keep = (others != book_id) & (scores > 0)
+        others, scores = others[keep], scores[keep]
+        best = numpy.lexsort((others, -scores))[:limit]
+        lists[book_id] = list(zip(others[best].tolist(), scores[best].tolist()))
+    return lists
+
+
+# ============================================================================
+# Storage
+# ============================================================================
+
+def _stored_lists(connection: Connection, book_ids: Iterable[int]) -> Dict[int, Neighbors]:
+    """The stored lists of the given books."""
+    lists: Dict[int, Neighbors] = {}
+    book_ids = list(book_ids)
+    for start in range(0, len(book_ids), _CHUNK):
+        rows = connection.execute(
+            select(BookNeighbor.book_id, BookNeighbor.neighbor_id, BookNeighbor.score)
+            .where(BookNeighbor.book_id.in_(book_ids[start:start + _CHUNK]))
+            .order_by(BookNeighbor.book_id, BookNeighbor.rank)
+        )
+        for book_id, neighbor_id, score in rows:
+            lists.setdefault(book_id, []).append((neighbor_id, score))
+    return lists
+
+
+def _books_listing(connection: Connection, book_ids: Sequence[int]) -> set:
+    """Books whose stored list contains any of the given books."""
+    listing = set()
+    for start in range(0, len(book_ids), _CHUNK):
+        listing.update(connection.execute(
+            select(BookNeighbor.book_id).where(BookNeighbor.neighbor_id.in_(book_ids[start:start + _CHUNK]))
+        ).scalars())
+    return listing
+
+
+def _last_entries(connection: Connection, book_ids: Sequence[int], limit: int) -> Dict[int, Tuple[int, float]]:
+    """The last entry of the given books' lists, for the lists that are full."""
+    last = {}
+    for start in range(0, len(book_ids), _CHUNK):
+        last.update((book_id, (neighbor_id, score)) for book_id, neighbor_id, score in connection.execute(
+            select(BookNeighbor.book_id, BookNeighbor.neighbor_id, BookNeighbor.score).where(
+                BookNeighbor.book_id.in_(book_ids[start:start + _CHUNK]),
+                BookNeighbor.rank == limit - 1,
+            )
+        ))
+    return last
+
+
+def _write_lists(connection: Connection, lists: Dict[int, Neighbors]):
+    """Replace the stored lists of the given books."""
+    book_ids = list(lists)
+    for start in range(0, len(book_ids), _CHUNK):
+        connection.execute(delete(BookNeighbor).where(BookNeighbor.book_id.in_(book_ids[start:start + _CHUNK])))
+    rows = [
+        {"book_id": book_id, "rank": rank, "neighbor_id": neighbor_id, "score": score}
+        for book_id, neighbors in lists.items()
+        for rank, (neighbor_id, score) in enumerate(neighbors)
+    ]
+    if rows:
+        connection.execute(insert(BookNeighbor), rows)
+
+
+def _replace_all_lists(connection: Connection, lists: Dict[int, Neighbors]):
+    """
+    Replace every stored list. On SQLite the rows go in through the driver
+    with the neighbor_id index dropped and built again afterwards, which
+    is several times faster than keeping it up to date row by row.
+    """
+    connection.execute(delete(BookNeighbor))
+    if connection.dialect.name != "sqlite":
+        _write_lists(connection, lists)
+        return
+
+    index = next(index for index in BookNeighbor.__table__.indexes if index.name == "ix_BookNeighbors_neighbor_id")
+    rows = [
+        (book_id, rank, neighbor_id, score)
+        for book_id in sorted(lists)
+        for rank, (neighbor_id, score) in enumerate(lists[book_id])
+    ]
+    connection.execute(DropIndex(index, if_exists=True))
+    if rows:
+        connection.exec_driver_sql(
+            "INSERT INTO BookNeighbors (book_id, rank, neighbor_id, score) VALUES (?, ?, ?, ?)", rows
+        )
+    connection.execute(CreateIndex(index, if_not_exists=True))
+
+
+def _queued_books(connection: Connection) -> Dict[int, int]:
+    """Book id -> changes counter of every queued book."""
+    return dict(connection.execute(select(BookNeighborQueue.book_id, BookNeighborQueue.changes)).all())
+
+
+def _dequeue(connection: Connection, queued: Dict[int, int]):
+    """Remove the handled books from the queue, unless they changed again meanwhile."""
+    if queued:
+        table = BookNeighborQueue.__table__
+        connection.execute(
+            table.delete().where(
+                table.c.book_id == bindparam("queued_book_id"),
+                table.c.changes == bindparam("queued_changes"),
+            ),
+            [{"queued_book_id": book_id, "queued_changes": changes} for book_id, changes in queued.items()],
+        )
+
+
+# ============================================================================
+# Build and update
+# ============================================================================
+
+def _changed_lists(connection: Connection, matrix, transposed, queued: Sequence[int], limit: int) -> Dict[int, Neighbors]:
+    """
+    The lists that change because the readers of the queued books changed.
+
+    A queued book d gets a new list. Any other book j only has new scores
+    against the queued books, so its stored list is patched: entries for
+    queued books are replaced by their new scores. Books j missing from the
+    stored list score no better than its last entry, so the patched list is
+    exact unless j's list was full and its new last entry ranks below the
+    old one; those lists are computed again. A full list that holds no
+    queued book and that no queued book now ranks into stays as it is,
+    so only its last entry is read.
+    """
+    computed, similarities = _similarities(matrix, transposed, queued)
+    lists = {book_id: [] for book_id in queued}  # queued books nobody reads any more
+    lists.update(_neighbor_lists(similarities, computed, limit))
+
+    # Book j -> {queued book: new score}, from the rows of the product
+    new_scores: Dict[int, Dict[int, float]] = {}
+    by_book = similarities.tocoo()
+    for row, position, score in zip(by_book.row.tolist(), by_book.col.tolist(), by_book.data.tolist()):
+        new_scores.setdefault(row, {})[computed[position]] = score
+
+    # Other books whose list changes: those listing a queued book, and
+    # those a queued book now ranks high enough for (or with room left)
+    queued_set = set(queued)
+    listing = _books_listing(connection, queued) - queued_set
+    others = sorted(set(new_scores) - queued_set - listing)
+    last = _last_entries(connection, others, limit)
+    affected = listing | {
+        book_id for book_id in others
+        if book_id not in last or any(
+            (-score, other) < (-last[book_id][1], last[book_id][0]) for other, score in new_scores[book_id].items()
+        )
+    }
+    stored = _stored_lists(connection, sorted(affected))
+
+    recompute = []
+    for book_id in sorted(affected):
+        old = stored.get(book_id, [])
+        kept = [item for item in old if item[0] not in queued_set]
+        patched = _top(kept + list(new_scores.get(book_id, {}).items()), limit)
+        if len(old) == limit and (
+            len(patched) < limit or (-patched[-1][1], patched[-1][0]) > (-old[-1][1], old[-1][0])
+        ):
+            recompute.append(book_id)
+        elif patched != old:
+            lists[book_id] = patched
+
+    if recompute:
+        computed, similarities = _similarities(matrix, transposed, recompute)
+        lists.update(_neighbor_lists(similarities, computed, limit))
+    return lists
+
+
+def update_neighbors(engine: Engine, full: bool = False) -> Optional[NeighborUpdate]:
+    """
+    Bring BookNeighbors up to date with the readers.
+
+    Recomputes the lists affected by the queued books, or every list when
+    asked to, or when there are none yet. The matrix is read in one
+    transaction and the lists are written in another, so readers and
+    writers are only held up for the write.
+
+    Args:
+        engine: Engine of the database
+        full: Recompute every list
+
+    Returns:
+        What was done, or None without NumPy/SciPy
+    """
+    if not is_available():
+        return None
+
+    started = time.perf_counter()
+    limit = settings.RECOMMENDATION_NEIGHBORS
+
+    with engine.connect() as connection:
+        queued = _queued_books(connection)
+        full = full or connection.execute(select(BookNeighbor.book_id).limit(1)).first() is None
+        if not full and not queued:
+            return NeighborUpdate(seconds=time.perf_counter() - started)
+
+        matrix = _load_matrix(connection)
+        transposed = matrix.T.tocsr()
+        if full:
+            lists = {}
+            for start in range(0, matrix.shape[1], BLOCK_SIZE):
+                computed, similarities = _similarities(
+                    matrix, transposed, range(start, min(start + BLOCK_SIZE, matrix.shape[1]))
+                )
+                lists.update(_neighbor_lists(similarities, computed, limit))
+        else:
+            lists = _changed_lists(connection, matrix, transposed, sorted(queued), limit)
+        connection.rollback()
+
+    with engine.begin() as connection:
+        if full:
+            lists = {book_id: neighbors for book_id, neighbors in lists.items() if neighbors}
+            _replace_all_lists(connection, lists)
+        else:
+            _write_lists(connection, lists)
+        _dequeue(connection, queued)
+
+    return NeighborUpdate(
+        full=full,
+        books_queued=len(queued),
+        lists_written=len(lists),
+        seconds=time.perf_counter() - started,
+    )
+
+
+async def refresh_periodically(engine: Engine, interval: float):
+    """
+    Run update_neighbors every `interval` seconds (in the threadpool) until
+    cancelled. Does nothing without NumPy/SciPy.
+    """
+    if not is_available():
+        logger.warning("RECOMMENDATION_REFRESH_SECONDS is set but numpy/scipy are not installed")
+        return
+
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            update = await run_in_threadpool(update_neighbors, engine)
+            if update.lists_written:
+                logger.info("Updated %d similar book list(s) for %d changed book(s) in %.2f s",
+                            update.lists_written, update.books_queued, update.seconds)
+        except Exception:
+            logger.exception("Updating the similar book lists failed")
@@ -4,16 +4,52 @@ Authentication routes: register, login, logout, get current user.
 
 from fastapi import APIRouter, Depends, HTTPException, status, Request
 from sqlalchemy.orm import Session
-from database import get_db
+from database import get_db, get_read_db, run_db
 from models import User
 from schemas import UserCreate, UserLogin, UserResponse, MessageResponse
-from auth import hash_password, verify_password, create_session, get_current_user_id, require_auth, destroy_session
+from auth import (
+    hash_password_async,
+    verify_password_async,
+    needs_rehash,
+    create_session,
+    cache_user,
+    get_cached_user,
+    require_auth,
+    destroy_session
+)
 
 router = APIRouter(prefix="/api/auth", tags=["Authentication"])
 
 
+def _get_user_by_email(db: Session, email: str):
+    """
+    Find a user by email (called through run_db).
+
+    The user is detached and the transaction ended, so the request doesn't
+    hold a pooled connection while bcrypt runs; otherwise a login storm
+    queues for connections before the password pool can shed it with 503.
+    """
+    user = db.query(User).filter(User.email == email).first()
+    if user is not None:
+        db.expunge(user)
+    db.rollback()
+    return user
+
+
+def _get_user_by_id(db: Session, user_id: int):
+    """Find a user by id (called through run_db)."""
+    return db.query(User).filter(User.user_id == user_id).first()
+
+
+def _save_user(db: Session, user: User):
+    """Commit a new or changed user and reload it (called through run_db)."""
+    db.add(user)
+    db.commit()
+    db.refresh(user)
+
+
 @router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-def register(user_data: UserCreate, request: Request, db: Session = Depends(get_db)):
+async def register(user_data: UserCreate, request: Request, db: Session = Depends(get_db)):
     """
     Register a new user.
 
@@ -23,9 +59,13 @@ def register(user_data: UserCreate, request: Request, db: Session = Depends(get_
     3. Creates the user in the database
     4. Creates a session (logs them in automatically)
     5. Returns the user data
+
+    Password hashing runs on the dedicated password pool; returns 503 when
+    that pool is saturated. Database calls go through run_db (threadpool,
+    or the async driver with ASYNC_DB).
     """
     # Check if email already exists
-    existing_user = db.query(User).filter(User.email == user_data.email).first()
+    existing_user = await run_db(db, _get_user_by_email, user_data.email)
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -33,7 +73,7 @@ def register(user_data: UserCreate, request: Request, db: Session = Depends(get_
         )
 
     # Hash the password
-    hashed_pw = hash_password(user_data.password)
+    hashed_pw = await hash_password_async(user_data.password)
 
     # Create new user
     new_user = User(
@@ -43,29 +83,31 @@ def register(user_data: UserCreate, request: Request, db: Session = Depends(get_
         bookmark_count=0
     )
 
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await run_db(db, _save_user, new_user)
 
     # Create session (auto-login after registration)
-    create_session(request, new_user.user_id)
+    create_session(request, new_user.user_id, new_user)
 
     return new_user
 
 
 @router.post("/login", response_model=UserResponse)
-def login(credentials: UserLogin, request: Request, db: Session = Depends(get_db)):
+async def login(credentials: UserLogin, request: Request, db: Session = Depends(get_db)):
     """
     Login a user.
 
     This endpoint:
     1. Finds user by email
     2. Verifies password
-    3. Creates a session
-    4. Returns the user data
+    3. Re-hashes the password if it was stored with a different bcrypt cost
+    4. Creates a session
+    5. Returns the user data
+
+    Password checks run on the dedicated password pool; returns 503 when
+    that pool is saturated.
     """
     # Find user by email
-    user = db.query(User).filter(User.email == credentials.email).first()
+    user = await run_db(db, _get_user_by_email, credentials.email)
 
     if not user:
         raise HTTPException(
@@ -74,14 +116,19 @@ def login(credentials: UserLogin, request: Request, db: Session = Depends(get_db
         )
 
     # Verify password
-    if not verify_password(credentials.password, user.password_hash):
+    if not await verify_password_async(credentials.password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid email or password"
         )
 
+    # Upgrade (or downgrade) the stored hash to the configured cost
+    if needs_rehash(user.password_hash):
+        user.password_hash = await hash_password_async(credentials.password)
+        await run_db(db, _save_user, user)
+
     # Create session
-    create_session(request, user.user_id)
+    create_session(request, user.user_id, user)
 
     return user
 
@@ -92,7 +139,7 @@ def logout(request: Request):
     Logout the current user.
 
     This endpoint:
-    1. Destroys the session
+    1. Destroys the session (and revokes it in the session store)
     2. Returns a success message
     """
     destroy_session(request)
@@ -100,19 +147,24 @@ def logout(request: Request):
 
 
 @router.get("/me", response_model=UserResponse)
-def get_current_user(request: Request, db: Session = Depends(get_db)):
+async def get_current_user(request: Request, db: Session = Depends(get_read_db)):
     """
     Get the current authenticated user's data.
 
     This endpoint:
     1. Checks if user is authenticated
-    2. Returns their user data
+    2. Returns their user data, from the session cache when it is fresh
+       (otherwise from the database, refreshing the cache)
 
     Returns 401 if not authenticated.
     """
     user_id = require_auth(request)
 
-    user = db.query(User).filter(User.user_id == user_id).first()
+    cached = get_cached_user(request)
+    if cached is not None:
+        return cached
+
+    user = await run_db(db, _get_user_by_id, user_id)
 
     if not user:
         raise HTTPException(
@@ -120,4 +172,5 @@ def get_current_user(request: Request, db: Session = Depends(get_db)):
             detail="User not found"
         )
 
+    cache_user(request, user)
     return user
@@ -2,173 +2,665 @@
 Book routes: browsing, purchasing, rating, and commenting on books.
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status, Request, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from typing import List, Optional
-from database import get_db
-from models import Book, User, UserBooksRead, BookRating, BookComment
+import re
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Query, Header
+from fastapi.responses import StreamingResponse
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, aliased, load_only
+from sqlalchemy import func, and_, insert, literal, select, tuple_, text, update, Integer
+from typing import Dict, List, Optional, Set, Tuple
+import catalog_cache
+import write_behind
+from database import get_db, get_read_db, open_read_session, run_db
+from http_cache import catalog_validators, catalog_version, comments_validators
+from json_response import FastJSONResponse
+from pagination import pack_cursor, unpack_cursor
+from models import (
+    Book, User, UserBooksRead, BookRating, BookRatingStats, BookComment, AVERAGE_RATING, COMMENT_TIME,
+    has_search_index
+)
 from schemas import (
     BookResponse,
     BookWithUserData,
+    BookPage,
+    BookSearchResult,
     RatingCreate,
     RatingResponse,
     CommentCreate,
     CommentResponse,
+    CommentPage,
+    BookBatchRequest,
+    BookBatchResponse,
+    RatingBatchRequest,
+    RatingBatchResponse,
+    PurchaseBatchResponse,
+    BatchItemResult,
     MessageResponse
 )
 from auth import get_current_user_id, require_auth
+from ratings import update_rating_stats
+from idempotency import get_stored_response, store_response
 
 router = APIRouter(prefix="/api/books", tags=["Books"])
 
+# Columns of the Books table, in response order
+BOOK_COLUMNS = (
+    "book_id", "title", "author", "release_year",
+    "summary", "bookmark_price", "cover_image", "pdf_url"
+)
+
+# Fields that are always returned, whatever projection is requested
+REQUIRED_FIELDS = {"book_id", "title", "author"}
+
+# Fields that depend on the current user (never cached)
+USER_FIELDS = {"is_purchased", "user_rating"}
+
+# Orderings supported by catalog pagination: the keyset fields and
+# whether the order is descending
+SORT_ORDERS = {
+    "book_id": (("book_id",), False),
+    "title": (("title", "book_id"), False),
+    "rating": (("average_rating", "book_id"), True),
+}
+
+# Type of each keyset field in a cursor
+SORT_TYPES = {
+    "book_id": int,
+    "title": str,
+    "average_rating": (int, float),
+}
+
+# SQL expression for each keyset field
+SORT_COLUMNS = {
+    "book_id": Book.book_id,
+    "title": Book.title,
+    "average_rating": func.coalesce(AVERAGE_RATING, 0.0),
+}
+
+
+def _books_with_user_data(db: Session, user_id: Optional[int], book_id: Optional[int] = None):
+    """
+    Build one query that returns books together with their rating aggregates
+    and, for a logged-in user, ownership and the user's own rating.
+
+    Rating aggregates come from the BookRatingStats running totals and the
+    per-user data from LEFT JOINs, so the whole result is fetched in a single
+    round trip no matter how many books there are.
+
+    Args:
+        db: Database session
+        user_id: ID of the current user, or None for guests
+        book_id: Restrict the query to a single book
+
+    Returns:
+        Query yielding (Book, average_rating, total_ratings, is_purchased, user_rating) rows
+    """
+    query = db.query(
+        Book,
+        AVERAGE_RATING.label("average_rating"),
+        BookRatingStats.rating_count.label("total_ratings")
+    ).outerjoin(BookRatingStats, BookRatingStats.book_id == Book.book_id)
+
+    if user_id:
+        owned = aliased(UserBooksRead)
+        own_rating = aliased(BookRating)
+        query = query.add_columns(
+            owned.book_id.isnot(None).label("is_purchased"),
+            own_rating.stars.label("user_rating")
+        ).outerjoin(
+            owned, and_(owned.book_id == Book.book_id, owned.user_id == user_id)
+        ).outerjoin(
+            own_rating, and_(own_rating.book_id == Book.book_id, own_rating.user_id == user_id)
+        )
+    else:
+        query = query.add_columns(
+            literal(False).label("is_purchased"),
+            literal(None, Integer).label("user_rating")
+        )
+
+    if book_id is not None:
+        query = query.filter(Book.book_id == book_id)
+
+    return query
+
+
+def _to_book_with_user_data(row, fields: Optional[Set[str]] = None) -> BookWithUserData:
+    """
+    Convert a row from _books_with_user_data into a response object.
+
+    Args:
+        row: Result row from _books_with_user_data
+        fields: Names of the fields to include, or None for all fields
+
+    Returns:
+        Book response; fields left out of the projection are never set
+    """
+    book, avg_rating, total_ratings, is_purchased, user_rating = row
+
+    data = {
+        column: getattr(book, column)
+        for column in BOOK_COLUMNS
+        if fields is None or column in fields
+    }
+    data.update(
+        is_purchased=bool(is_purchased),
+        user_rating=user_rating,
+        average_rating=float(avg_rating) if avg_rating else None,
+        total_ratings=total_ratings or 0
+    )
+
+    if fields is not None:
+        data = {key: value for key, value in data.items() if key in fields}
+
+    return BookWithUserData(**data)
+
+
+def _parse_fields(fields: Optional[str]) -> Optional[Set[str]]:
+    """
+    Parse a comma-separated field projection.
+
+    book_id, title and author are always included. Raises a 400 error for
+    unknown field names.
+    """
+    if not fields:
+        return None
+
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = requested - set(BookWithUserData.model_fields)
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(sorted(unknown))}"
+        )
+
+    return requested | REQUIRED_FIELDS
+
+
+def _sort_values(sort: str, row) -> list:
+    """Get the keyset values of a row from _books_with_user_data."""
+    book, avg_rating = row[0], row[1]
+    keys, _ = SORT_ORDERS[sort]
+    return [(avg_rating or 0.0) if key == "average_rating" else getattr(book, key) for key in keys]
+
+
+def _encode_cursor(sort: str, row) -> str:
+    """Encode the keyset position of a catalog row."""
+    return pack_cursor(sort, _sort_values(sort, row))
+
+
+def _decode_cursor(sort: str, cursor: str) -> list:
+    """Decode a catalog cursor produced by _encode_cursor."""
+    return unpack_cursor(sort, cursor, [SORT_TYPES[key] for key in SORT_ORDERS[sort][0]])
+
+
+def _encode_comment_cursor(created_at: datetime, comment_id: int) -> str:
+    """Encode the position of a comment in a book's comment feed."""
+    return pack_cursor("comments", [created_at.isoformat(), comment_id])
+
+
+def _decode_comment_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Decode a comment cursor produced by _encode_comment_cursor."""
+    created_at, comment_id = unpack_cursor("comments", cursor, [str, int])
+    try:
+        return datetime.fromisoformat(created_at), comment_id
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+
+def _fts_query(q: str) -> Optional[str]:
+    """
+    Turn free text into an FTS5 query where every word is a prefix match.
+
+    Example: 'moby di' -> '"moby"* "di"*'. Quoting each word keeps FTS5
+    operators typed by the user from being interpreted.
+    """
+    words = re.findall(r"\w+", q)
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def _apply_search(query, db: Session, q: str):
+    """
+    Filter a Book query by a search string.
+
+    Uses the FTS5 index when the database has one and falls back to a
+    LIKE scan over title and author otherwise.
+    """
+    if has_search_index(db):
+        match = _fts_query(q)
+        if match is None:
+            return query.filter(literal(False))
+        return query.filter(Book.book_id.in_(
+            text("SELECT rowid FROM BooksSearch WHERE BooksSearch MATCH :match").bindparams(match=match)
+        ))
+
+    search_term = f"%{q}%"
+    return query.filter(
+        (Book.title.ilike(search_term)) | (Book.author.ilike(search_term))
+    )
+
+
+def _user_book_data(db: Session, user_id: int, book_ids: List[int]) -> Dict[int, Tuple[bool, Optional[int]]]:
+    """
+    Look up ownership and the user's own rating for some books.
+
+    Args:
+        db: Database session
+        user_id: ID of the current user
+        book_ids: Books to look up
+
+    Returns:
+        Mapping of book_id to (is_purchased, user_rating); books the user
+        neither owns nor rated are left out
+    """
+    owned = aliased(UserBooksRead)
+    own_rating = aliased(BookRating)
+
+    rows = db.query(
+        Book.book_id, owned.book_id.isnot(None), own_rating.stars
+    ).outerjoin(
+        owned, and_(owned.book_id == Book.book_id, owned.user_id == user_id)
+    ).outerjoin(
+        own_rating, and_(own_rating.book_id == Book.book_id, own_rating.user_id == user_id)
+    ).filter(
+        Book.book_id.in_(book_ids),
+        (owned.book_id.isnot(None)) | (own_rating.stars.isnot(None))
+    ).all()
+
+    return {book_id: (bool(is_purchased), stars) for book_id, is_purchased, stars in rows}
+
+
+def _merge_user_data(db: Session, user_id: int, books: List[BookWithUserData],
+                     projection: Optional[Set[str]] = None) -> List[BookWithUserData]:
+    """
+    Put the user's own data on top of shared (cached) books (called through run_db).
+
+    The cached objects are left untouched; changed copies are returned.
+    """
+    if not books or (projection is not None and not projection & USER_FIELDS):
+        return books
+
+    user_data = _user_book_data(db, user_id, [book.book_id for book in books])
+
+    merged = []
+    for book in books:
+        is_purchased, user_rating = user_data.get(book.book_id, (False, None))
+        update = {"is_purchased": is_purchased, "user_rating": user_rating}
+        if projection is not None:
+            update = {key: value for key, value in update.items() if key in projection}
+        merged.append(book.model_copy(update=update))
+    return merged
+
+
+def _top_rated(query, position: Optional[list], limit: int) -> list:
+    """
+    Catalog rows in "rating" order, from two index walks instead of a sort.
+
+    Rated books come first, best first, from the average rating index on
+    BookRatingStats; books without ratings (average 0) follow, newest
+    first, from the Books primary key. A second query runs only when the
+    page reaches the unrated books.
+
+    Args:
+        query: Catalog query from _books_with_user_data
+        position: Decoded (average_rating, book_id) cursor, or None for the first page
+        limit: Number of rows to return
 
-@router.get("", response_model=List[BookWithUserData])
-def get_all_books(
+    Returns:
+        Up to `limit` rows, as query.all() would return them
+    """
+    rows = []
+    if position is None or position[0] > 0:
+        # Range conditions on the indexed average let SQLite seek to the
+        # position (a rated book averages at least 1); the row value
+        # comparison then skips the ties already sent
+        rated = query.filter(AVERAGE_RATING > 0)
+        if position:
+            rated = rated.filter(
+                AVERAGE_RATING <= position[0],
+                tuple_(AVERAGE_RATING, BookRatingStats.book_id) < tuple_(*position)
+            )
+        rows = rated.order_by(AVERAGE_RATING.desc(), BookRatingStats.book_id.desc()).limit(limit).all()
+        position = None
+
+    if len(rows) < limit:
+        unrated = query.filter(func.coalesce(BookRatingStats.rating_count, 0) == 0)
+        if position:
+            unrated = unrated.filter(Book.book_id < position[1])
+        rows += unrated.order_by(Book.book_id.desc()).limit(limit - len(rows)).all()
+
+    return rows
+
+
+def _list_books(db: Session, q: Optional[str], limit: int, cursor: Optional[str],
+                sort: str, projection: Optional[Set[str]]) -> BookPage:
+    """Load the shared part of one catalog page (called through run_db)."""
+    sort_keys, descending = SORT_ORDERS[sort]
+    sort_columns = [SORT_COLUMNS[key] for key in sort_keys]
+
+    # Base query (books and rating aggregates in one statement)
+    query = _books_with_user_data(db, None)
+
+    # Only load the Book columns that will be returned
+    if projection is not None:
+        query = query.options(load_only(
+            *(getattr(Book, column) for column in BOOK_COLUMNS if column in projection)
+        ))
+
+    # Apply search filter if provided
+    if q:
+        query = _apply_search(query, db, q)
+
+    position = _decode_cursor(sort, cursor) if cursor else None
+
+    if sort == "rating" and not q:
+        rows = _top_rated(query, position, limit + 1)
+    else:
+        # Continue after the last book of the previous page
+        if position:
+            keyset = tuple_(*sort_columns)
+            query = query.filter(keyset < tuple_(*position) if descending else keyset > tuple_(*position))
+
+        # Fetch one extra row to find out whether another page follows
+        order_by = [column.desc() for column in sort_columns] if descending else sort_columns
+        rows = query.order_by(*order_by).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(sort, rows[-1])
+
+    return BookPage(
+        items=[_to_book_with_user_data(row, projection) for row in rows],
+        next_cursor=next_cursor
+    )
+
+
+@router.get(
+    "",
+    response_model=BookPage,
+    response_model_exclude_unset=True,
+    responses={304: {"description": "The client's copy (If-None-Match / If-Modified-Since) is current"}}
+)
+async def get_all_books(
     request: Request,
     q: Optional[str] = Query(None, description="Search query for book title or author"),
-    db: Session = Depends(get_db)
+    limit: int = Query(50, ge=1, le=200, description="Maximum number of books per page"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    sort: str = Query("book_id", pattern="^(book_id|title|rating)$", description="Sort order: book_id, title or rating (highest first)"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. title,author,cover_image"),
+    db: Session = Depends(get_read_db)
 ):
     """
-    Get all books. Optionally filter by search query.
+    Get one page of books. Optionally filter by search query.
 
     - **q**: Search query (searches in title and author)
-    - Returns list of books with user-specific data if authenticated
+    - **limit** / **cursor**: Keyset pagination; pass back next_cursor to get the following page
+    - **sort**: Order by book_id (default), by title, or by average rating (highest first)
+    - **fields**: Projection for list views; book_id, title and author are always included
+    - Returns books with user-specific data if authenticated
+    - Sends an ETag; a request with a matching If-None-Match gets 304 Not Modified
     """
     user_id = get_current_user_id(request)
+    projection = _parse_fields(fields)
+    await write_behind.writer.wait_for_user(user_id)
 
-    # Base query
-    query = db.query(Book)
+    # Answer repeat requests before building the page
+    validators = await run_db(db, catalog_validators, user_id, str(request.url.path) + "?" + request.url.query)
+    if validators:
+        if validators.is_fresh(request):
+            return validators.not_modified()
+    headers = validators.headers() if validators else None
+    # A cached body must be from the catalog version the ETag describes
+    version = validators.version if validators else None
 
-    # Apply search filter if provided
-    if q:
-        search_term = f"%{q}%"
-        query = query.filter(
-            (Book.title.ilike(search_term)) | (Book.author.ilike(search_term))
-        )
+    # The page without per-user data is the same for everyone, so it is cached
+    cache_key = (q, limit, cursor, sort, frozenset(projection) if projection is not None else None)
+    page = catalog_cache.pages.get(cache_key, version)
+    if page is None:
+        generation = catalog_cache.current_generation()
+        page = await run_db(db, _list_books, q, limit, cursor, sort, projection)
+        catalog_cache.pages.put(cache_key, page, generation, version)
 
-    books = query.all()
+    if user_id:
+        items = await run_db(db, _merge_user_data, user_id, page.items, projection)
+        page = BookPage(items=items, next_cursor=page.next_cursor)
 
-    # Enrich books with user-specific data
-    result = []
-    for book in books:
-        # Calculate average rating
-        avg_rating = db.query(func.avg(BookRating.stars)).filter(
-            BookRating.book_id == book.book_id
-        ).scalar()
-
-        total_ratings = db.query(func.count(BookRating.stars)).filter(
-            BookRating.book_id == book.book_id
-        ).scalar()
-
-        # Check if user has purchased this book
-        is_purchased = False
-        user_rating = None
-
-        if user_id:
-            is_purchased = db.query(UserBooksRead).filter(
-                UserBooksRead.user_id == user_id,
-                UserBooksRead.book_id == book.book_id
-            ).first() is not None
-
-            rating = db.query(BookRating).filter(
-                BookRating.user_id == user_id,
-                BookRating.book_id == book.book_id
-            ).first()
-
-            if rating:
-                user_rating = rating.stars
-
-        # Create response object
-        book_data = BookWithUserData(
-            book_id=book.book_id,
-            title=book.title,
-            author=book.author,
-            release_year=book.release_year,
-            summary=book.summary,
-            bookmark_price=book.bookmark_price,
-            cover_image=book.cover_image,
-            pdf_url=book.pdf_url,
-            is_purchased=is_purchased,
-            user_rating=user_rating,
-            average_rating=float(avg_rating) if avg_rating else None,
-            total_ratings=total_ratings or 0
-        )
+    return FastJSONResponse(page, exclude_unset=True, headers=headers)
 
-        result.append(book_data)
 
-    return result
+def _search_books(db: Session, q: str, limit: int) -> List[BookSearchResult]:
+    """Run a ranked search (called through run_db)."""
+    if not has_search_index(db):
+        # No FTS5: plain LIKE scan, alphabetical, no snippets
+        books = _apply_search(db.query(Book), db, q).order_by(Book.title).limit(limit).all()
+        return [
+            BookSearchResult(
+                book_id=book.book_id,
+                title=book.title,
+                author=book.author,
+                cover_image=book.cover_image,
+                bookmark_price=book.bookmark_price,
+                title_highlight=book.title
+            )
+            for book in books
+        ]
+
+    match = _fts_query(q)
+    if match is None:
+        return []
 
+    rows = db.execute(text("""
+        SELECT b.book_id, b.title, b.author, b.cover_image, b.bookmark_price,
+               highlight(BooksSearch, 0, '<mark>', '</mark>') AS title_highlight,
+               snippet(BooksSearch, 2, '<mark>', '</mark>', '...', 12) AS snippet
+        FROM BooksSearch
+        JOIN Books b ON b.book_id = BooksSearch.rowid
+        WHERE BooksSearch MATCH :match
+        ORDER BY bm25(BooksSearch, 10.0, 5.0, 1.0)
+        LIMIT :limit
+    """), {"match": match, "limit": limit}).mappings().all()
 
-@router.get("/{book_id}", response_model=BookWithUserData)
-def get_book_by_id(
+    return [BookSearchResult(**row) for row in rows]
+
+
+@router.get("/search", response_model=List[BookSearchResult])
+async def search_books(
+    q: str = Query(..., min_length=1, description="Search text; every word is matched as a prefix"),
+    limit: int = Query(10, ge=1, le=50, description="Maximum number of results"),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Full-text search over title, author and summary, best matches first.
+
+    - **q**: Search text (typeahead friendly: "moby di" matches "Moby Dick")
+    - Results are ranked with bm25 (title > author > summary) and include
+      highlighted matches
+    """
+    return FastJSONResponse(await run_db(db, _search_books, q, limit))
+
+
+def _get_book(db: Session, book_id: int) -> BookWithUserData:
+    """Load the shared part of one book (called through run_db)."""
+    row = _books_with_user_data(db, None, book_id=book_id).first()
+
+    if not row:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Book not found"
+        )
+
+    return _to_book_with_user_data(row)
+
+
+@router.get(
+    "/{book_id}",
+    response_model=BookWithUserData,
+    responses={304: {"description": "The client's copy (If-None-Match / If-Modified-Since) is current"}}
+)
+async def get_book_by_id(
     book_id: int,
     request: Request,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Get detailed information about a specific book.
 
     - **book_id**: The ID of the book
     - Returns book details with user-specific data if authenticated
+    - Sends an ETag; a request with a matching If-None-Match gets 304 Not Modified
     """
     user_id = get_current_user_id(request)
+    await write_behind.writer.wait_for_user(user_id)
+
+    validators = await run_db(db, catalog_validators, user_id, request.url.path)
+    if validators:
+        if validators.is_fresh(request):
+            return validators.not_modified()
+    headers = validators.headers() if validators else None
+    # A cached body must be from the catalog version the ETag describes
+    version = validators.version if validators else None
+
+    book = catalog_cache.books.get(book_id, version)
+    if book is None:
+        generation = catalog_cache.current_generation()
+        book = await run_db(db, _get_book, book_id)
+        catalog_cache.books.put(book_id, book, generation, version)
+
+    if user_id:
+        book = (await run_db(db, _merge_user_data, user_id, [book]))[0]
+
+    return FastJSONResponse(book, headers=headers)
+
+
+def _get_books(db: Session, book_ids: List[int]) -> Dict[int, BookWithUserData]:
+    """Load the shared part of several books with one IN query (called through run_db)."""
+    rows = _books_with_user_data(db, None).filter(Book.book_id.in_(book_ids)).all()
+    return {row[0].book_id: _to_book_with_user_data(row) for row in rows}
+
+
+@router.post("/batch", response_model=BookBatchResponse)
+async def get_books_batch(
+    batch: BookBatchRequest,
+    request: Request,
+    db: Session = Depends(get_read_db)
+):
+    """
+    Get several books in one request, e.g. to render a shelf.
+
+    - **book_ids**: Up to 200 book IDs
+    - Returns the books in request order (with user-specific data if
+      authenticated) and lists the IDs that don't exist in not_found
+    - Books not in the catalog cache are loaded with a single query
+    """
+    user_id = get_current_user_id(request)
+    book_ids = list(dict.fromkeys(batch.book_ids))
+
+    # Cached books must be from the current catalog version, as in get_book_by_id
+    version = await run_db(db, catalog_version)
+
+    books = {}
+    for book_id in book_ids:
+        book = catalog_cache.books.get(book_id, version)
+        if book is not None:
+            books[book_id] = book
+
+    uncached = [book_id for book_id in book_ids if book_id not in books]
+    if uncached:
+        generation = catalog_cache.current_generation()
+        loaded = await run_db(db, _get_books, uncached)
+        for book_id, book in loaded.items():
+            catalog_cache.books.put(book_id, book, generation, version)
+        books.update(loaded)
+
+    items = [books[book_id] for book_id in book_ids if book_id in books]
+    if user_id:
+        items = await run_db(db, _merge_user_data, user_id, items)
+
+    return FastJSONResponse(BookBatchResponse(
+        items=items,
+        not_found=[book_id for book_id in book_ids if book_id not in books]
+    ))
 
-    # Get book
-    book = db.query(Book).filter(Book.book_id == book_id).first()
 
+def _purchase_book(db: Session, user_id: int, book_id: int,
+                   idempotency_key: Optional[str], request_path: str):
+    """Charge the user and add the book to their library (called through run_db)."""
+    # Replay the original result of a retried request
+    if idempotency_key:
+        stored = get_stored_response(db, user_id, idempotency_key, request_path)
+        if stored:
+            return stored
+
+    # Check if book exists
+    book = db.query(Book).filter(Book.book_id == book_id).first()
     if not book:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Book not found"
         )
 
-    # Calculate average rating
-    avg_rating = db.query(func.avg(BookRating.stars)).filter(
-        BookRating.book_id == book_id
-    ).scalar()
+    result = {"message": f"Successfully purchased '{book.title}'"}
 
-    total_ratings = db.query(func.count(BookRating.stars)).filter(
-        BookRating.book_id == book_id
-    ).scalar()
+    try:
+        # Add book to user's library (the primary key rejects a second copy)
+        db.add(UserBooksRead(user_id=user_id, book_id=book_id))
+        db.flush()
 
-    # Check if user has purchased this book
-    is_purchased = False
-    user_rating = None
+        # Deduct bookmarks only if the user can afford the book. The check and
+        # the subtraction happen in one UPDATE, so concurrent purchases can't
+        # both spend the same balance.
+        charged = db.execute(
+            update(User)
+            .where(User.user_id == user_id, User.bookmark_count >= book.bookmark_price)
+            .values(bookmark_count=User.bookmark_count - book.bookmark_price)
+        ).rowcount
 
-    if user_id:
-        is_purchased = db.query(UserBooksRead).filter(
-            UserBooksRead.user_id == user_id,
-            UserBooksRead.book_id == book_id
-        ).first() is not None
+        if not charged:
+            db.rollback()
+            balance = db.query(User.bookmark_count).filter(User.user_id == user_id).scalar()
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Insufficient bookmarks. You have {balance}, need {book.bookmark_price}"
+            )
 
-        rating = db.query(BookRating).filter(
-            BookRating.user_id == user_id,
-            BookRating.book_id == book_id
-        ).first()
-
-        if rating:
-            user_rating = rating.stars
-
-    return BookWithUserData(
-        book_id=book.book_id,
-        title=book.title,
-        author=book.author,
-        release_year=book.release_year,
-        summary=book.summary,
-        bookmark_price=book.bookmark_price,
-        cover_image=book.cover_image,
-        pdf_url=book.pdf_url,
-        is_purchased=is_purchased,
-        user_rating=user_rating,
-        average_rating=float(avg_rating) if avg_rating else None,
-        total_ratings=total_ratings or 0
-    )
+        if idempotency_key:
+            store_response(db, user_id, idempotency_key, request_path, status.HTTP_200_OK, result)
+
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+
+        # A concurrent request with the same key may have just finished
+        if idempotency_key:
+            stored = get_stored_response(db, user_id, idempotency_key, request_path)
+            if stored:
+                return stored
+
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="You already own this book"
+        )
+
+    return result
 
 
-@router.post("/{book_id}/purchase", response_model=MessageResponse)
-def purchase_book(
+@router.post(
+    "/{book_id}/purchase",
+    response_model=MessageResponse,
+    responses={409: {"description": "The user already owns this book"}}
+)
+async def purchase_book(
     book_id: int,
     request: Request,
+    idempotency_key: Optional[str] = Header(
+        None, max_length=255, description="Retries with the same key return the original result"
+    ),
     db: Session = Depends(get_db)
 ):
     """
@@ -177,67 +669,136 @@ def purchase_book(
     - **book_id**: The ID of the book to purchase
     - Deducts bookmark_price from user's bookmark_count
     - Adds book to user's library
+    - Returns 409 if the user already owns the book
+    - **Idempotency-Key** header: a retried purchase with the same key gets the
+      original response back instead of being processed again
     """
     user_id = require_auth(request)
 
-    # Check if book exists
-    book = db.query(Book).filter(Book.book_id == book_id).first()
-    if not book:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Book not found"
-        )
+    return await run_db(db, _purchase_book, user_id, book_id, idempotency_key, request.url.path)
 
-    # Check if user already owns this book
-    already_purchased = db.query(UserBooksRead).filter(
-        UserBooksRead.user_id == user_id,
-        UserBooksRead.book_id == book_id
-    ).first()
 
-    if already_purchased:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="You already own this book"
-        )
+# A concurrent request changed what a batch purchase was checked against
+BATCH_PURCHASE_CONFLICT = "Your library or balance changed during the purchase, please retry"
 
-    # Get user
-    user = db.query(User).filter(User.user_id == user_id).first()
 
-    # Check if user has enough bookmarks
-    if user.bookmark_count < book.bookmark_price:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Insufficient bookmarks. You have {user.bookmark_count}, need {book.bookmark_price}"
+def _purchase_books(db: Session, user_id: int, book_ids: List[int],
+                    idempotency_key: Optional[str], request_path: str):
+    """Buy several books in one transaction (called through run_db)."""
+    # Replay the original result of a retried request
+    if idempotency_key:
+        stored = get_stored_response(db, user_id, idempotency_key, request_path)
+        if stored:
+            return stored
+
+    # Everything the checks need, in three queries for the whole batch
+    books = {
+        book_id: (title, price)
+        for book_id, title, price in db.execute(
+            select(Book.book_id, Book.title, Book.bookmark_price).where(Book.book_id.in_(book_ids))
         )
+    }
+    owned = set(db.scalars(
+        select(UserBooksRead.book_id).where(
+            UserBooksRead.user_id == user_id,
+            UserBooksRead.book_id.in_(book_ids)
+        )
+    ))
+    balance = db.execute(select(User.bookmark_count).where(User.user_id == user_id)).scalar() or 0
 
-    # Deduct bookmarks
-    user.bookmark_count -= book.bookmark_price
+    # Books are bought in request order while the balance lasts
+    results = []
+    purchased = []
+    total = 0
+    for book_id in book_ids:
+        if book_id not in books:
+            results.append(BatchItemResult(book_id=book_id, status=status.HTTP_404_NOT_FOUND, detail="Book not found"))
+            continue
 
-    # Add book to user's library
-    user_book = UserBooksRead(user_id=user_id, book_id=book_id)
-    db.add(user_book)
+        title, price = books[book_id]
+        if book_id in owned:
+            results.append(BatchItemResult(book_id=book_id, status=status.HTTP_409_CONFLICT, detail="You already own this book"))
+        elif balance - total < price:
+            results.append(BatchItemResult(
+                book_id=book_id,
+                status=status.HTTP_400_BAD_REQUEST,
+                detail=f"Insufficient bookmarks. You have {balance - total}, need {price}"
+            ))
+        else:
+            owned.add(book_id)
+            purchased.append(book_id)
+            total += price
+            results.append(BatchItemResult(
+                book_id=book_id, status=status.HTTP_200_OK, detail=f"Successfully purchased '{title}'"
+            ))
 
-    db.commit()
+    result = PurchaseBatchResponse(results=results, bookmark_count=balance - total)
 
-    return {"message": f"Successfully purchased '{book.title}'"}
+    try:
+        if purchased:
+            db.execute(insert(UserBooksRead), [
+                {"user_id": user_id, "book_id": book_id} for book_id in purchased
+            ])
 
+            # Charge the whole batch in one guarded UPDATE, as for a single
+            # purchase: a concurrent spend makes it match no row
+            charged = db.execute(
+                update(User)
+                .where(User.user_id == user_id, User.bookmark_count >= total)
+                .values(bookmark_count=User.bookmark_count - total)
+            ).rowcount
+            if not charged:
+                db.rollback()
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=BATCH_PURCHASE_CONFLICT)
 
-@router.post("/{book_id}/rate", response_model=RatingResponse)
-def rate_book(
-    book_id: int,
-    rating_data: RatingCreate,
+        if idempotency_key:
+            store_response(db, user_id, idempotency_key, request_path, status.HTTP_200_OK, result.model_dump())
+
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+
+        # A concurrent request with the same key may have just finished
+        if idempotency_key:
+            stored = get_stored_response(db, user_id, idempotency_key, request_path)
+            if stored:
+                return stored
+
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=BATCH_PURCHASE_CONFLICT)
+
+    return result
+
+
+@router.post(
+    "/purchases:batch",
+    response_model=PurchaseBatchResponse,
+    responses={409: {"description": "A concurrent purchase changed the library or balance; nothing was bought"}}
+)
+async def purchase_books_batch(
+    batch: BookBatchRequest,
     request: Request,
+    idempotency_key: Optional[str] = Header(
+        None, max_length=255, description="Retries with the same key return the original result"
+    ),
     db: Session = Depends(get_db)
 ):
     """
-    Rate a book (1-5 stars). Requires authentication.
+    Purchase several books in one transaction. Requires authentication.
 
-    - **book_id**: The ID of the book to rate
-    - **stars**: Rating from 1 to 5
-    - Creates new rating or updates existing one
+    - **book_ids**: Up to 200 book IDs, bought in this order while the balance lasts
+    - Returns a result per book with the status the single purchase endpoint
+      would have returned (200, 400 insufficient bookmarks, 404, 409 already owned)
+    - All purchases are committed together; returns 409 (and buys nothing)
+      if a concurrent request changed the library or balance
+    - **Idempotency-Key** header: as for a single purchase
     """
     user_id = require_auth(request)
 
+    return await run_db(db, _purchase_books, user_id, batch.book_ids, idempotency_key, request.url.path)
+
+
+def _save_rating(db: Session, user_id: int, book_id: int, stars: int) -> RatingResponse:
+    """Create or update the user's rating, without committing."""
     # Check if book exists
     book = db.query(Book).filter(Book.book_id == book_id).first()
     if not book:
@@ -253,80 +814,257 @@ def rate_book(
     ).first()
 
     if existing_rating:
-        # Update existing rating
-        existing_rating.stars = rating_data.stars
-        db.commit()
-        db.refresh(existing_rating)
-        return existing_rating
+        # Update existing rating (the book keeps the same number of ratings)
+        update_rating_stats(db, book_id, stars - existing_rating.stars, 0)
+        existing_rating.stars = stars
+        db.flush()
+        return RatingResponse.model_validate(existing_rating)
     else:
         # Create new rating
         new_rating = BookRating(
             user_id=user_id,
             book_id=book_id,
-            stars=rating_data.stars
+            stars=stars
         )
         db.add(new_rating)
-        db.commit()
-        db.refresh(new_rating)
-        return new_rating
+        update_rating_stats(db, book_id, stars, 1)
+        db.flush()
+        return RatingResponse.model_validate(new_rating)
+
+
+def _rate_book(db: Session, user_id: int, book_id: int, stars: int) -> RatingResponse:
+    """Create or update the user's rating (called through run_db)."""
+    rating = _save_rating(db, user_id, book_id, stars)
+    db.commit()
+    return rating
 
 
-@router.get("/{book_id}/comments", response_model=List[CommentResponse])
-def get_book_comments(
+@router.post(
+    "/{book_id}/rate",
+    response_model=RatingResponse,
+    responses={202: {"model": MessageResponse, "description": "Queued (WRITE_BEHIND_DURABILITY=accepted)"}}
+)
+async def rate_book(
     book_id: int,
+    rating_data: RatingCreate,
+    request: Request,
     db: Session = Depends(get_db)
 ):
     """
-    Get all comments for a book.
+    Rate a book (1-5 stars). Requires authentication.
 
-    - **book_id**: The ID of the book
-    - Returns list of comments with user names
+    - **book_id**: The ID of the book to rate
+    - **stars**: Rating from 1 to 5
+    - Creates new rating or updates existing one
+    - With the write-behind queue, committed together with other writes
+      (see write_behind.py)
     """
-    # Check if book exists
-    book = db.query(Book).filter(Book.book_id == book_id).first()
-    if not book:
+    user_id = require_auth(request)
+
+    if write_behind.writer.active:
+        return await write_behind.writer.submit(
+            request, user_id, _save_rating, user_id, book_id, rating_data.stars,
+            check=lambda: run_db(db, _require_book, book_id)
+        )
+
+    return await run_db(db, _rate_book, user_id, book_id, rating_data.stars)
+
+
+def _rate_books(db: Session, user_id: int, batch: RatingBatchRequest) -> RatingBatchResponse:
+    """Create or update several ratings in one transaction (called through run_db)."""
+    book_ids = {rating.book_id for rating in batch.ratings}
+
+    existing_books = set(db.scalars(select(Book.book_id).where(Book.book_id.in_(book_ids))))
+    current = dict(db.execute(
+        select(BookRating.book_id, BookRating.stars).where(
+            BookRating.user_id == user_id,
+            BookRating.book_id.in_(book_ids)
+        )
+    ).all())
+
+    # A book rated twice in the batch keeps the last rating
+    results = []
+    final: Dict[int, int] = {}
+    for rating in batch.ratings:
+        if rating.book_id in existing_books:
+            final[rating.book_id] = rating.stars
+            results.append(BatchItemResult(book_id=rating.book_id, status=status.HTTP_200_OK, stars=rating.stars))
+        else:
+            results.append(BatchItemResult(book_id=rating.book_id, status=status.HTTP_404_NOT_FOUND, detail="Book not found"))
+
+    new_ratings = []
+    changed_ratings = []
+    for book_id, stars in final.items():
+        old_stars = current.get(book_id)
+        if old_stars is None:
+            new_ratings.append({"user_id": user_id, "book_id": book_id, "stars": stars})
+            update_rating_stats(db, book_id, stars, 1)
+        elif old_stars != stars:
+            changed_ratings.append({"user_id": user_id, "book_id": book_id, "stars": stars})
+            update_rating_stats(db, book_id, stars - old_stars, 0)
+
+    # executemany for each kind of write, one commit for the batch
+    if new_ratings:
+        db.execute(insert(BookRating), new_ratings)
+    if changed_ratings:
+        db.execute(update(BookRating), changed_ratings)
+    db.commit()
+
+    return RatingBatchResponse(results=results)
+
+
+@router.post("/ratings:batch", response_model=RatingBatchResponse)
+async def rate_books_batch(
+    batch: RatingBatchRequest,
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    """
+    Rate several books in one transaction (e.g. syncing offline ratings).
+    Requires authentication.
+
+    - **ratings**: Up to 200 {book_id, stars} items
+    - Returns a result per item: 200 with the stars saved, or 404 for a
+      book that doesn't exist (the other ratings are still saved)
+    """
+    user_id = require_auth(request)
+
+    return await run_db(db, _rate_books, user_id, batch)
+
+
+def _comments_query(book_id: int, before: Optional[str]):
+    """
+    SELECT for a book's comments with the author's name, newest first,
+    starting after the `before` cursor. The (book_id, COMMENT_TIME) index
+    serves both the filter and the order, so no sort step is needed.
+    """
+    query = select(
+        BookComment.comment_id,
+        BookComment.book_id,
+        BookComment.user_id,
+        BookComment.content,
+        BookComment.created_at,
+        User.name.label("user_name"),
+        COMMENT_TIME.label("comment_time")
+    ).join(
+        User, BookComment.user_id == User.user_id
+    ).where(
+        BookComment.book_id == book_id
+    )
+
+    if before:
+        created_at, comment_id = _decode_comment_cursor(before)
+        query = query.where(
+            tuple_(COMMENT_TIME, BookComment.comment_id) < tuple_(created_at, comment_id),
+            # Implied by the row comparison, but SQLite only seeks the
+            # expression index on a plain comparison
+            COMMENT_TIME <= created_at
+        )
+
+    return query.order_by(COMMENT_TIME.desc(), BookComment.comment_id.desc())
+
+
+def _require_book(db: Session, book_id: int):
+    """Raise a 404 error if the book does not exist."""
+    if db.query(Book.book_id).filter(Book.book_id == book_id).first() is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Book not found"
         )
 
-    # Get comments with user data
-    comments = db.query(BookComment, User.name).join(
-        User, BookComment.user_id == User.user_id
-    ).filter(
-        BookComment.book_id == book_id
-    ).order_by(BookComment.created_at.desc()).all()
-
-    # Format response
-    result = []
-    for comment, user_name in comments:
-        result.append(CommentResponse(
-            comment_id=comment.comment_id,
-            book_id=comment.book_id,
-            user_id=comment.user_id,
-            content=comment.content,
-            created_at=comment.created_at,
-            user_name=user_name
-        ))
 
-    return result
+def _list_comments(db: Session, book_id: int, before: Optional[str], limit: int) -> CommentPage:
+    """Load one page of a book's comments, newest first (called through run_db)."""
+    # Check if book exists
+    _require_book(db, book_id)
+
+    # Fetch one extra row to find out whether another page follows
+    rows = db.execute(_comments_query(book_id, before).limit(limit + 1)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_comment_cursor(rows[-1].comment_time, rows[-1].comment_id)
+
+    return CommentPage(
+        items=[CommentResponse(**row._mapping) for row in rows],
+        next_cursor=next_cursor
+    )
+
 
+# Rows fetched from the database per chunk of an NDJSON stream
+COMMENT_STREAM_BATCH = 500
 
-@router.post("/{book_id}/comments", response_model=CommentResponse, status_code=status.HTTP_201_CREATED)
-def add_book_comment(
+
+def _stream_comments(request: Request, book_id: int, before: Optional[str]):
+    """
+    Yield a book's comments as NDJSON, one batch of lines at a time.
+
+    Runs after the endpoint has returned, so it opens its own session
+    (the request's session is already closed). Rows come from the
+    database cursor in batches; the full list is never held in memory.
+    """
+    query = _comments_query(book_id, before).execution_options(yield_per=COMMENT_STREAM_BATCH)
+
+    with open_read_session(request) as db:
+        for rows in db.execute(query).partitions():
+            yield "".join(
+                CommentResponse(**row._mapping).model_dump_json() + "\n" for row in rows
+            )
+
+
+@router.get(
+    "/{book_id}/comments",
+    response_model=CommentPage,
+    responses={
+        200: {"content": {"application/x-ndjson": {}}},
+        304: {"description": "The client's copy (If-None-Match / If-Modified-Since) is current"}
+    }
+)
+async def get_book_comments(
     book_id: int,
-    comment_data: CommentCreate,
     request: Request,
-    db: Session = Depends(get_db)
+    before: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(50, ge=1, le=200, description="Maximum number of comments per page"),
+    response_format: str = Query("json", alias="format", pattern="^(json|ndjson)$", description="json (one page) or ndjson (stream)"),
+    db: Session = Depends(get_read_db)
 ):
     """
-    Add a comment to a book. Requires authentication.
+    Get a book's comments, newest first.
 
     - **book_id**: The ID of the book
-    - **content**: The comment text
+    - **limit** / **before**: Keyset pagination; pass back next_cursor to get older comments
+    - **format=ndjson**: Stream every comment (older than **before**, if given)
+      as newline-delimited JSON instead of one page; meant for exports and
+      moderation tools, ignores **limit**
+    - Sends an ETag; a request with a matching If-None-Match gets 304 Not Modified
     """
-    user_id = require_auth(request)
+    # The author sees their own queued comments
+    await write_behind.writer.wait_for_user(get_current_user_id(request))
+
+    validators = await run_db(db, comments_validators, book_id, str(request.url.path) + "?" + request.url.query)
+    if validators:
+        if validators.is_fresh(request):
+            return validators.not_modified()
+    headers = validators.headers() if validators else None
+
+    if response_format == "ndjson":
+        # Check what can fail before the 200 status is sent
+        await run_db(db, _require_book, book_id)
+        if before:
+            _decode_comment_cursor(before)
+        return StreamingResponse(
+            _stream_comments(request, book_id, before),
+            media_type="application/x-ndjson",
+            headers=headers
+        )
+
+    page = await run_db(db, _list_comments, book_id, before, limit)
+    return FastJSONResponse(page, exclude_unset=True, headers=headers)
+
 
+def _save_comment(db: Session, user_id: int, book_id: int, content: str) -> CommentResponse:
+    """Store a new comment, without committing."""
     # Check if book exists
     book = db.query(Book).filter(Book.book_id == book_id).first()
     if not book:
@@ -342,12 +1080,11 @@ def add_book_comment(
     new_comment = BookComment(
         book_id=book_id,
         user_id=user_id,
-        content=comment_data.content
+        content=content
     )
 
     db.add(new_comment)
-    db.commit()
-    db.refresh(new_comment)
+    db.flush()
 
     return CommentResponse(
         comment_id=new_comment.comment_id,
@@ -357,3 +1094,41 @@ def add_book_comment(
         created_at=new_comment.created_at,
         user_name=user.name
     )
+
+
+def _add_comment(db: Session, user_id: int, book_id: int, content: str) -> CommentResponse:
+    """Store a new comment (called through run_db)."""
+    comment = _save_comment(db, user_id, book_id, content)
+    db.commit()
+    return comment
+
+
+@router.post(
+    "/{book_id}/comments",
+    response_model=CommentResponse,
+    status_code=status.HTTP_201_CREATED,
+    responses={202: {"model": MessageResponse, "description": "Queued (WRITE_BEHIND_DURABILITY=accepted)"}}
+)
+async def add_book_comment(
+    book_id: int,
+    comment_data: CommentCreate,
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    """
+    Add a comment to a book. Requires authentication.
+
+    - **book_id**: The ID of the book
+    - **content**: The comment text
+    - With the write-behind queue, committed together with other writes
+      (see write_behind.py)
+    """
+    user_id = require_auth(request)
+
+    if write_behind.writer.active:
+        return await write_behind.writer.submit(
+            request, user_id, _save_comment, user_id, book_id, comment_data.content,
+            check=lambda: run_db(db, _require_book, book_id)
+        )
+
+    return await run_db(db, _add_comment, user_id, book_id, comment_data.content)
@@ -0,0 +1,416 @@
+"""
+Group routes: browsing, creating, joining and leaving reading groups, and
+the group discussion (posts and the live feed).
+"""
+
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Query, Header
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, select
+from sqlalchemy.orm import Session, joinedload
+from typing import Optional
+import group_feed
+import write_behind
+from config import settings
+from database import get_db, get_read_db, open_read_session, run_db
+from json_response import FastJSONResponse
+from memberships import join_group, leave_group
+from models import Book, Group, GroupPost, UserGroup
+from pagination import pack_cursor, unpack_cursor
+from schemas import GroupCreate, GroupResponse, GroupPage, MessageResponse, PostCreate, PostResponse, PostPage
+from auth import require_auth
+
+router = APIRouter(prefix="/api/groups", tags=["Groups"])
+
+# Posts read per query when a reconnecting feed client catches up
+FEED_BACKFILL_BATCH = 200
+
+# How long EventSource clients wait before reconnecting (milliseconds)
+FEED_RETRY_MS = 3000
+
+
+def _groups_query():
+    """Groups with their current book, joined into the same statement."""
+    return select(Group).options(joinedload(Group.current_book))
+
+
+def _list_groups(db: Session, member_id: Optional[int], book_id: Optional[int],
+                 limit: int, cursor: Optional[str]) -> GroupPage:
+    """Load one page of groups (called through run_db)."""
+    query = _groups_query()
+    order_column = Group.group_id
+
+    # A user's groups come straight from the UserGroups primary key
+    # (user_id, group_id); paging on its group_id avoids a sort
+    if member_id is not None:
+        query = query.join(UserGroup, and_(
+            UserGroup.group_id == Group.group_id,
+            UserGroup.user_id == member_id
+        ))
+        order_column = UserGroup.group_id
+
+    if book_id is not None:
+        query = query.where(Group.current_book_id == book_id)
+
+    # Continue after the last group of the previous page
+    if cursor:
+        after_group_id = unpack_cursor("groups", cursor, [int])[0]
+        query = query.where(order_column > after_group_id)
+
+    # Fetch one extra row to find out whether another page follows
+    groups = db.execute(query.order_by(order_column).limit(limit + 1)).scalars().all()
+
+    next_cursor = None
+    if len(groups) > limit:
+        groups = groups[:limit]
+        next_cursor = pack_cursor("groups", [groups[-1].group_id])
+
+    return GroupPage(
+        items=[GroupResponse.model_validate(group) for group in groups],
+        next_cursor=next_cursor
+    )
+
+
+@router.get("", response_model=GroupPage)
+async def get_all_groups(
+    request: Request,
+    mine: bool = Query(False, description="Only groups the current user belongs to (requires authentication)"),
+    member_id: Optional[int] = Query(None, description="Only groups this user belongs to"),
+    book_id: Optional[int] = Query(None, description="Only groups currently reading this book"),
+    limit: int = Query(50, ge=1, le=200, description="Maximum number of groups per page"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Get one page of groups, oldest first.
+
+    - **mine** / **member_id**: Only groups the current user / a given user belongs to
+    - **book_id**: Only groups whose current book is this book
+    - **limit** / **cursor**: Keyset pagination; pass back next_cursor to get the following page
+    - Each group includes its member_count and current_book
+    """
+    if mine:
+        member_id = require_auth(request)
+
+    return FastJSONResponse(await run_db(db, _list_groups, member_id, book_id, limit, cursor))
+
+
+def _get_group(db: Session, group_id: int) -> GroupResponse:
+    """
+    Load one group with its current book (called through run_db).
+
+    Always reads the row from the database, even if the session already
+    holds the group (e.g. with its member_count from before a join).
+    """
+    group = db.execute(
+        _groups_query()
+        .where(Group.group_id == group_id)
+        .execution_options(populate_existing=True)
+    ).scalar_one_or_none()
+
+    if not group:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Group not found"
+        )
+
+    return GroupResponse.model_validate(group)
+
+
+@router.get("/{group_id}", response_model=GroupResponse)
+async def get_group_by_id(group_id: int, db: Session = Depends(get_read_db)):
+    """
+    Get a group with its member_count and current book.
+
+    - **group_id**: The ID of the group
+    """
+    return FastJSONResponse(await run_db(db, _get_group, group_id))
+
+
+def _create_group(db: Session, user_id: int, group_data: GroupCreate) -> GroupResponse:
+    """Create a group with its creator as first member (called through run_db)."""
+    if group_data.current_book_id is not None and db.get(Book, group_data.current_book_id) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Book not found"
+        )
+
+    group = Group(
+        name=group_data.name,
+        cover_image=group_data.cover_image,
+        current_book_id=group_data.current_book_id,
+        member_count=0
+    )
+    db.add(group)
+    db.flush()
+
+    join_group(db, user_id, group.group_id)
+    db.commit()
+
+    return _get_group(db, group.group_id)
+
+
+@router.post("", response_model=GroupResponse, status_code=status.HTTP_201_CREATED)
+async def create_group(group_data: GroupCreate, request: Request, db: Session = Depends(get_db)):
+    """
+    Create a new group. Requires authentication.
+
+    - The creator becomes the group's first member
+    - **current_book_id**: Optional book the group starts reading
+    """
+    user_id = require_auth(request)
+
+    return await run_db(db, _create_group, user_id, group_data)
+
+
+def _require_group(db: Session, group_id: int):
+    """Raise 404 if the group doesn't exist."""
+    if db.get(Group, group_id) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Group not found"
+        )
+
+
+def _change_membership(db: Session, user_id: int, group_id: int, join: bool) -> GroupResponse:
+    """Join or leave a group and return it (called through run_db)."""
+    _require_group(db, group_id)
+
+    if join:
+        join_group(db, user_id, group_id)
+    else:
+        leave_group(db, user_id, group_id)
+    db.commit()
+
+    return _get_group(db, group_id)
+
+
+@router.post("/{group_id}/join", response_model=GroupResponse)
+async def join(group_id: int, request: Request, db: Session = Depends(get_db)):
+    """
+    Join a group. Requires authentication.
+
+    - Joining a group you are already in changes nothing
+    - Returns the group with its updated member_count
+    """
+    user_id = require_auth(request)
+
+    return await run_db(db, _change_membership, user_id, group_id, True)
+
+
+@router.post("/{group_id}/leave", response_model=GroupResponse)
+async def leave(group_id: int, request: Request, db: Session = Depends(get_db)):
+    """
+    Leave a group. Requires authentication.
+
+    - Leaving a group you are not in changes nothing
+    - Returns the group with its updated member_count
+    """
+    user_id = require_auth(request)
+
+    return await run_db(db, _change_membership, user_id, group_id, False)
+
+
+def _list_posts(db: Session, group_id: int, before: Optional[str], limit: int) -> PostPage:
+    """Load one page of a group's posts, newest first (called through run_db)."""
+    _require_group(db, group_id)
+
+    query = (
+        group_feed.posts_query()
+        .where(GroupPost.group_id == group_id)
+        .order_by(None)
+        .order_by(GroupPost.post_id.desc())
+    )
+
+    # Continue with the posts older than the last page
+    if before:
+        before_post_id = unpack_cursor("posts", before, [int])[0]
+        query = query.where(GroupPost.post_id < before_post_id)
+
+    # Fetch one extra row to find out whether another page follows
+    rows = db.execute(query.limit(limit + 1)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = pack_cursor("posts", [rows[-1].post_id])
+
+    return PostPage(
+        items=[PostResponse(**row._mapping) for row in rows],
+        next_cursor=next_cursor
+    )
+
+
+@router.get("/{group_id}/posts", response_model=PostPage)
+async def get_group_posts(
+    group_id: int,
+    request: Request,
+    before: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(50, ge=1, le=200, description="Maximum number of posts per page"),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Get one page of a group's posts, newest first. Requires authentication.
+
+    - **before** / **limit**: Keyset pagination; pass back next_cursor to get older posts
+    - For new posts as they are written, use the feed endpoint
+    """
+    user_id = require_auth(request)
+    # The author sees their own queued posts
+    await write_behind.writer.wait_for_user(user_id)
+
+    return FastJSONResponse(await run_db(db, _list_posts, group_id, before, limit))
+
+
+def _check_post(db: Session, user_id: int, group_id: int, post_data: PostCreate):
+    """Raise 404/403 unless the user may post this in the group (called through run_db)."""
+    _require_group(db, group_id)
+
+    if db.get(UserGroup, (user_id, group_id)) is None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Join the group to post in it"
+        )
+
+    if post_data.book_id is not None and db.get(Book, post_data.book_id) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Book not found"
+        )
+
+
+def _save_post(db: Session, user_id: int, group_id: int, post_data: PostCreate) -> PostResponse:
+    """Save a post by a group member, without committing."""
+    _check_post(db, user_id, group_id, post_data)
+
+    post = GroupPost(
+        group_id=group_id,
+        user_id=user_id,
+        book_id=post_data.book_id,
+        content=post_data.content
+    )
+    db.add(post)
+    db.flush()
+
+    row = db.execute(group_feed.posts_query().where(GroupPost.post_id == post.post_id)).one()
+    return PostResponse(**row._mapping)
+
+
+def _create_post(db: Session, user_id: int, group_id: int, post_data: PostCreate) -> PostResponse:
+    """Save a post by a group member (called through run_db)."""
+    post = _save_post(db, user_id, group_id, post_data)
+    db.commit()
+    return post
+
+
+@router.post(
+    "/{group_id}/posts",
+    response_model=PostResponse,
+    status_code=status.HTTP_201_CREATED,
+    responses={202: {"model": MessageResponse, "description": "Queued (WRITE_BEHIND_DURABILITY=accepted)"}}
+)
+async def create_post(group_id: int, post_data: PostCreate, request: Request, db: Session = Depends(get_db)):
+    """
+    Post in a group's discussion. Requires authentication and membership.
+
+    - **book_id**: Optional book the post is about
+    - The post is pushed to everyone following the group's feed
+    - With the write-behind queue, committed together with other writes
+      (see write_behind.py)
+    """
+    user_id = require_auth(request)
+
+    if write_behind.writer.active:
+        return await write_behind.writer.submit(
+            request, user_id, _save_post, user_id, group_id, post_data,
+            check=lambda: run_db(db, _check_post, user_id, group_id, post_data),
+            on_commit=group_feed.broker.post_created
+        )
+
+    post = await run_db(db, _create_post, user_id, group_id, post_data)
+    group_feed.broker.post_created(post)
+
+    return post
+
+
+def _load_posts_after(request: Request, group_id: int, after_post_id: int):
+    """Posts a reconnecting feed client missed (runs in the threadpool)."""
+    with open_read_session(request) as db:
+        return group_feed.posts_after(db, after_post_id, FEED_BACKFILL_BATCH, group_id)
+
+
+async def _feed_events(request: Request, group_id: int, after_post_id: Optional[int]):
+    """
+    Yield a group's posts as server-sent events.
+
+    Subscribes first, then sends the posts after after_post_id from the
+    database, then live posts (skipping any the database already
+    returned). Ends when the subscription overflows; the client then
+    reconnects and catches up from the database.
+    """
+    subscription = group_feed.broker.subscribe(group_id)
+    try:
+        yield f"retry: {FEED_RETRY_MS}\n\n"
+
+        sent_through = after_post_id or 0
+        if after_post_id is not None:
+            while True:
+                posts = await run_in_threadpool(_load_posts_after, request, group_id, sent_through)
+                for post in posts:
+                    yield group_feed.format_event(post)
+                if posts:
+                    sent_through = posts[-1].post_id
+                if len(posts) < FEED_BACKFILL_BATCH:
+                    break
+
+        while True:
+            if subscription.overflowed and subscription.queue.empty():
+                return
+
+            try:
+                post_id, event = await asyncio.wait_for(
+                    subscription.queue.get(), settings.FEED_HEARTBEAT_SECONDS
+                )
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+
+            if post_id > sent_through:
+                sent_through = post_id
+                yield event
+    finally:
+        group_feed.broker.unsubscribe(subscription)
+
+
+@router.get(
+    "/{group_id}/feed",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"text/event-stream": {}}}}
+)
+async def get_group_feed(
+    group_id: int,
+    request: Request,
+    after: Optional[int] = Query(None, description="Resume after this post_id"),
+    last_event_id: Optional[str] = Header(None, description="Set by EventSource when it reconnects"),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Follow a group's new posts as server-sent events. Requires authentication.
+
+    - Each event is a PostResponse with the post_id as its event id
+    - **after** / **Last-Event-ID**: Resume after this post; missed posts are
+      sent first (EventSource sends Last-Event-ID on reconnect by itself)
+    - Clients that fall behind are disconnected and should reconnect
+    """
+    require_auth(request)
+    await run_db(db, _require_group, group_id)
+
+    if last_event_id is not None and last_event_id.isdigit():
+        after = int(last_event_id)
+
+    return StreamingResponse(
+        _feed_events(request, group_id, after),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -0,0 +1,68 @@
+"""
+Leaderboard routes: trending, top-rated and most-purchased books.
+The boards are kept in memory by leaderboards.py.
+"""
+
+from typing import List, Tuple
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+import leaderboards
+from database import get_read_db, run_db
+from json_response import FastJSONResponse
+from models import Book
+from schemas import LeaderboardEntry
+
+router = APIRouter(prefix="/api/leaderboards", tags=["Leaderboards"])
+
+
+def _leaderboard_entries(db: Session, ranked: List[Tuple[int, float]]) -> List[LeaderboardEntry]:
+    """Load the ranked books (called through run_db)."""
+    if not ranked:
+        return []
+
+    books = {
+        row.book_id: row
+        for row in db.execute(
+            select(Book.book_id, Book.title, Book.author, Book.cover_image, Book.bookmark_price)
+            .where(Book.book_id.in_([book_id for book_id, _ in ranked]))
+        )
+    }
+    return [
+        LeaderboardEntry(
+            rank=rank,
+            book_id=book_id,
+            title=books[book_id].title,
+            author=books[book_id].author,
+            cover_image=books[book_id].cover_image,
+            bookmark_price=books[book_id].bookmark_price,
+            score=round(score, 4)
+        )
+        for rank, (book_id, score) in enumerate(
+            (item for item in ranked if item[0] in books), start=1
+        )
+    ]
+
+
+@router.get("/{board}", response_model=List[LeaderboardEntry])
+async def get_leaderboard(
+    board: str,
+    limit: int = Query(10, ge=1, le=100, description="Number of books"),
+    db: Session = Depends(get_read_db)
+):
+    """
+    The best books of a leaderboard.
+
+    - **board**: `trending` (recent purchases, ratings and comments, decayed
+      over time), `top-rated` (average stars, weighted by the number of
+      ratings) or `most-purchased` (all time)
+    - Boards are refreshed every few seconds (LEADERBOARD_REFRESH_SECONDS)
+    """
+    if board not in leaderboards.BOARDS:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Unknown leaderboard; use one of: {', '.join(leaderboards.BOARDS)}"
+        )
+
+    ranked = leaderboards.boards.top(board, limit)
+    return FastJSONResponse(await run_db(db, _leaderboard_entries, ranked))
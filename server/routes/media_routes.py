@@ -0,0 +1,74 @@
+"""
+Media routes: book and group covers, their thumbnails, and PDFs.
+Content-hashed URLs (from GET /media/manifest) are cached by browsers for
+a year; the path-based URL is for links that can't know the hash.
+"""
+
+import os
+from fastapi import APIRouter, HTTPException, status, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from config import settings
+from http_cache import etag_matches
+from json_response import FastJSONResponse
+from media import IMMUTABLE, REVALIDATE, Asset, MediaFileResponse, library
+
+router = APIRouter(prefix="/media", tags=["Media"])
+
+
+def _file_response(request: Request, asset: Asset, cache_control: str) -> MediaFileResponse:
+    """Send an original media file."""
+    accel_path = None
+    if settings.MEDIA_ACCEL_REDIRECT:
+        accel_path = settings.MEDIA_ACCEL_REDIRECT.rstrip("/") + "/" + asset.relative_path
+    return MediaFileResponse(
+        request, asset.path, asset.etag, asset.media_type, cache_control,
+        os.stat(asset.path), accel_path
+    )
+
+
+@router.get("/manifest")
+def get_manifest(request: Request):
+    """
+    Map every media path (as stored in cover_image) to its content-hashed
+    URL and thumbnail URLs.
+    """
+    etag = f'"{library.version}"'
+    headers = {"ETag": etag, "Cache-Control": REVALIDATE}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return FastJSONResponse(library.manifest(), headers=headers)
+
+
+@router.api_route("/thumbs/{digest}/{width}.webp", methods=["GET", "HEAD"])
+async def get_thumbnail(request: Request, digest: str, width: int):
+    """
+    A cover resized to one of MEDIA_THUMBNAIL_WIDTHS, as WebP.
+    Made on first request if `manage.py build-thumbnails` hasn't yet.
+    """
+    asset = library.by_digest(digest)
+    path = await run_in_threadpool(library.thumbnail, asset, width) if asset else None
+    if path is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Thumbnail not found")
+
+    return MediaFileResponse(
+        request, path, f'"{digest}-{width}"', "image/webp", IMMUTABLE, os.stat(path)
+    )
+
+
+@router.api_route("/files/{path:path}", methods=["GET", "HEAD"])
+def get_file_by_path(request: Request, path: str):
+    """A media file by its stored path; revalidated on every use."""
+    asset = library.get(path)
+    if asset is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+    return _file_response(request, asset, REVALIDATE)
+
+
+@router.api_route("/{digest}/{name}", methods=["GET", "HEAD"])
+def get_file(request: Request, digest: str, name: str):
+    """A media file by content hash; cached for good."""
+    asset = library.by_digest(digest)
+    if asset is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+    return _file_response(request, asset, IMMUTABLE)
@@ -0,0 +1,124 @@
+"""
+Recommendation routes: similar books and a reader's recommendations.
+Both read the neighbor lists precomputed by recommendations.py.
+"""
+
+from typing import Dict, List
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Query
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from config import settings
+from database import get_read_db, run_db
+from json_response import FastJSONResponse
+from models import Book, BookNeighbor, BookRating, UserBooksRead
+from schemas import BookRecommendation
+from auth import require_auth
+
+router = APIRouter(tags=["Recommendations"])
+
+# Seed weight of a book the reader bought but hasn't rated
+PURCHASE_SEED_WEIGHT = 0.5
+
+
+def _to_recommendations(db: Session, scores: Dict[int, float]) -> List[BookRecommendation]:
+    """Load the scored books, in the order given."""
+    books = {
+        row.book_id: row
+        for row in db.execute(
+            select(Book.book_id, Book.title, Book.author, Book.cover_image, Book.bookmark_price)
+            .where(Book.book_id.in_(list(scores)))
+        )
+    }
+    return [
+        BookRecommendation(
+            book_id=book_id,
+            title=books[book_id].title,
+            author=books[book_id].author,
+            cover_image=books[book_id].cover_image,
+            bookmark_price=books[book_id].bookmark_price,
+            score=round(score, 4)
+        )
+        for book_id, score in scores.items() if book_id in books
+    ]
+
+
+def _similar_books(db: Session, book_id: int, limit: int) -> List[BookRecommendation]:
+    """Read a book's neighbor list (called through run_db)."""
+    if db.get(Book, book_id) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Book not found"
+        )
+
+    neighbors = db.execute(
+        select(BookNeighbor.neighbor_id, BookNeighbor.score)
+        .where(BookNeighbor.book_id == book_id)
+        .order_by(BookNeighbor.rank)
+        .limit(limit)
+    ).all()
+    return _to_recommendations(db, dict(neighbors))
+
+
+@router.get("/api/books/{book_id}/similar", response_model=List[BookRecommendation])
+async def similar_books(
+    book_id: int,
+    limit: int = Query(10, ge=1, le=50, description="Maximum number of books"),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Books read by the readers of this book ("readers of this also read"),
+    most similar first.
+
+    - **book_id**: The ID of the book
+    - Empty until the neighbor lists have been built
+      (`python manage.py build-recommendations`)
+    """
+    return FastJSONResponse(await run_db(db, _similar_books, book_id, limit))
+
+
+def _recommendations(db: Session, user_id: int, limit: int) -> List[BookRecommendation]:
+    """Score the neighbors of the reader's books (called through run_db)."""
+    ratings = db.execute(select(BookRating.book_id, BookRating.stars).where(BookRating.user_id == user_id)).all()
+    purchased = db.scalars(select(UserBooksRead.book_id).where(UserBooksRead.user_id == user_id)).all()
+
+    # Liked books count for, disliked books against (5 stars 1.0 ... 1 star -1.0)
+    seeds = {book_id: (stars - 3) / 2 for book_id, stars in ratings if stars != 3}
+    for book_id in purchased:
+        seeds.setdefault(book_id, PURCHASE_SEED_WEIGHT)
+    strongest = sorted(seeds, key=lambda book_id: (-abs(seeds[book_id]), book_id))[:settings.RECOMMENDATION_MAX_SEEDS]
+    if not strongest:
+        return []
+
+    seen = set(purchased) | {book_id for book_id, _ in ratings}
+    scores: Dict[int, float] = {}
+    for book_id, neighbor_id, score in db.execute(
+        select(BookNeighbor.book_id, BookNeighbor.neighbor_id, BookNeighbor.score)
+        .where(BookNeighbor.book_id.in_(strongest))
+    ):
+        if neighbor_id not in seen:
+            scores[neighbor_id] = scores.get(neighbor_id, 0.0) + seeds[book_id] * score
+
+    best = sorted(
+        (item for item in scores.items() if item[1] > 0), key=lambda item: (-item[1], item[0])
+    )[:limit]
+    return _to_recommendations(db, dict(best))
+
+
+@router.get("/api/me/recommendations", response_model=List[BookRecommendation])
+async def my_recommendations(
+    request: Request,
+    limit: int = Query(10, ge=1, le=50, description="Maximum number of books"),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Books for the current user, from the books similar to the ones they
+    rated highly or bought, best first.
+
+    - Requires authentication
+    - Books the user rated or owns are left out; low ratings count against
+      the books similar to them
+    - Empty for a user who hasn't rated or bought anything yet
+    """
+    user_id = require_auth(request)
+
+    return FastJSONResponse(await run_db(db, _recommendations, user_id, limit))
@@ -67,6 +67,28 @@ class BookWithUserData(BookResponse):
     total_ratings: int = 0
 
 
+class BookSearchResult(BaseModel):
+    """
+    Schema for a ranked search hit.
+
+    title_highlight and snippet wrap matched terms in <mark> tags; the rest of
+    the text is not HTML-escaped, so clients must escape it before rendering.
+    """
+    book_id: int
+    title: str
+    author: str
+    cover_image: Optional[str] = None
+    bookmark_price: int = 0
+    title_highlight: str
+    snippet: Optional[str] = None
+
+
+class BookPage(BaseModel):
+    """One page of the book catalog with an opaque cursor for the next page."""
+    items: List[BookWithUserData]
+    next_cursor: Optional[str] = None
+
+
 # ============================================================================
 # Rating Schemas
 # ============================================================================
@@ -86,6 +108,57 @@ class RatingResponse(BaseModel):
         from_attributes = True
 
 
+# ============================================================================
+# Batch Schemas
+# ============================================================================
+
+# Most items one batch request may carry
+BATCH_MAX_ITEMS = 200
+
+
+class BookBatchRequest(BaseModel):
+    """Schema for looking up, or purchasing, several books at once."""
+    book_ids: List[int] = Field(..., min_length=1, max_length=BATCH_MAX_ITEMS)
+
+
+class BookBatchResponse(BaseModel):
+    """Books found by a batch lookup, in request order, and the ids that weren't."""
+    items: List[BookWithUserData]
+    not_found: List[int] = []
+
+
+class BatchRating(RatingCreate):
+    """One rating in a batch."""
+    book_id: int
+
+
+class RatingBatchRequest(BaseModel):
+    """Schema for rating several books at once."""
+    ratings: List[BatchRating] = Field(..., min_length=1, max_length=BATCH_MAX_ITEMS)
+
+
+class BatchItemResult(BaseModel):
+    """
+    Outcome of one item of a batch write: the status code and detail the
+    single-item endpoint would have answered with.
+    """
+    book_id: int
+    status: int
+    detail: Optional[str] = None
+    stars: Optional[int] = None
+
+
+class RatingBatchResponse(BaseModel):
+    """Per-item results of a batch rating, in request order."""
+    results: List[BatchItemResult]
+
+
+class PurchaseBatchResponse(BaseModel):
+    """Per-item results of a batch purchase, in request order, and the new balance."""
+    results: List[BatchItemResult]
+    bookmark_count: int
+
+
 # ============================================================================
 # Comment Schemas
 # ============================================================================
@@ -101,13 +174,19 @@ class CommentResponse(BaseModel):
     book_id: int
     user_id: int
     content: str
-    created_at: datetime
+    created_at: Optional[datetime] = None  # NULL on some older comments
     user_name: str  # Will be populated from joined User data
 
     class Config:
         from_attributes = True
 
 
+class CommentPage(BaseModel):
+    """One page of a book's comments with an opaque cursor for older comments."""
+    items: List[CommentResponse]
+    next_cursor: Optional[str] = None
+
+
 # ============================================================================
 # Group Schemas
 # ============================================================================
@@ -119,6 +198,11 @@ class GroupBase(BaseModel):
     current_book_id: Optional[int] = None
 
 
+class GroupCreate(GroupBase):
+    """Schema for creating a group."""
+    name: str = Field(..., min_length=1, max_length=100)
+
+
 class GroupResponse(GroupBase):
     """Schema for group data in responses."""
     group_id: int
@@ -130,6 +214,12 @@ class GroupResponse(GroupBase):
         from_attributes = True
 
 
+class GroupPage(BaseModel):
+    """One page of groups with an opaque cursor for the next page."""
+    items: List[GroupResponse]
+    next_cursor: Optional[str] = None
+
+
 # ============================================================================
 # Group Post Schemas
 # ============================================================================
@@ -153,6 +243,49 @@ class PostResponse(BaseModel):
         from_attributes = True
 
 
+class PostPage(BaseModel):
+    """One page of a group's posts with an opaque cursor for older posts."""
+    items: List[PostResponse]
+    next_cursor: Optional[str] = None
+
+
+# ============================================================================
+# Recommendation Schemas
+# ============================================================================
+
+class BookRecommendation(BaseModel):
+    """
+    Schema for a similar or recommended book.
+    score is the cosine similarity for /similar (0..1) and the weighted sum
+    over the reader's books for recommendations; higher is better.
+    """
+    book_id: int
+    title: str
+    author: str
+    cover_image: Optional[str] = None
+    bookmark_price: int = 0
+    score: float
+
+
+# ============================================================================
+# Leaderboard Schemas
+# ============================================================================
+
+class LeaderboardEntry(BaseModel):
+    """
+    Schema for a book on a leaderboard.
+    score is the decayed activity (trending), the weighted average rating
+    (top-rated) or the number of purchases (most-purchased).
+    """
+    rank: int
+    book_id: int
+    title: str
+    author: str
+    cover_image: Optional[str] = None
+    bookmark_price: int = 0
+    score: float
+
+
 # ============================================================================
 # Generic Response Schemas
 # ============================================================================
@@ -0,0 +1,205 @@
+"""
+Server-side sessions.
+The session cookie only holds a random, signed session id; the session data lives
+in a session store. The default store keeps sessions in memory (an LRU
+per worker process); the Redis store keeps them in any server that speaks
+the Redis protocol, so several workers share the same sessions.
+
+Routes keep using request.session as before. Logging out deletes the
+record from the store, so the old cookie stops working everywhere.
+"""
+
+import json
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from itsdangerous import BadSignature, Signer
+from starlette.datastructures import MutableHeaders
+from starlette.requests import HTTPConnection
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from config import settings
+
+# Scope key set by auth.create_session to issue a new session id
+ROTATE_SESSION_KEY = "session_rotate"
+
+
+class SessionStore:
+    """Interface of a session store. Session data is a JSON-serializable dict."""
+
+    async def load(self, session_id: str) -> Optional[dict]:
+        """Return the session's data, or None if it doesn't exist or expired."""
+        raise NotImplementedError
+
+    async def save(self, session_id: str, data: dict, ttl_seconds: int):
+        """Create or replace a session, expiring ttl_seconds from now."""
+        raise NotImplementedError
+
+    async def delete(self, session_id: str):
+        """Remove a session (logout)."""
+        raise NotImplementedError
+
+    async def close(self):
+        """Release connections (on shutdown)."""
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Sessions in this process's memory, least recently used dropped first.
+
+    Each worker process has its own sessions, so use it with a single
+    worker (or sticky sessions); use RedisSessionStore otherwise.
+    """
+
+    def __init__(self, max_entries: int = 100_000):
+        self.max_entries = max_entries
+        self._sessions: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def load(self, session_id: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            payload, expires_at = entry
+            if expires_at <= time.time():
+                del self._sessions[session_id]
+                return None
+            self._sessions.move_to_end(session_id)
+        # Stored as JSON, so callers never share (and mutate) the stored dict
+        return json.loads(payload)
+
+    async def save(self, session_id: str, data: dict, ttl_seconds: int):
+        payload = json.dumps(data)
+        with self._lock:
+            self._sessions[session_id] = (payload, time.time() + ttl_seconds)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+
+    async def delete(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Sessions in a Redis-protocol server (Redis, Valkey, KeyDB, ...), using
+    GET / SET EX / DEL only. Needs the redis package.
+    """
+
+    def __init__(self, url: str, key_prefix: str = "bookclub:session:"):
+        try:
+            import redis.asyncio
+        except ImportError as error:
+            raise RuntimeError("SESSION_STORE=redis needs the redis package (pip install redis)") from error
+
+        self.client = redis.asyncio.from_url(url)
+        self.key_prefix = key_prefix
+
+    async def load(self, session_id: str) -> Optional[dict]:
+        payload = await self.client.get(self.key_prefix + session_id)
+        return json.loads(payload) if payload is not None else None
+
+    async def save(self, session_id: str, data: dict, ttl_seconds: int):
+        await self.client.set(self.key_prefix + session_id, json.dumps(data), ex=ttl_seconds)
+
+    async def delete(self, session_id: str):
+        await self.client.delete(self.key_prefix + session_id)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def create_session_store() -> SessionStore:
+    """Build the session store selected by SESSION_STORE."""
+    if settings.SESSION_STORE == "memory":
+        return MemorySessionStore(settings.SESSION_MAX_ENTRIES)
+    if settings.SESSION_STORE == "redis":
+        return RedisSessionStore(settings.SESSION_REDIS_URL)
+    raise ValueError(f"Unknown SESSION_STORE '{settings.SESSION_STORE}', expected 'memory' or 'redis'")
+
+
+class ServerSessionMiddleware:
+    """
+    ASGI middleware providing request.session from a SessionStore.
+
+    The session is loaded when the request arrives and written back when
+    the response starts, only if it changed. An emptied session (logout)
+    is deleted from the store and its cookie expired.
+
+    Args:
+        app: The wrapped application
+        store: Where sessions are kept
+        secret_key: Key signing the session id, so forged cookies are
+            rejected without a store lookup
+        session_cookie: Name of the cookie holding the session id
+        max_age: Session lifetime in seconds, counted from the last change
+        same_site: SameSite attribute of the cookie
+        https_only: Only send the cookie over HTTPS
+    """
+
+    def __init__(self, app: ASGIApp, store: SessionStore, secret_key: str, session_cookie: str = "session",
+                 max_age: int = 86400, same_site: str = "lax", https_only: bool = False):
+        self.app = app
+        self.store = store
+        self.signer = Signer(secret_key)
+        self.session_cookie = session_cookie
+        self.max_age = max_age
+        self.cookie_flags = f"path=/; httponly; samesite={same_site}" + ("; secure" if https_only else "")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        session_id = self._read_cookie(HTTPConnection(scope).cookies.get(self.session_cookie))
+        data = await self.store.load(session_id) if session_id else None
+        if data is None:
+            session_id = None
+
+        scope["session"] = dict(data or {})
+        original = json.dumps(scope["session"], sort_keys=True)
+
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                await self._commit(scope, message, session_id, original)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    def _read_cookie(self, value: Optional[str]) -> Optional[str]:
+        """The session id from a cookie value, or None if it isn't validly signed."""
+        if not value:
+            return None
+        try:
+            return self.signer.unsign(value).decode("utf-8")
+        except BadSignature:
+            return None
+
+    async def _commit(self, scope: Scope, message: Message, session_id: Optional[str], original: str):
+        """Write a changed session back to the store and set the cookie."""
+        session = scope["session"]
+        rotate = scope.get(ROTATE_SESSION_KEY, False)
+        headers = MutableHeaders(scope=message)
+
+        if not session:
+            if session_id:
+                # Logout (or a cleared session): revoke it
+                await self.store.delete(session_id)
+                headers.append("Set-Cookie", f"{self.session_cookie}=null; Max-Age=0; {self.cookie_flags}")
+            return
+
+        if session_id and not rotate and json.dumps(session, sort_keys=True) == original:
+            return
+
+        if rotate or not session_id:
+            # A new id on login, so an id known before login is useless afterwards
+            if session_id:
+                await self.store.delete(session_id)
+            session_id = secrets.token_urlsafe(32)
+
+        await self.store.save(session_id, session, self.max_age)
+        cookie = self.signer.sign(session_id).decode("utf-8")
+        headers.append("Set-Cookie", f"{self.session_cookie}={cookie}; Max-Age={self.max_age}; {self.cookie_flags}")
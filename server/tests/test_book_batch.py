@@ -0,0 +1,52 @@
+"""
+POST /api/books/batch serves cached books only at the current catalog
+version, like GET /api/books/{id}: a change made by another worker (which
+this process's cache doesn't hear about) shows up at once.
+"""
+
+import pytest
+from sqlalchemy import update
+import catalog_cache
+from conftest import add_books
+from database import engine
+from models import Book
+
+
+@pytest.fixture
+def book_cache(monkeypatch):
+    """Turn the book cache on (the tests run with it off)."""
+    monkeypatch.setattr(catalog_cache, "books", catalog_cache.LRUCache("books", 100, 3600))
+
+
+def batch_titles(client, book_ids: list) -> list:
+    response = client.post("/api/books/batch", json={"book_ids": book_ids})
+    assert response.status_code == 200, response.text
+    return [book["title"] for book in response.json()["items"]]
+
+
+def rename_elsewhere(book_id: int, title: str):
+    """Change a book outside the ORM session, so this process's cache isn't told."""
+    with engine.begin() as connection:
+        connection.execute(update(Book).where(Book.book_id == book_id).values(title=title))
+
+
+def test_batch_sees_changes_from_other_workers(client, book_cache):
+    book_ids = add_books(3)
+    titles = batch_titles(client, book_ids)
+    assert catalog_cache.books.stats()["entries"] == 3
+
+    rename_elsewhere(book_ids[1], "Renamed Elsewhere")
+
+    assert batch_titles(client, book_ids) == [titles[0], "Renamed Elsewhere", titles[2]]
+    # The detail route reads the same entries
+    assert client.get(f"/api/books/{book_ids[1]}").json()["title"] == "Renamed Elsewhere"
+
+
+def test_batch_uses_the_cache(client, book_cache):
+    book_ids = add_books(3)
+    batch_titles(client, book_ids)
+    hits = catalog_cache.books.stats()["hits"]
+
+    batch_titles(client, book_ids)
+
+    assert catalog_cache.books.stats()["hits"] == hits + 3
@@ -0,0 +1,62 @@
+"""
+GET /api/books must run a fixed number of statements, however many books
+the page holds (no query per book).
+"""
+
+from contextlib import contextmanager
+import pytest
+from sqlalchemy import event
+from conftest import add_books, clear_catalog, register
+from database import engine, read_engine
+
+N = 15
+
+
+@contextmanager
+def count_statements():
+    """Collect the SQL statements run on the app's engines."""
+    statements = []
+
+    def record(connection, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engines = {engine, read_engine}
+    for target in engines:
+        event.listen(target, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        for target in engines:
+            event.remove(target, "before_cursor_execute", record)
+
+
+def catalog_statements(client, sort: str) -> tuple:
+    """Statements run by one catalog request, and the number of books it returned."""
+    url = f"/api/books?limit=200&sort={sort}"
+    # Settle per-session lookups first, so both counts start from the same state
+    assert client.get(url).status_code == 200
+
+    with count_statements() as statements:
+        response = client.get(url)
+    assert response.status_code == 200
+    return len(statements), len(response.json()["items"])
+
+
+@pytest.mark.parametrize("logged_in", [False, True], ids=["anonymous", "logged-in"])
+@pytest.mark.parametrize("sort", ["book_id", "title"])
+def test_catalog_statements_do_not_grow_with_books(client, logged_in, sort):
+    clear_catalog()
+    if logged_in:
+        register(client, bookmarks=10)
+    book_ids = add_books(N)
+    if logged_in:
+        # Give the user's own data something to find
+        assert client.post(f"/api/books/{book_ids[0]}/purchase").status_code == 200
+        assert client.post(f"/api/books/{book_ids[1]}/rate", json={"stars": 4}).status_code == 200
+
+    small, small_books = catalog_statements(client, sort)
+    add_books(9 * N)
+    large, large_books = catalog_statements(client, sort)
+
+    assert large_books > small_books
+    assert large == small, f"{small} statements for {small_books} books, {large} for {large_books}"
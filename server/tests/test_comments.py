@@ -0,0 +1,57 @@
+"""
+A book's comment feed pages through every comment, newest first,
+including comments without a created_at, which come last.
+"""
+
+import json
+from sqlalchemy import update
+from conftest import add_books, register
+from database import SessionLocal
+from models import BookComment
+
+
+def add_comments(client, book_id: int, count: int) -> list:
+    """Post `count` comments on a book and return their IDs, oldest first."""
+    comment_ids = []
+    for index in range(count):
+        response = client.post(f"/api/books/{book_id}/comments", json={"content": f"Comment {index}"})
+        assert response.status_code == 201, response.text
+        comment_ids.append(response.json()["comment_id"])
+    return comment_ids
+
+
+def all_pages(client, book_id: int, limit: int) -> list:
+    """Comment IDs of every page of a book's comments, following next_cursor."""
+    comment_ids = []
+    params = {"limit": limit}
+    while True:
+        response = client.get(f"/api/books/{book_id}/comments", params=params)
+        assert response.status_code == 200, response.text
+        page = response.json()
+        comment_ids += [comment["comment_id"] for comment in page["items"]]
+        if page["next_cursor"] is None:
+            return comment_ids
+        params["before"] = page["next_cursor"]
+
+
+def test_comments_without_created_at_are_paged(client):
+    register(client)
+    [book_id] = add_books(1)
+    comment_ids = add_comments(client, book_id, 6)
+    undated = comment_ids[1:4]
+    with SessionLocal() as db:
+        db.execute(update(BookComment).where(BookComment.comment_id.in_(undated)).values(created_at=None))
+        db.commit()
+
+    dated = [comment_id for comment_id in comment_ids if comment_id not in undated]
+    expected = dated[::-1] + undated[::-1]
+    for limit in (1, 2, 4, 10):
+        assert all_pages(client, book_id, limit) == expected, f"limit={limit}"
+
+    first = client.get(f"/api/books/{book_id}/comments", params={"limit": 10}).json()["items"]
+    assert [comment["created_at"] for comment in first[-3:]] == [None] * 3
+
+    # The NDJSON stream has them too
+    response = client.get(f"/api/books/{book_id}/comments", params={"format": "ndjson"})
+    assert response.status_code == 200
+    assert [json.loads(line)["comment_id"] for line in response.text.splitlines()] == expected
@@ -0,0 +1,105 @@
+"""
+Cursors come from the client: one that is malformed, or holds values of
+the wrong type for its sort keys, is answered with 400, never 500.
+"""
+
+import base64
+import json
+import pytest
+from conftest import add_books, clear_catalog, register
+from pagination import pack_cursor
+
+
+def forged(kind: str, values) -> str:
+    """A cursor as pack_cursor would make it, but with any values."""
+    payload = json.dumps([kind, values]).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+
+@pytest.mark.parametrize("sort, values", [
+    ("book_id", [{"a": 1}]),
+    ("book_id", [[1]]),
+    ("book_id", ["1"]),
+    ("book_id", [1.5]),
+    ("book_id", [True]),
+    ("book_id", [1 << 70]),
+    ("book_id", [None]),
+    ("title", [1, 1]),
+    ("title", ["Dune", "1"]),
+    ("title", [{"a": 1}, 1]),
+    ("rating", ["4.5", 1]),
+    ("rating", [[4.5], 1]),
+    ("rating", [4.5]),
+])
+def test_catalog_cursor_with_wrong_values(client, sort, values):
+    response = client.get("/api/books", params={"sort": sort, "cursor": forged(sort, values)})
+
+    assert response.status_code == 400, response.text
+    assert response.json()["detail"] == "Invalid cursor"
+
+
+@pytest.mark.parametrize("cursor", ["%%%", "bm90IGpzb24", forged("title", [1])])
+def test_malformed_catalog_cursor(client, cursor):
+    assert client.get("/api/books", params={"cursor": cursor}).status_code == 400
+
+
+@pytest.mark.parametrize("sort, values", [
+    ("book_id", [1]),
+    ("title", ["Dune", 1]),
+    ("rating", [4.5, 1]),
+    ("rating", [0, 1]),
+])
+def test_catalog_cursor_with_valid_values(client, sort, values):
+    add_books(3)
+    response = client.get("/api/books", params={"sort": sort, "cursor": pack_cursor(sort, values)})
+
+    assert response.status_code == 200, response.text
+
+
+def test_catalog_pages_follow_their_cursors(client):
+    clear_catalog()
+    book_ids = add_books(5)
+    seen = []
+    cursor = None
+    while True:
+        params = {"sort": "title", "limit": 2, **({"cursor": cursor} if cursor else {})}
+        page = client.get("/api/books", params=params).json()
+        seen += [book["book_id"] for book in page["items"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert sorted(seen) == book_ids
+
+
+WRONG_ID_VALUES = [["x"], [{"a": 1}], [[1]], [1.5], [True], [None], [1, 2], []]
+
+
+@pytest.mark.parametrize("values", WRONG_ID_VALUES)
+def test_group_cursor_with_wrong_values(client, values):
+    response = client.get("/api/groups", params={"cursor": forged("groups", values)})
+
+    assert response.status_code == 400, response.text
+    assert response.json()["detail"] == "Invalid cursor"
+
+
+@pytest.mark.parametrize("values", WRONG_ID_VALUES)
+def test_post_cursor_with_wrong_values(client, values):
+    register(client)
+    group_id = client.post("/api/groups", json={"name": "Test Group"}).json()["group_id"]
+    response = client.get(f"/api/groups/{group_id}/posts", params={"before": forged("posts", values)})
+
+    assert response.status_code == 400, response.text
+    assert response.json()["detail"] == "Invalid cursor"
+
+
+def test_group_and_post_cursors_with_valid_values(client):
+    register(client)
+    group_id = client.post("/api/groups", json={"name": "Test Group"}).json()["group_id"]
+
+    groups = client.get("/api/groups", params={"cursor": pack_cursor("groups", [0])})
+    posts = client.get(f"/api/groups/{group_id}/posts", params={"before": pack_cursor("posts", [1 << 40])})
+
+    assert groups.status_code == 200, groups.text
+    assert group_id in [group["group_id"] for group in groups.json()["items"]]
+    assert posts.status_code == 200, posts.text
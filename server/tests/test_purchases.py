@@ -0,0 +1,96 @@
+"""
+Concurrent purchases by one user: each book is charged and added to the
+library once, whatever the interleaving, and retries with an
+Idempotency-Key get the original response back.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import func, select
+from conftest import add_books, register
+from database import SessionLocal
+from models import User, UserBooksRead
+
+PRICE = 3
+
+
+def purchase_all(client, requests: list) -> list:
+    """Send (book_id, idempotency_key) purchases at the same time; returns the responses in order."""
+    def purchase(book_id, key):
+        headers = {"Idempotency-Key": key} if key else {}
+        return client.post(f"/api/books/{book_id}/purchase", headers=headers)
+
+    with ThreadPoolExecutor(max_workers=len(requests)) as pool:
+        return list(pool.map(lambda request: purchase(*request), requests))
+
+
+def library(user_id: int) -> dict:
+    """Purchases rows per book, and the balance, of a user."""
+    with SessionLocal() as db:
+        rows = dict(db.execute(
+            select(UserBooksRead.book_id, func.count())
+            .where(UserBooksRead.user_id == user_id)
+            .group_by(UserBooksRead.book_id)
+        ).all())
+        return rows, db.scalar(select(User.bookmark_count).where(User.user_id == user_id))
+
+
+def test_concurrent_purchases_of_the_same_book(client):
+    user_id = register(client, bookmarks=10 * PRICE)
+    [book_id] = add_books(1, price=PRICE)
+
+    responses = purchase_all(client, [(book_id, None)] * 8)
+
+    codes = sorted(response.status_code for response in responses)
+    assert codes == [200] + [409] * 7, [response.text for response in responses]
+    assert library(user_id) == ({book_id: 1}, 9 * PRICE)
+
+
+def test_concurrent_purchases_of_different_books(client):
+    user_id = register(client, bookmarks=10 * PRICE)
+    book_ids = add_books(8, price=PRICE)
+
+    responses = purchase_all(client, [(book_id, None) for book_id in book_ids])
+
+    assert [response.status_code for response in responses] == [200] * 8, [response.text for response in responses]
+    assert library(user_id) == ({book_id: 1 for book_id in book_ids}, 2 * PRICE)
+
+
+def test_concurrent_purchases_never_overdraw(client):
+    user_id = register(client, bookmarks=3 * PRICE)
+    book_ids = add_books(8, price=PRICE)
+
+    responses = purchase_all(client, [(book_id, None) for book_id in book_ids])
+
+    bought = [book_id for book_id, response in zip(book_ids, responses) if response.status_code == 200]
+    assert len(bought) == 3
+    assert sorted(response.status_code for response in responses) == [200] * 3 + [400] * 5
+    assert library(user_id) == ({book_id: 1 for book_id in bought}, 0)
+
+
+def test_concurrent_retries_with_the_same_key(client):
+    user_id = register(client, bookmarks=10 * PRICE)
+    book_ids = add_books(2, price=PRICE)
+
+    # Retries of two purchases, each with its own key, racing each other and
+    # a purchase of the first book without a key
+    requests = [(book_ids[0], "first")] * 4 + [(book_ids[1], "second")] * 4 + [(book_ids[0], None)]
+    responses = purchase_all(client, requests)
+
+    first, second, unkeyed = responses[:4], responses[4:8], responses[8]
+    for retries in (first, second):
+        assert all(response.status_code == retries[0].status_code for response in retries)
+        assert all(response.json() == retries[0].json() for response in retries)
+    assert second[0].status_code == 200
+    # The first book was bought once: either by the keyed request (the unkeyed
+    # one then conflicts) or by the unkeyed one (the keyed ones then conflict)
+    assert sorted([first[0].status_code, unkeyed.status_code]) == [200, 409]
+    assert library(user_id) == ({book_id: 1 for book_id in book_ids}, 8 * PRICE)
+
+    # A later retry is a replay, not a second purchase
+    [replay] = purchase_all(client, [(book_ids[1], "second")])
+    assert replay.status_code == 200
+    assert replay.json() == second[0].json()
+    # A new key for a book the user owns is a new request
+    [again] = purchase_all(client, [(book_ids[1], "third")])
+    assert again.status_code == 409
+    assert library(user_id) == ({book_id: 1 for book_id in book_ids}, 8 * PRICE)
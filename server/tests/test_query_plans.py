@@ -0,0 +1,61 @@
+"""
+No hot-path statement may read an indexed table whole (query_plans.py,
+`manage.py check-query-plans`), checked on a generated database that is
+migrated to the latest schema.
+"""
+
+import shutil
+import pytest
+from sqlalchemy import text
+import migrations
+import query_plans
+from benchmarks.dataset import PRESETS, build_database
+from database import create_db_engine
+
+
+@pytest.fixture(scope="module")
+def dataset(tmp_path_factory):
+    """Path of a database made by benchmarks.dataset (small preset)."""
+    path = str(tmp_path_factory.mktemp("plans") / "bench.db")
+    build_database(path, PRESETS["small"], seed=1, progress=lambda line: None)
+    return path
+
+
+def check(path: str) -> query_plans.PlanReport:
+    engine = create_db_engine(f"sqlite:///{path}")
+    try:
+        with engine.connect() as connection:
+            assert migrations.pending_migrations(connection) == []
+        # Small and empty tables too: the statistics come from realistic data,
+        # so the planner has no reason to read an indexed table whole
+        return query_plans.check_query_plans(engine, small_table_rows=0)
+    finally:
+        engine.dispose()
+
+
+def describe(report: query_plans.PlanReport) -> str:
+    return "\n".join(f"{scan.path}: SCAN {scan.table}: {scan.plan} {scan.statement}" for scan in report.full_scans)
+
+
+def test_hot_paths_use_indexes(dataset):
+    report = check(dataset)
+
+    assert report.statements > 0
+    assert not report.full_scans, describe(report)
+
+
+def test_a_lost_index_is_reported(dataset, tmp_path):
+    path = str(tmp_path / "no_index.db")
+    shutil.copy(dataset, path)
+    engine = create_db_engine(f"sqlite:///{path}")
+    with engine.begin() as connection:
+        # From sqlite_master: inspect() leaves out expression indexes
+        for name in connection.scalars(text(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'BookComments' AND sql IS NOT NULL"
+        )).all():
+            connection.exec_driver_sql(f'DROP INDEX "{name}"')
+    engine.dispose()
+
+    report = check(path)
+
+    assert "BookComments" in {scan.table for scan in report.full_scans}, describe(report)
@@ -0,0 +1,52 @@
+"""
+Rating totals (BookRatingStats) stay equal to the ratings, including when
+a book's first ratings arrive together.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from fastapi.testclient import TestClient
+from conftest import add_books, register
+from database import SessionLocal
+from models import BookRatingStats
+from ratings import find_rating_stats_drift, update_rating_stats
+
+
+def stats(book_id: int) -> tuple:
+    with SessionLocal() as db:
+        row = db.get(BookRatingStats, book_id)
+        return (row.rating_sum, row.rating_count) if row else None
+
+
+def test_first_ratings_in_one_transaction(app_client):
+    # The write-behind writer commits several users' ratings together
+    [book_id] = add_books(1)
+    with SessionLocal() as db:
+        update_rating_stats(db, book_id, 4, 1)
+        update_rating_stats(db, book_id, 2, 1)
+        update_rating_stats(db, book_id, 1, 0)
+        db.commit()
+
+    assert stats(book_id) == (7, 2)
+
+
+def test_concurrent_first_ratings(app_client):
+    [book_id] = add_books(1)
+    clients = [TestClient(app_client.app) for _ in range(8)]
+    for client in clients:
+        register(client)
+
+    def rate(pair):
+        client, stars = pair
+        return client.post(f"/api/books/{book_id}/rate", json={"stars": stars})
+
+    with ThreadPoolExecutor(max_workers=len(clients)) as pool:
+        responses = list(pool.map(rate, zip(clients, [1, 2, 3, 4, 5, 1, 2, 3])))
+
+    assert [response.status_code for response in responses] == [200] * 8, [response.text for response in responses]
+    assert stats(book_id) == (21, 8)
+
+    # Changing a rating moves the sum, not the count
+    assert rate((clients[0], 5)).status_code == 200
+    assert stats(book_id) == (25, 8)
+    with SessionLocal() as db:
+        assert [drift for drift in find_rating_stats_drift(db) if drift[0] == book_id] == []
@@ -0,0 +1,212 @@
+"""
+Both session stores behind ServerSessionMiddleware: login, /me from the
+UserResponse cached in the session, logout, and the old cookie refused.
+
+RedisSessionStore talks to a small in-process server speaking the Redis
+protocol (GET, SET EX and DEL are all the store uses), so no Redis is
+needed.
+"""
+
+import asyncio
+import json
+import socketserver
+import threading
+import time
+from contextlib import asynccontextmanager
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from itsdangerous import Signer
+from conftest import register
+from config import settings
+from database import SessionLocal
+from models import User
+from routes import auth_routes
+from sessions import MemorySessionStore, RedisSessionStore, ServerSessionMiddleware
+
+
+class FakeRedis(socketserver.ThreadingTCPServer):
+    """A Redis-protocol server keeping strings in a dict, recording each command."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _RedisHandler)
+        self.data = {}  # key -> (value, expires_at or None)
+        self.commands = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address
+        return f"redis://{host}:{port}/0"
+
+    def execute(self, command: list) -> bytes:
+        """Run one command and return the encoded reply."""
+        name = command[0].upper()
+        with self.lock:
+            self.commands.append([name, *command[1:]])
+            if name == b"GET":
+                value, expires_at = self.data.get(command[1], (None, None))
+                if value is None or (expires_at is not None and expires_at <= time.time()):
+                    return b"$-1\r\n"
+                return b"$%d\r\n%s\r\n" % (len(value), value)
+            if name == b"SET":
+                options = [option.upper() for option in command[3:]]
+                expires_at = time.time() + int(options[1]) if options[:1] == [b"EX"] else None
+                self.data[command[1]] = (command[2], expires_at)
+                return b"+OK\r\n"
+            if name == b"DEL":
+                return b":%d\r\n" % sum(self.data.pop(key, None) is not None for key in command[1:])
+        # redis-py's connection setup (CLIENT SETINFO) accepts an error
+        return b"-ERR unknown command\r\n"
+
+
+class _RedisHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        while True:
+            header = self.rfile.readline()
+            if not header:
+                return
+            assert header.startswith(b"*"), header
+            command = []
+            for _ in range(int(header[1:])):
+                length = int(self.rfile.readline()[1:])
+                command.append(self.rfile.read(length + 2)[:-2])
+            self.wfile.write(self.server.execute(command))
+
+
+@pytest.fixture
+def fake_redis():
+    server = FakeRedis()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=["memory", "redis"])
+def store(request):
+    if request.param == "memory":
+        return MemorySessionStore()
+    return RedisSessionStore(request.getfixturevalue("fake_redis").url)
+
+
+@pytest.fixture
+def session_client(app_client, store):
+    """A client for the auth routes, with sessions kept in `store`."""
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        yield
+        await store.close()
+
+    # app_client has created the database
+    app = FastAPI(lifespan=lifespan)
+    app.include_router(auth_routes.router)
+    app.add_middleware(
+        ServerSessionMiddleware,
+        store=store,
+        secret_key=settings.SECRET_KEY,
+        session_cookie=settings.SESSION_COOKIE_NAME,
+        max_age=settings.SESSION_MAX_AGE
+    )
+    with TestClient(app) as client:
+        yield client
+
+
+def session_id(client: TestClient) -> str:
+    """The session id in the client's (signed) session cookie."""
+    cookie = client.cookies[settings.SESSION_COOKIE_NAME]
+    return Signer(settings.SECRET_KEY).unsign(cookie).decode("utf-8")
+
+
+def test_login_me_logout(session_client):
+    user_id = register(session_client)
+    email = session_client.get("/api/auth/me").json()["email"]
+    session_client.post("/api/auth/logout")
+    assert session_client.get("/api/auth/me").status_code == 401
+
+    response = session_client.post("/api/auth/login", json={"email": email, "password": "password"})
+    assert response.status_code == 200, response.text
+    cookie = session_client.cookies[settings.SESSION_COOKIE_NAME]
+
+    # /me answers from the UserResponse cached at login, not the database
+    with SessionLocal() as db:
+        db.get(User, user_id).name = "Renamed Reader"
+        db.commit()
+    me = session_client.get("/api/auth/me")
+    assert me.status_code == 200
+    assert me.json()["name"] == "Test Reader"
+
+    assert session_client.post("/api/auth/logout").status_code == 200
+    assert settings.SESSION_COOKIE_NAME not in session_client.cookies
+
+    # The session was deleted from the store, so the old cookie is refused
+    session_client.cookies.set(settings.SESSION_COOKIE_NAME, cookie)
+    assert session_client.get("/api/auth/me").status_code == 401
+
+
+def test_login_rotates_session_id(session_client):
+    register(session_client)
+    email = session_client.get("/api/auth/me").json()["email"]
+    before = session_id(session_client)
+    before_cookie = session_client.cookies[settings.SESSION_COOKIE_NAME]
+
+    response = session_client.post("/api/auth/login", json={"email": email, "password": "password"})
+    assert response.status_code == 200, response.text
+    assert session_id(session_client) != before
+
+    # The id from before the login was deleted from the store
+    session_client.cookies.set(settings.SESSION_COOKIE_NAME, before_cookie)
+    assert session_client.get("/api/auth/me").status_code == 401
+
+
+@pytest.mark.parametrize("store", ["redis"], indirect=True)
+def test_redis_store_commands(fake_redis, session_client):
+    register(session_client)
+    key = b"bookclub:session:" + session_id(session_client).encode("utf-8")
+    # Register's own write outdates the user it cached; the first /me refreshes it
+    assert session_client.get("/api/auth/me").status_code == 200
+    fake_redis.commands.clear()
+
+    assert session_client.get("/api/auth/me").status_code == 200
+    assert session_client.post("/api/auth/logout").status_code == 200
+
+    assert fake_redis.commands == [[b"GET", key], [b"GET", key], [b"DEL", key]]
+    assert key not in fake_redis.data
+
+
+@pytest.mark.parametrize("store", ["redis"], indirect=True)
+def test_redis_store_sets_sessions_with_expiry(fake_redis, session_client):
+    register(session_client)
+    key = b"bookclub:session:" + session_id(session_client).encode("utf-8")
+
+    value, expires_at = fake_redis.data[key]
+    assert json.loads(value)["user_id"] is not None
+    assert [b"SET", key, value, b"EX", str(settings.SESSION_MAX_AGE).encode("ascii")] in fake_redis.commands
+    assert expires_at == pytest.approx(time.time() + settings.SESSION_MAX_AGE, abs=5)
+
+
+def test_memory_store_drops_least_recently_used():
+    async def run():
+        store = MemorySessionStore(max_entries=2)
+        await store.save("a", {"user_id": 1}, 60)
+        await store.save("b", {"user_id": 2}, 60)
+        assert await store.load("a") == {"user_id": 1}  # "b" is now the oldest
+        await store.save("c", {"user_id": 3}, 60)
+        return [await store.load(key) for key in ("a", "b", "c")]
+
+    assert asyncio.run(run()) == [{"user_id": 1}, None, {"user_id": 3}]
+
+
+def test_memory_store_expires_sessions():
+    async def run():
+        store = MemorySessionStore()
+        await store.save("a", {"user_id": 1}, 0)
+        return await store.load("a")
+
+    assert asyncio.run(run()) is None
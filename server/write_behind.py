@@ -0,0 +1,289 @@
+"""
+Write-behind queue for ratings, comments and group posts.
+
+With WRITE_BEHIND_ENABLED, these requests hand their write to one writer
+task per worker process instead of committing their own transaction.
+The writer takes everything that is waiting, up to WRITE_BEHIND_MAX_BATCH
+writes or WRITE_BEHIND_FLUSH_MS after the first one, and runs it as one
+transaction: the write lock is taken once and there is one commit (one
+fsync) for the whole batch instead of one per request. Each write runs
+in its own savepoint, so a write that fails is rolled back and reported
+to its request without losing the rest of the batch.
+
+WRITE_BEHIND_DURABILITY decides when the request is answered:
+
+- "commit": once the batch with the write has committed. The response
+  (including a 404 or 403) is the same as without the queue; only the
+  commit is shared.
+- "accepted": as soon as the request has checked the write (the book
+  exists, the user is a member, ...) and queued it, with 202 Accepted.
+  Queued writes are committed on shutdown, but are lost if the process
+  dies.
+  The author's reads in this process wait for their queued writes first
+  (wait_for_user); another worker doesn't know about them, so with
+  several workers use sticky sessions or "commit".
+
+The queue is bounded: when it is full, writes are shed with 503, like
+password hashing (auth.py), instead of piling up in memory.
+"""
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from fastapi import HTTPException, Request, status
+from config import settings
+from database import LAST_WRITE_KEY
+from json_response import FastJSONResponse
+from schemas import MessageResponse
+
+logger = logging.getLogger(__name__)
+
+DURABILITY_LEVELS = ("commit", "accepted")
+
+
+class PendingWrite:
+    """
+    One queued write: func(db, *args) adds its rows to the batch's
+    session (without committing) and returns the response.
+    """
+
+    def __init__(self, user_id: int, func: Callable[..., Any], args: tuple,
+                 on_commit: Optional[Callable[[Any], None]]):
+        self.user_id = user_id
+        self.func = func
+        self.args = args
+        self.on_commit = on_commit
+        self.future: "asyncio.Future[Any]" = asyncio.get_running_loop().create_future()
+
+
+def _write_batch(session_factory, batch: List[PendingWrite]) -> List[Tuple[Any, Optional[Exception]]]:
+    """
+    Run a batch of writes in one transaction, each in its own savepoint
+    (on the writer's thread).
+
+    Returns:
+        (result, None) or (None, error) for each write, in batch order
+    """
+    results: List[Tuple[Any, Optional[Exception]]] = []
+    with session_factory() as db:
+        if db.get_bind().dialect.name == "sqlite":
+            # Take the write lock up front; pysqlite would not start the
+            # transaction before the first savepoint on its own
+            db.connection().exec_driver_sql("BEGIN IMMEDIATE")
+
+        for write in batch:
+            try:
+                with db.begin_nested():
+                    results.append((write.func(db, *write.args), None))
+            except Exception as error:
+                results.append((None, error))
+
+        db.commit()
+    return results
+
+
+class WriteBehindQueue:
+    """
+    The bounded queue and the writer task that empties it.
+
+    Only used from the event loop thread. The batches run one at a time
+    on a thread of their own rather than in the threadpool, where the
+    requests waiting for them could take every thread.
+
+    Args:
+        max_size: Writes that may wait in the queue
+        max_batch: Writes committed together at most
+        flush_seconds: How long the writer waits for more writes after
+            the first one of a batch
+        durability: "commit" or "accepted" (see the module docstring)
+    """
+
+    def __init__(self, max_size: int, max_batch: int, flush_seconds: float, durability: str):
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"Unknown WRITE_BEHIND_DURABILITY '{durability}', expected one of {DURABILITY_LEVELS}")
+
+        self.max_size = max_size
+        self.max_batch = max_batch
+        self.flush_seconds = flush_seconds
+        self.durability = durability
+        # Set while the writer task runs; routes commit themselves otherwise
+        self.active = False
+        self._queue: Optional["asyncio.Queue[Optional[PendingWrite]]"] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # Futures of each user's writes that haven't committed yet
+        self._pending: Dict[int, Set["asyncio.Future[Any]"]] = {}
+        self.batches = 0
+        self.written = 0
+        self.failed = 0
+        self.rejected = 0
+
+    async def submit(self, request: Request, user_id: int, func: Callable[..., Any], *args,
+                     check: Optional[Callable[[], Awaitable[Any]]] = None,
+                     on_commit: Optional[Callable[[Any], None]] = None) -> Any:
+        """
+        Queue a write.
+
+        Args:
+            request: The request; its user reads from the primary for a
+                while afterwards, as after any write
+            user_id: Author of the write
+            func: Function taking a sync Session and *args that checks the
+                write, adds the rows without committing and returns the
+                response
+            *args: Further arguments for func
+            check: Run before an "accepted" write is queued, to raise the
+                errors func would (with "commit", func reports them)
+            on_commit: Called with func's result once the write has committed
+
+        Returns:
+            func's result ("commit"), or a 202 response ("accepted")
+
+        Raises:
+            HTTPException: 503 if the queue is full, or whatever check or
+                func raised
+        """
+        if self.durability == "accepted" and check is not None:
+            await check()
+
+        write = PendingWrite(user_id, func, args, on_commit)
+        try:
+            self._queue.put_nowait(write)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, please try again",
+                headers={"Retry-After": "1"}
+            )
+
+        self._pending.setdefault(user_id, set()).add(write.future)
+        request.session[LAST_WRITE_KEY] = time.time()
+
+        if self.durability == "accepted":
+            return FastJSONResponse(MessageResponse(message="Accepted"), status_code=status.HTTP_202_ACCEPTED)
+        return await write.future
+
+    async def wait_for_user(self, user_id: Optional[int]):
+        """Wait until the user's queued writes in this process have committed (or failed)."""
+        futures = self._pending.get(user_id) if user_id is not None else None
+        if futures:
+            await asyncio.wait(list(futures))
+
+    def start(self, session_factory) -> "asyncio.Task":
+        """
+        Start the writer task, which commits queued writes in batches
+        until stop() is called.
+
+        Args:
+            session_factory: Creates the (sync) sessions to write with
+
+        Returns:
+            The writer task
+        """
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="write-behind")
+        self.active = True
+        return asyncio.create_task(self._run(session_factory))
+
+    async def _run(self, session_factory):
+        try:
+            stopping = False
+            while not stopping:
+                batch, stopping = await self._collect()
+                if batch:
+                    await self._flush(session_factory, batch)
+        finally:
+            self.active = False
+            self._executor.shutdown(wait=False)
+
+    async def stop(self):
+        """Stop taking writes; the writer task commits the queued ones and ends."""
+        self.active = False
+        await self._queue.put(None)
+
+    async def _collect(self) -> Tuple[List[PendingWrite], bool]:
+        """Wait for the next batch; also returns whether stop() was called."""
+        write = await self._queue.get()
+        if write is None:
+            return [], True
+
+        batch = [write]
+        deadline = asyncio.get_running_loop().time() + self.flush_seconds
+        while len(batch) < self.max_batch:
+            try:
+                write = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    write = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if write is None:
+                return batch, True
+            batch.append(write)
+        return batch, False
+
+    async def _flush(self, session_factory, batch: List[PendingWrite]):
+        """Commit a batch and answer its requests."""
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self._executor, _write_batch, session_factory, batch
+            )
+        except Exception as error:
+            logger.exception("Committing a batch of %d queued writes failed", len(batch))
+            results = [(None, error)] * len(batch)
+
+        self.batches += 1
+        for write, (result, error) in zip(batch, results):
+            self._finish(write, result, error)
+
+    def _finish(self, write: PendingWrite, result: Any, error: Optional[Exception]):
+        futures = self._pending.get(write.user_id)
+        if futures is not None:
+            futures.discard(write.future)
+            if not futures:
+                del self._pending[write.user_id]
+
+        if error is None:
+            self.written += 1
+            if write.on_commit is not None:
+                write.on_commit(result)
+        else:
+            self.failed += 1
+            if self.durability == "accepted":
+                # The request has been answered; nobody else will see it
+                logger.warning("Queued write by user %s failed: %r", write.user_id, error)
+
+        # Done already if the client went away while waiting
+        if write.future.done():
+            return
+        if error is None or self.durability == "accepted":
+            write.future.set_result(result)
+        else:
+            write.future.set_exception(error)
+
+    def stats(self) -> dict:
+        """Counters for /health/writes."""
+        return {
+            "active": self.active,
+            "durability": self.durability,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "queue_size": self.max_size,
+            "batches": self.batches,
+            "written": self.written,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "average_batch": round((self.written + self.failed) / self.batches, 2) if self.batches else None,
+        }
+
+
+writer = WriteBehindQueue(
+    settings.WRITE_BEHIND_QUEUE_SIZE,
+    settings.WRITE_BEHIND_MAX_BATCH,
+    settings.WRITE_BEHIND_FLUSH_MS / 1000,
+    settings.WRITE_BEHIND_DURABILITY
+)